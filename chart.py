@@ -0,0 +1,97 @@
+"""
+The chart of the CKY parsers.
+"""
+
+from types import MappingProxyType
+from .util import irange
+
+_EMPTY_SPAN = MappingProxyType({})
+
+
+class Chart:
+    """
+    Maps (start, length, symbol) keys to entries, like a dict.
+
+    Entries are stored per span, in a dict per (start, length) that is only
+    created once something is derived over the span. Looking up a key never
+    creates anything, and the symbols of a span can be iterated without
+    looking at other spans.
+
+    start is 1-indexed, like everywhere in the parser.
+    """
+    def __init__(self, text_len):
+        self.text_len = text_len
+        # _spans[start][length], None for spans without entries
+        self._spans = [None] + [[None] * (text_len - start + 2)
+            for start in irange(1, text_len)]
+
+    def grow(self):
+        """Make room for the spans ending at one more word"""
+        self.text_len += 1
+        for start in irange(1, self.text_len - 1):
+            self._spans[start].append(None)
+        self._spans.append([None, None])
+
+    def span(self, start, length):
+        """Read-only mapping from the symbols derived over a span to their entries"""
+        if not (1 <= start <= self.text_len and 0 <= length <= self.text_len - start + 1):
+            return _EMPTY_SPAN
+        span = self._spans[start][length]
+        return _EMPTY_SPAN if span is None else span
+
+    def symbols(self, start, length):
+        return self.span(start, length).keys()
+
+    def get(self, key, default=None):
+        start, length, symbol = key
+        return self.span(start, length).get(symbol, default)
+
+    def __getitem__(self, key):
+        start, length, symbol = key
+        return self.span(start, length)[symbol]
+
+    def __contains__(self, key):
+        start, length, symbol = key
+        return symbol in self.span(start, length)
+
+    def __setitem__(self, key, entry):
+        start, length, symbol = key
+        if not (1 <= start and 1 <= length and start + length - 1 <= self.text_len):
+            raise KeyError(key)
+        spans = self._spans[start]
+        if spans[length] is None:
+            spans[length] = {}
+        spans[length][symbol] = entry
+
+    def __delitem__(self, key):
+        start, length, symbol = key
+        span = self._spans[start][length]
+        if span is None:
+            raise KeyError(key)
+        del span[symbol]
+
+    def spans(self):
+        """Yield the (start, length) of every span with entries"""
+        for start in irange(1, self.text_len):
+            for length, span in enumerate(self._spans[start]):
+                if span:
+                    yield start, length
+
+    def items(self):
+        for start, length in self.spans():
+            for symbol, entry in self._spans[start][length].items():
+                yield (start, length, symbol), entry
+
+    def __iter__(self):
+        for key, entry in self.items():
+            yield key
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for key, entry in self.items():
+            yield entry
+
+    def __len__(self):
+        return sum(len(self._spans[start][length]) for start, length in self.spans())
@@ -0,0 +1,67 @@
+from unittest import TestCase
+from .chart import *
+
+class TestChart(TestCase):
+    def setUp(self):
+        self.chart = Chart(3)
+        self.chart[1, 1, "A"] = "a"
+        self.chart[1, 3, "S"] = "s"
+        self.chart[2, 2, "B"] = "b"
+        self.chart[2, 2, "C"] = "c"
+
+    def test_get(self):
+        self.assertEqual(self.chart[2, 2, "B"], "b")
+        self.assertEqual(self.chart.get((2, 2, "B")), "b")
+        self.assertIsNone(self.chart.get((2, 2, "A")))
+        self.assertEqual(self.chart.get((3, 1, "A"), "default"), "default")
+        self.assertRaises(KeyError, lambda: self.chart[3, 1, "A"])
+
+    def test_lookups_dont_create_entries(self):
+        self.chart.get((3, 1, "A"))
+        (3, 1, "A") in self.chart
+        self.chart.span(2, 1)
+        self.chart.span(5, 7)
+        self.assertEqual(len(self.chart), 4)
+        self.assertEqual(set(self.chart.spans()), {(1, 1), (1, 3), (2, 2)})
+
+    def test_contains(self):
+        self.assertIn((1, 1, "A"), self.chart)
+        self.assertNotIn((1, 1, "B"), self.chart)
+        self.assertNotIn((0, 1, "A"), self.chart)
+
+    def test_symbols(self):
+        self.assertEqual(set(self.chart.symbols(2, 2)), {"B", "C"})
+        self.assertEqual(set(self.chart.symbols(3, 1)), set())
+
+    def test_iteration(self):
+        self.assertEqual(set(self.chart.keys()),
+            {(1, 1, "A"), (1, 3, "S"), (2, 2, "B"), (2, 2, "C")})
+        self.assertEqual(set(self.chart.values()), {"a", "b", "c", "s"})
+        self.assertEqual(dict(self.chart.items())[1, 3, "S"], "s")
+
+    def test_del(self):
+        del self.chart[2, 2, "B"]
+        self.assertEqual(set(self.chart.symbols(2, 2)), {"C"})
+        with self.assertRaises(KeyError):
+            del self.chart[3, 1, "A"]
+
+    def test_out_of_range(self):
+        with self.assertRaises(KeyError):
+            self.chart[3, 2, "A"] = "x"
+
+    def test_grow(self):
+        self.chart.grow()
+        self.assertEqual(self.chart.text_len, 4)
+        self.chart[1, 4, "S"] = "s4"
+        self.chart[4, 1, "D"] = "d"
+        self.assertEqual(self.chart[1, 4, "S"], "s4")
+        self.assertEqual(self.chart[2, 2, "C"], "c")
+        self.assertEqual(set(self.chart.symbols(4, 1)), {"D"})
+        with self.assertRaises(KeyError):
+            self.chart[4, 2, "A"] = "x"
+
+    def test_grow_empty(self):
+        chart = Chart(0)
+        chart.grow()
+        chart[1, 1, "A"] = "a"
+        self.assertEqual(list(chart.keys()), [(1, 1, "A")])
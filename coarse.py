@@ -0,0 +1,136 @@
+"""
+Coarse-to-fine parsing.
+
+The grammar is projected onto fewer, coarser symbols. The coarse grammar is
+parsed first, and only the fine symbols whose coarse projection has a high
+enough posterior probability over a span may be derived over it by the
+fine pass.
+"""
+
+from collections import defaultdict
+import numpy as np
+from .common import Grammar, Rule, PosTerminal, SplitTag
+from .dense import DenseGrammar
+from .posterior import inside_outside
+from .parser import _as_grammar, build_viterbi_chart, viterbi_tree, replace_leafs_by_words
+from .util import irange
+
+# All SplitTag intermediates of binarization project onto this symbol
+INTERMEDIATE = SplitTag(())
+
+def collapse_split_tags(symbol):
+    """Projection of every SplitTag onto INTERMEDIATE, other symbols stay"""
+    if isinstance(symbol, SplitTag):
+        return INTERMEDIATE
+    return symbol
+
+def family_projection(families):
+    """
+    Return a projection mapping symbols by the dict families and collapsing
+    SplitTags. Symbols not in families stay.
+    """
+    def projection(symbol):
+        if isinstance(symbol, SplitTag):
+            return INTERMEDIATE
+        return families.get(symbol, symbol)
+    return projection
+
+def first_letter_projection(symbol):
+    """Projection onto the first letter of a symbol, like NP, NN, NNS -> N"""
+    if isinstance(symbol, SplitTag):
+        return INTERMEDIATE
+    return symbol[0]
+
+
+def _project(projection, symbol):
+    # The root and POS terminals are never projected
+    if symbol == "S" or isinstance(symbol, PosTerminal):
+        return symbol
+    return projection(symbol)
+
+def project_grammar(grammar, projection):
+    """
+    Return the coarse Grammar of grammar under projection.
+
+    The probabilities of the fine rules of a fine left side that project to
+    the same coarse rule are summed, and the coarse rule gets the maximum
+    of these sums over its fine left sides. Unary rules projecting onto
+    A -> A are dropped.
+    """
+    sums = defaultdict(float)
+    for rule in _as_grammar(grammar).rules:
+        right_side = tuple(_project(projection, child) for child in rule.right_side)
+        sums[rule.left_side, right_side] += float(rule.probability)
+    coarse = {}
+    for (left_side, right_side), probability in sums.items():
+        key = _project(projection, left_side), right_side
+        if key[1] != (key[0],):
+            coarse[key] = max(coarse.get(key, 0), probability)
+    return Grammar(Rule(left_side, right_side, probability)
+        for (left_side, right_side), probability in coarse.items())
+
+
+class CoarseToFine:
+    """
+    A fine grammar together with its coarse projection.
+
+    Attributes:
+        grammar: the fine Grammar
+        coarse: the coarse grammar, as a dense.DenseGrammar
+        posterior_threshold: fine symbols may only be derived over spans on
+            which their projection has at least this posterior probability;
+            0 means no pruning
+    """
+    def __init__(self, grammar, projection=collapse_split_tags, posterior_threshold=1e-4):
+        self.grammar = _as_grammar(grammar)
+        self.projection = projection
+        self.posterior_threshold = posterior_threshold
+        self.coarse = DenseGrammar(project_grammar(self.grammar, projection))
+        # Fine symbols by coarse symbol id
+        fine = defaultdict(set)
+        for rule in self.grammar.rules:
+            for symbol in (rule.left_side,) + rule.right_side:
+                if not isinstance(symbol, PosTerminal):
+                    coarse_id = self.coarse.symbol_ids.get(_project(projection, symbol))
+                    if coarse_id is not None:
+                        fine[coarse_id].add(symbol)
+        self._fine_symbols = [frozenset(fine[i]) for i in range(self.coarse.num_symbols)]
+
+    def allowed_symbols(self, text):
+        """
+        Return a dict mapping (start, length) to the set of fine symbols
+        that survive coarse pruning, None if the coarse grammar has no parse.
+        """
+        result = inside_outside(self.coarse, text)
+        if result.log_z == -np.inf:
+            return None
+        if self.posterior_threshold > 0:
+            keep = result.posteriors >= np.log(self.posterior_threshold)
+        else:
+            keep = np.ones(result.posteriors.shape, dtype=bool)
+        ret = {}
+        for length in irange(1, len(text)):
+            for start in irange(1, len(text) - length + 1):
+                symbols = set()
+                for coarse_id in np.flatnonzero(keep[start, length]):
+                    symbols |= self._fine_symbols[coarse_id]
+                ret[start, length] = symbols
+        return ret
+
+    def parse_best(self, text, keep_posleafs=False, beam=None, threshold=None):
+        """
+        Like parser.parse_best, with the fine pass pruned by the coarse one.
+        Pruning can lose the only parses of a sentence; then this returns
+        None.
+        """
+        allowed = self.allowed_symbols(text)
+        if allowed is None:
+            return None
+        chart = build_viterbi_chart(self.grammar, text, beam, threshold,
+            lambda start, length: allowed[start, length])
+        if (1, len(text), "S") not in chart:
+            return None
+        tree = viterbi_tree(chart, 1, len(text), "S")
+        if not keep_posleafs:
+            replace_leafs_by_words(tree, text)
+        return tree, chart[1, len(text), "S"].score
@@ -0,0 +1,84 @@
+from unittest import TestCase, skipIf
+from .common import Rule, Grammar, SplitTag, PosTerminal
+from .parser import parse_best, build_viterbi_chart
+from .training import parse_treebank, extract_grammar
+from .testutil import grammar, pp_grammar, pp_sentence
+try:
+    import numpy
+    from .coarse import *
+except ImportError:
+    numpy = None
+
+TREEBANK = """
+( (S (NP (DT the) (JJ big) (NN dog)) (VP (VBZ barks)) (. .)) )
+( (S (NP (DT a) (NN cat)) (VP (VBZ sees) (NP (DT the) (JJ small) (NN dog))) (. .)) )
+"""
+
+@skipIf(numpy is None, "numpy is not installed")
+class TestProjectGrammar(TestCase):
+    def test_collapse_split_tags(self):
+        self.assertEqual(collapse_split_tags(SplitTag(("NP", "VP"))), INTERMEDIATE)
+        self.assertEqual(collapse_split_tags("NP"), "NP")
+
+    def test_family(self):
+        fine = Grammar({Rule("S", ("NP", "VP"), 1), Rule("NP", ("NN",), .4),
+            Rule("NP", ("NNS",), .6), Rule("VP", ("VB",), 1)})
+        coarse = project_grammar(fine, family_projection({"NN": "N", "NNS": "N"}))
+        self.assertEqual(set(coarse.rules), {Rule("S", ("NP", "VP"), 1),
+            Rule("NP", ("N",), 1), Rule("VP", ("VB",), 1)})
+
+    def test_unary_self_loops_dropped(self):
+        fine = Grammar({Rule("S", ("NP", "VP"), 1), Rule("NP", ("NNP",), .5),
+            Rule("NP", ("NN",), .5)})
+        coarse = project_grammar(fine, family_projection({"NNP": "NP", "NN": "NP"}))
+        self.assertEqual(set(coarse.rules), {Rule("S", ("NP", "VP"), 1)})
+
+
+@skipIf(numpy is None, "numpy is not installed")
+class TestCoarseToFine(TestCase):
+    def assertSameBest(self, grammar, text, **kwargs):
+        expected = parse_best(grammar, text)
+        found = CoarseToFine(grammar, **kwargs).parse_best(text)
+        self.assertEqual(found[0], expected[0])
+        self.assertAlmostEqual(found[1], expected[1])
+
+    def test_simple(self):
+        self.assertSameBest(grammar, [("she", "NP"), ("eats", "V"), ("a", "Det"), ("fish", "N")])
+
+    def test_ambiguous(self):
+        self.assertSameBest(pp_grammar, pp_sentence)
+
+    def test_split_tags(self):
+        fine = extract_grammar(parse_treebank(TREEBANK))
+        text = [("the", "DT"), ("small", "JJ"), ("cat", "NN"), ("sees", "VBZ"),
+            ("a", "DT"), ("big", "JJ"), ("dog", "NN"), (".", ".")]
+        self.assertSameBest(fine, text)
+        self.assertSameBest(fine, text, projection=first_letter_projection)
+
+    def test_prunes(self):
+        c2f = CoarseToFine(pp_grammar, posterior_threshold=.5)
+        allowed = c2f.allowed_symbols(pp_sentence)
+        pruned = build_viterbi_chart(pp_grammar, pp_sentence,
+            allowed=lambda start, length: allowed[start, length])
+        self.assertLess(len(pruned), len(build_viterbi_chart(pp_grammar, pp_sentence)))
+        self.assertSameBest(pp_grammar, pp_sentence, posterior_threshold=.5)
+
+    def test_improper_coarse_unaries(self):
+        # The coarse grammar has A -> B and B -> A, both with probability 1
+        fine = Grammar({Rule("S", ("A1",), .5), Rule("S", ("B2",), .5),
+            Rule("A1", ("B1",), 1), Rule("B2", ("A2",), 1),
+            Rule("B1", (PosTerminal("T"),), 1), Rule("A2", (PosTerminal("T"),), 1)})
+        projection = family_projection({"A1": "A", "A2": "A", "B1": "B", "B2": "B"})
+        self.assertSameBest(fine, [("t", "T")], projection=projection)
+
+    def test_no_pruning(self):
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            allowed = CoarseToFine(pp_grammar, posterior_threshold=0).allowed_symbols(pp_sentence)
+        chart = build_viterbi_chart(pp_grammar, pp_sentence)
+        for (start, length, symbol), entry in chart.items():
+            self.assertIn(symbol, allowed[start, length])
+
+    def test_no_parse(self):
+        self.assertIsNone(CoarseToFine(pp_grammar).parse_best([("fish", "N")]))
@@ -1,16 +1,27 @@
-from collections import deque
+import math
+import heapq
+import itertools
+import functools
+from collections import deque, defaultdict, namedtuple
 from .util import empty
 from . import log
 
 class AbstractTree:
+    # Treebanks have millions of nodes, see treebank.Treebank for even less
+    # memory per node
+    __slots__ = ("type_", "children", "_start", "_length")
+
     def __init__(self, type_, *children, start=None, length=None):
         if not all((hasattr(child, "children") and hasattr(child, "type_")) for child in children):
             raise TypeError
         self.type_ = type_
-        self.probability = Probability(1)
         self._start = start
         self._length = length
 
+    @property
+    def probability(self):
+        return _CERTAIN
+
     def __eq__(self, other):
         return tuple(self.children) == tuple(other.children) \
             and self.type_ == other.type_ #\
@@ -79,20 +90,36 @@ class AbstractTree:
 
     @log.log
     def debinarized_children(self):
-        if self.is_terminal:
-            yield self
-        else:
-            assert len(self.children) <= 2
-            for child in self.children:
+        """The children of the debinarized tree, with SplitTag nodes spliced in"""
+        assert len(self.children) <= 2
+        for child in self.children:
+            if isinstance(child.type_, SplitTag):
                 for from_ in child.debinarized_children():
                     yield from_
+            else:
+                yield child.debinarized()
 
 
     @log.log
     def debinarized(self):
         if isinstance(self.type_, SplitTag):
             log.warn("debinarized:debinarizing {} whose type_ is an instance of SplitTag", self)
-        return Tree(self.type_, *self.debinarized_children())
+        type_ = self.type_
+        if isinstance(type_, AnnotatedSymbol):
+            type_ = type_.symbol
+        return Tree(type_, *self.debinarized_children())
+
+    def bracketed(self):
+        """The tree on one line, in the bracket notation of the treebank"""
+        if empty(self.children):
+            return str(self.type_)
+        return "(" + str(self.type_) + " " \
+            + " ".join(child.bracketed() for child in self.children) + ")"
+
+    def copy(self):
+        """Deep copy of the tree structure, sharing only the symbols"""
+        return self.__class__(self.type_, *(child.copy() for child in self.children),
+            start=self._start, length=self._length)
 
     def is_equal_constituent(self, other):
         return self.type_ == other.type_ and \
@@ -101,6 +128,8 @@ class AbstractTree:
 
 
 class Tree(AbstractTree):
+    __slots__ = ()
+
     def __init__(self, type_, *children, **kwargs):
         super().__init__(type_, *children, **kwargs)
         self.children = list(children)
@@ -110,17 +139,80 @@ class Tree(AbstractTree):
 
 
 class HashableTree(AbstractTree):
+    """
+    An immutable tree. The hash is computed once, on first use, so the tree
+    must not be changed after it was hashed.
+    """
+    __slots__ = ("_hash",)
+
     def __init__(self, type_, *children, **kwargs):
         super().__init__(type_, *children, **kwargs)
         self.children = tuple(children)
+        self._hash = None
 
     def __hash__(self):
-        return hash(self.children) * 7 + hash(self.type_) * 13
+        if self._hash is None:
+            self._hash = hash(self.children) * 7 + hash(self.type_) * 13
+        return self._hash
 
     def hashable(self):
         return self
 
 
+class InternedTree(HashableTree):
+    """
+    A HashableTree built by a TreeFactory. Structurally equal trees over
+    the same span built by the same factory are the same object, so
+    comparing them is an identity check.
+    """
+    __slots__ = ("_factory",)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, InternedTree) and other._factory is self._factory \
+                and other._start == self._start and other._length == self._length:
+            return False
+        return super().__eq__(other)
+
+    __hash__ = HashableTree.__hash__
+
+    def copy(self):
+        """A copy made of HashableTrees, which can be changed before hashing"""
+        return HashableTree(self.type_, *(child.copy() for child in self.children),
+            start=self._start, length=self._length)
+
+
+class TreeFactory:
+    """
+    Hash-consing constructor of trees: called like HashableTree, it returns
+    the InternedTree built before for the same type_, children and span if
+    there is one, so every distinct subtree exists once.
+
+    Children should be InternedTrees of the same factory; looking them up
+    is then constant time.
+    """
+    def __init__(self):
+        self._trees = {}
+
+    def __call__(self, type_, *children, start=None, length=None):
+        key = (type_, children, start, length)
+        tree = self._trees.get(key)
+        if tree is None:
+            tree = InternedTree(type_, *children, start=start, length=length)
+            tree._factory = self
+            self._trees[key] = tree
+        return tree
+
+    def intern(self, tree):
+        """The interned version of any tree, like those of a treebank"""
+        return self(tree.type_, *(self.intern(child) for child in tree.children),
+            start=tree._start, length=tree._length)
+
+    def __len__(self):
+        return len(self._trees)
+
+
 
 
 
@@ -170,25 +262,62 @@ class Rule:
             repr(self.right_side), repr(self.probability))
 
 class SplitTag:
-    def __init__(self, members):
+    """
+    The symbol of an intermediate node created by binarization.
+
+    members -- the remaining right side of the rule that was split, or with
+        horizontal Markovization the last siblings already generated
+    parent -- with horizontal Markovization, the left side of the rule that
+        was split, None otherwise
+    """
+    def __init__(self, members, parent=None):
         self._members = tuple(members)
+        self._parent = parent
 
     def __eq__(self, other):
-        return self._members == other._members
+        return isinstance(other, SplitTag) and self._members == other._members \
+            and self._parent == other._parent
 
     def __hash__(self):
-        return hash(self._members)
+        return hash(self._members) + 31 * hash(self._parent)
 
     def __repr__(self):
-        return "SplitTag (" + repr(self._members) + ")"
+        if self._parent is None:
+            return "SplitTag (" + repr(self._members) + ")"
+        return "SplitTag (" + repr(self._members) + ", parent=" + repr(self._parent) + ")"
+
+
+class AnnotatedSymbol(namedtuple("AnnotatedSymbol", "symbol ancestors")):
+    """
+    A symbol annotated with the symbols of its closest ancestors, parent
+    first, for vertical Markovization. Debinarized trees drop the
+    annotation.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "^".join(str(symbol) for symbol in (self.symbol,) + self.ancestors)
 
+@functools.total_ordering
 class Probability:
     """
     Whenever I need to store a probability, I use this class instead of a float.
     That way I can easily replace how I store them.
+
+    Probabilities multiply and add in log space, so products of many of
+    them don't underflow.
     """
     def __init__(self, prob):
         self._prob = float(prob)
+        self._log = math.log(self._prob) if self._prob > 0 else -math.inf
+
+    @classmethod
+    def from_log(cls, log):
+        """The Probability whose natural logarithm is log"""
+        ret = cls.__new__(cls)
+        ret._log = log
+        ret._prob = math.exp(log)
+        return ret
 
     def __repr__(self):
         return "Probability(" + repr(self._prob) + ")"
@@ -196,9 +325,35 @@ class Probability:
     def __eq__(self, other):
         return self._prob == other._prob
 
+    def __hash__(self):
+        return hash(self._prob)
+
+    def __lt__(self, other):
+        return self._log < other._log
+
+    def __mul__(self, other):
+        if not isinstance(other, Probability):
+            return NotImplemented
+        return Probability.from_log(self._log + other._log)
+
+    def __add__(self, other):
+        if not isinstance(other, Probability):
+            return NotImplemented
+        high, low = max(self._log, other._log), min(self._log, other._log)
+        if low == -math.inf:
+            return Probability.from_log(high)
+        return Probability.from_log(high + math.log1p(math.exp(low - high)))
+
     def __float__(self):
         return self._prob
 
+    def log(self):
+        """Natural logarithm of the probability, -inf for 0"""
+        return self._log
+
+# The probability of every tree node, shared between all of them
+_CERTAIN = Probability(1)
+
 
 class Terminal:
     """
@@ -224,17 +379,237 @@ class PosTerminal(Terminal):
     def __repr__(self):
         return "PosTerminal(" + self._postag + ")"
 
+    def __str__(self):
+        return self._postag
+
+class UnaryChain(namedtuple("UnaryChain", "top bottom rules log_probability")):
+    """
+    The most probable derivation top =>+ bottom using only unary rules.
+
+    rules -- the rules of the derivation, starting with the one for top
+    log_probability -- sum of the log probabilities of the rules
+    """
+    __slots__ = ()
+
+    def wrap(self, tree, start=None, length=None, factory=HashableTree):
+        """
+        Put tree, whose type_ is bottom, below the nodes created by the
+        rules. factory builds the nodes, like HashableTree or a TreeFactory.
+        """
+        for rule in reversed(self.rules):
+            tree = factory(rule.left_side, tree, start=start, length=length)
+        return tree
+
+class UnarySum(namedtuple("UnarySum", "top bottom probability")):
+    """
+    All derivations top =>+ bottom using only unary rules, including the
+    ones going around cycles.
+
+    probability -- their summed Probability
+    """
+    __slots__ = ()
+
+def _max_into(scores, symbol, score):
+    if scores.get(symbol, -math.inf) < score:
+        scores[symbol] = score
+
+
+def _unary_series(unary):
+    """
+    dense.unary_series without numpy, for a unary rule matrix as a list of
+    rows: Gauss-Jordan elimination on [I - U | I].
+    """
+    size = len(unary)
+    rows = [[float(i == j) - unary[i][j] for j in range(size)]
+        + [float(i == j) for j in range(size)] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            raise ValueError("The unary rules have no finite summed probability")
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        pivot_row = rows[column]
+        factor = pivot_row[column]
+        for j in range(column, 2 * size):
+            pivot_row[j] /= factor
+        for i, row in enumerate(rows):
+            factor = row[column]
+            if i != column and factor != 0:
+                for j in range(column, 2 * size):
+                    row[j] -= factor * pivot_row[j]
+    if any(total < -1e-9 for row in rows for total in row[size:]):
+        raise ValueError("The unary rules have no finite summed probability")
+    return [[max(total - (i == j), 0.0) for j, total in enumerate(row[size:])]
+        for i, row in enumerate(rows)]
+
+
 class Grammar:
+    """
+    A set of rules together with indexes that make the lookups done by the
+    parser constant time. The indexes are built once, on construction.
+    """
     def __init__(self, grammar):
         self.rules = frozenset(grammar)
+        self._build_indexes()
+
+    def _build_indexes(self):
+        by_arity = defaultdict(list)
+        binary_by_children = defaultdict(list)
+        binary_by_left = defaultdict(list)
+        unary_by_child = defaultdict(list)
+        lexicon = defaultdict(list)
+        for rule in self.rules:
+            by_arity[len(rule.right_side)].append(rule)
+            if len(rule.right_side) == 2:
+                binary_by_children[rule.right_side].append(rule)
+                binary_by_left[rule.right_side[0]].append(rule)
+            elif len(rule.right_side) == 1:
+                child = rule.right_side[0]
+                if isinstance(child, PosTerminal):
+                    lexicon[child].append(rule)
+                else:
+                    unary_by_child[child].append(rule)
+        freeze = lambda index: {key: tuple(value) for key, value in index.items()}
+        self._rules_by_arity = freeze(by_arity)
+        self._binary_by_children = freeze(binary_by_children)
+        self._binary_by_left = freeze(binary_by_left)
+        self._unary_by_child = freeze(unary_by_child)
+        self._lexicon = freeze(lexicon)
+        self._nonterminal_symbols = frozenset(rule.left_side for rule in self.rules)
+        self._unary_closure = {child: self._best_unary_chains(child)
+            for child in self._unary_by_child}
+        # Computed on demand by outside_estimates, unary_sums_for and
+        # binary_rules_with_right
+        self._inside_estimates = [{}]
+        self._outside_estimates = {}
+        self._unary_sums = None
+        self._binary_by_right = None
+
+    def _best_unary_chains(self, bottom):
+        """
+        Dijkstra from bottom upwards through the unary rules. Rule
+        probabilities are <= 1, so cycles never make a chain more probable
+        and every symbol is settled once.
+        """
+        ret = []
+        settled = {bottom}
+        counter = itertools.count()
+        # Entries are (cost, tie breakers, symbol, rules bottom-up)
+        agenda = [(0.0, "", next(counter), bottom, ())]
+        while not empty(agenda):
+            cost, _, _, symbol, rules = heapq.heappop(agenda)
+            if not empty(rules):
+                if symbol in settled:
+                    continue
+                settled.add(symbol)
+                ret.append(UnaryChain(symbol, bottom, tuple(reversed(rules)), -cost))
+            for rule in self._unary_by_child.get(symbol, ()):
+                if rule.left_side not in settled:
+                    heapq.heappush(agenda, (cost - rule.probability.log(),
+                        repr(rule.left_side), next(counter), rule.left_side, rules + (rule,)))
+        return tuple(ret)
+
+    def __setstate__(self, state):
+        # The indexes and the estimates computed so far are pickled along
+        # with the rules, so workers don't build them again. Grammars pickled
+        # before the indexes existed only have their rules.
+        self.__dict__.update(state)
+        if "_rules_by_arity" not in state:
+            self.rules = frozenset(self.rules)
+            self._build_indexes()
+
+    def _max_over_chains(self, scores):
+        """Update scores, by symbol, with the unary chains on top of them"""
+        for bottom, score in tuple(scores.items()):
+            for chain in self.unary_chains_for(bottom):
+                _max_into(scores, chain.top, score + chain.log_probability)
+
+    def _extend_inside_estimates(self, max_length):
+        """
+        _inside_estimates[length][symbol] is the log probability of the best
+        derivation of symbol over length words with any POS tags.
+        """
+        estimates = self._inside_estimates
+        for length in range(len(estimates), max_length + 1):
+            scores = {}
+            if length == 1:
+                for rules in self._lexicon.values():
+                    for rule in rules:
+                        _max_into(scores, rule.left_side, rule.probability.log())
+            for rule in self.binary_rules:
+                left, right = rule.right_side
+                for partition in range(1, length):
+                    left_score = estimates[partition].get(left)
+                    right_score = estimates[length - partition].get(right)
+                    if left_score is not None and right_score is not None:
+                        _max_into(scores, rule.left_side,
+                            left_score + right_score + rule.probability.log())
+            self._max_over_chains(scores)
+            estimates.append(scores)
+
+    def outside_estimates(self, max_length):
+        """
+        Admissible outside estimates for sentences of up to max_length words,
+        as a dict mapping (left, right) to a dict from symbols to log
+        probabilities. left and right are the numbers of words before and
+        after a span; the estimate is the log probability of the best
+        derivation of "S" around the span over any words with any POS tags,
+        so it is never below the actual outside score of the span (Klein and
+        Manning 2003, the SX estimate). Symbols missing from the dict can't
+        be part of a parse.
+
+        The estimates don't depend on the sentence, so they are computed
+        once and kept with the grammar, growing when a longer sentence
+        comes in.
+        """
+        estimates = self._outside_estimates
+        if (max_length - 1, 0) in estimates or max_length < 1:
+            return estimates
+        self._extend_inside_estimates(max_length)
+        inside = self._inside_estimates
+        closure = self._unary_closure
+        by_parent = defaultdict(list)
+        for rule in self.binary_rules:
+            by_parent[rule.left_side].append(rule.right_side + (rule.probability.log(),))
+        # Every context is built from the contexts of its parents, which
+        # have fewer words, so contexts are done in order of their number of
+        # words. The ones done for shorter sentences are kept.
+        for context in range(max_length):
+            if (context, 0) in estimates:
+                continue
+            for left in range(context + 1):
+                right = context - left
+                scores = {"S": 0.0} if context == 0 else {}
+                # Left children, with sibling words to their right
+                for sibling in range(1, right + 1):
+                    siblings = inside[sibling]
+                    for parent, parent_score in estimates[left, right - sibling].items():
+                        for left_child, right_child, log_probability in by_parent.get(parent, ()):
+                            right_score = siblings.get(right_child)
+                            if right_score is not None:
+                                _max_into(scores, left_child,
+                                    parent_score + log_probability + right_score)
+                # Right children, with sibling words to their left
+                for sibling in range(1, left + 1):
+                    siblings = inside[sibling]
+                    for parent, parent_score in estimates[left - sibling, right].items():
+                        for left_child, right_child, log_probability in by_parent.get(parent, ()):
+                            left_score = siblings.get(left_child)
+                            if left_score is not None:
+                                _max_into(scores, right_child,
+                                    parent_score + log_probability + left_score)
+                # The bottom of a unary chain has the context of its top
+                for bottom, chains in closure.items():
+                    for chain in chains:
+                        if chain.top in scores:
+                            _max_into(scores, bottom, scores[chain.top] + chain.log_probability)
+                estimates[left, right] = scores
+        return estimates
 
     def __iter__(self):
         return iter(self.rules)
 
     def _nnary_rules(self, n):
-        for rule in self.rules:
-            if len(rule.right_side) == n:
-                yield rule
+        return iter(self._rules_by_arity.get(n, ()))
 
     @property
     def unary_rules(self):
@@ -246,21 +621,89 @@ class Grammar:
 
     @property
     def nonterminal_symbols(self):
-        for rule in self.rules:
-            yield rule.left_side
+        return self._nonterminal_symbols
 
     @property
     def terminal_rules(self):
         for rule in self.unary_rules:
-            if rule.right_side[0] not in self.nonterminal_symbols:
+            if rule.right_side[0] not in self._nonterminal_symbols:
                 yield rule
 
     @property
     def nonterminal_rules(self):
+        terminal_rules = frozenset(self.terminal_rules)
         for rule in self.rules:
-            if rule not in self.terminal_rules:
+            if rule not in terminal_rules:
                 yield rule
 
+    def binary_rules_for(self, left, right):
+        """Binary rules whose right side is (left, right)"""
+        return self._binary_by_children.get((left, right), ())
+
+    def binary_rules_with_left(self, left):
+        """Binary rules whose right side starts with left"""
+        return self._binary_by_left.get(left, ())
+
+    def binary_rules_with_right(self, right):
+        """Binary rules whose right side ends with right"""
+        if self._binary_by_right is None:
+            index = defaultdict(list)
+            for rule in self.binary_rules:
+                index[rule.right_side[1]].append(rule)
+            self._binary_by_right = {key: tuple(value) for key, value in index.items()}
+        return self._binary_by_right.get(right, ())
+
+    def unary_rules_for(self, child):
+        """Unary rules whose right side is the nonterminal child"""
+        return self._unary_by_child.get(child, ())
+
+    def unary_chains_for(self, child):
+        """
+        The transitive closure of the unary rules: for every symbol that
+        derives the nonterminal child through one or more unary rules, the
+        most probable such derivation as a UnaryChain. Most probable first.
+        """
+        return self._unary_closure.get(child, ())
+
+    def unary_sums_for(self, child):
+        """
+        Like unary_chains_for, but summing over all unary derivations instead
+        of taking the best one, as a UnarySum for every symbol that derives
+        the nonterminal child, which may be child itself through a cycle.
+        """
+        if self._unary_sums is None:
+            self._unary_sums = self._compute_unary_sums()
+        return self._unary_sums.get(child, ())
+
+    def _compute_unary_sums(self):
+        """
+        Raises ValueError if the summed probabilities don't converge, see
+        dense.unary_series.
+        """
+        rules = [rule for rule in self.unary_rules if not isinstance(rule.right_side[0], PosTerminal)]
+        symbols = sorted({rule.left_side for rule in rules} | {rule.right_side[0] for rule in rules},
+            key=repr)
+        ids = {symbol: i for i, symbol in enumerate(symbols)}
+        unary = [[0.0] * len(symbols) for _ in symbols]
+        for rule in rules:
+            unary[ids[rule.left_side]][ids[rule.right_side[0]]] += float(rule.probability)
+        try:
+            from .dense import unary_series
+        except ImportError:
+            sums = _unary_series(unary)
+        else:
+            sums = unary_series(unary).tolist()
+        ret = defaultdict(list)
+        for top, row in zip(symbols, sums):
+            for bottom, total in zip(symbols, row):
+                if total > 1e-12:
+                    ret[bottom].append(UnarySum(top, bottom, Probability(total)))
+        return {bottom: tuple(sums) for bottom, sums in ret.items()}
+
+    def lexical_rules_for(self, posterminal):
+        """Unary rules whose right side is the PosTerminal posterminal"""
+        return self._lexicon.get(posterminal, ())
+
     def __repr__(self):
         return "Grammar(" + "\n".join((repr(x) for x in self.rules)) + ")"
 
@@ -272,7 +715,45 @@ class Grammar:
             for split_rule in rule.split():
                 yield split_rule
 
-    def binarized(self):
-        return Grammar(self._binarized_rules())
+    def binarized(self, horizontal=None):
+        """
+        Return an equivalent Grammar with at most two symbols on every right
+        side, splitting longer rules with SplitTag intermediate symbols.
+
+        horizontal -- if None, an intermediate symbol stands for the rest
+            of the right side of the rule it came from. Otherwise it only
+            remembers the left side of the rule and the last horizontal
+            siblings generated before it (horizontal Markovization), so long
+            rules share intermediate symbols. The probabilities of the rules
+            of an intermediate symbol are the shares of the probability of
+            the split rules going through it.
+        """
+        if horizontal is None:
+            return Grammar(self._binarized_rules())
+        mass = defaultdict(float)
+        through = defaultdict(float)
+        rules = []
+        for rule in self.rules:
+            right_side = rule.right_side
+            if len(right_side) <= 2:
+                rules.append(rule)
+                continue
+            probability = float(rule.probability)
+            # states[k] generates right_side[k:]
+            states = [None] + [SplitTag(right_side[max(0, k - horizontal):k], rule.left_side)
+                for k in range(1, len(right_side) - 1)]
+            mass[rule.left_side, (right_side[0], states[1])] += probability
+            for k in range(1, len(right_side) - 1):
+                if k < len(right_side) - 2:
+                    children = (right_side[k], states[k + 1])
+                else:
+                    children = right_side[k:]
+                mass[states[k], children] += probability
+                through[states[k]] += probability
+        for (left_side, right_side), probability in mass.items():
+            if through.get(left_side):
+                probability /= through[left_side]
+            rules.append(Rule(left_side, right_side, probability))
+        return Grammar(rules)
 
 
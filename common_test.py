@@ -5,6 +5,9 @@ from .common import *
 from .util import empty, ilen
 from .testutil import POSTREE, unary_grammar, grammar, unary_grammar2, tree
 from . import log
+import math
+import pickle
+import copyreg
 
 class TestHashableTree(TestCase):
     def test_hashable_children(self):
@@ -48,6 +51,46 @@ class TestHashableTree(TestCase):
         tree2 = Tree("A", childa2, childb2)
         self.assertEqual(tree1, tree2)
 
+    def test_hash_cached(self):
+        htree = POSTREE.hashable()
+        self.assertEqual(hash(htree), hash(htree))
+        self.assertIsNotNone(htree._hash)
+        self.assertEqual(hash(htree), hash(POSTREE.hashable()))
+
+
+class TestTreeFactory(TestCase):
+    def setUp(self):
+        self.factory = TreeFactory()
+
+    def np(self, start=None):
+        make = self.factory
+        return make("NP", make("Det", make("a"), start=start), make("N", make("fish")), start=start)
+
+    def test_shared(self):
+        self.assertIs(self.np(), self.np())
+        self.assertEqual(len(self.factory), 5)
+        self.assertIsNot(self.np(), self.np(1))
+
+    def test_eq(self):
+        expected = HashableTree("NP", HashableTree("Det", HashableTree("a")),
+            HashableTree("N", HashableTree("fish")))
+        self.assertEqual(self.np(), expected)
+        self.assertEqual(expected, self.np())
+        self.assertEqual(hash(self.np()), hash(expected))
+        self.assertNotEqual(self.np(), self.factory("NP"))
+        # Different spans, compared like HashableTree
+        self.assertEqual(self.np(), self.np(1))
+        self.assertEqual(self.np(), TreeFactory().intern(expected))
+
+    def test_intern(self):
+        interned = self.factory.intern(POSTREE)
+        self.assertEqual(interned, POSTREE)
+        self.assertIs(self.factory.intern(POSTREE.hashable()), interned)
+
+    def test_copy(self):
+        copy = self.np().copy()
+        self.assertNotIsInstance(copy, InternedTree)
+        self.assertEqual(copy, self.np())
 
 
 class TestRule(TestCase):
@@ -114,6 +157,23 @@ class TestTree(TestCase):
         expected = tree("A", "B", "C", "D", "E")
         self.assertEqual(self.data.debinarized(), expected)
 
+    def test_debinarized_nested(self):
+        binarized = Tree("S",
+            Tree("NP", Tree(PosTerminal("NP"))),
+            Tree(SplitTag(["VP", "."]),
+                Tree("VP", Tree("V", Tree(PosTerminal("V"))), Tree("NP", Tree(PosTerminal("NP")))),
+                Tree(".", Tree(PosTerminal(".")))
+            )
+        )
+        expected = tree("S", tree("NP", "NP"), tree("VP", tree("V", "V"), tree("NP", "NP")),
+            tree(".", "."))
+        self.assertEqual(binarized.debinarized(), expected)
+
+    def test_bracketed(self):
+        self.assertEqual(tree("S", tree("NP", "NP"), tree("V", "V")).bracketed(),
+            "(S (NP NP) (V V))")
+        self.assertEqual(Tree("A", Tree("a")).bracketed(), "(A a)")
+
     def test_wrong_argument(self):
         class NotTree1:
             children = []
@@ -198,6 +258,39 @@ class TestGrammar(TestCase):
             Rule("Det", (PosTerminal("Det"),))
         })
 
+    def test_binarize_markovized(self):
+        g = Grammar({
+            Rule("A", ("B", "C", "D", "E"), 0.5),
+            Rule("A", ("B", "C", "F"), 0.5)})
+        after_b = SplitTag(("B",), "A")
+        after_c = SplitTag(("C",), "A")
+        self.assertEqual(set(g.binarized(horizontal=1).rules), {
+            Rule("A", ("B", after_b), 1),
+            Rule(after_b, ("C", after_c), 0.5),
+            Rule(after_b, ("C", "F"), 0.5),
+            Rule(after_c, ("D", "E"), 1)})
+        intermediate = SplitTag((), "A")
+        rules = {(rule.left_side, rule.right_side): float(rule.probability)
+            for rule in g.binarized(horizontal=0).rules}
+        self.assertEqual(set(rules), {("A", ("B", intermediate)), (intermediate, ("C", intermediate)),
+            (intermediate, ("C", "F")), (intermediate, ("D", "E"))})
+        self.assertAlmostEqual(rules[intermediate, ("C", intermediate)], 1 / 3)
+
+    def test_binarize_markovized_debinarized(self):
+        g = Grammar({Rule("S", ("A", "B", "C"))} |
+            {Rule(symbol, (PosTerminal(symbol),)) for symbol in "ABC"})
+        from .parser import parse_best
+        tree, score = parse_best(g.binarized(horizontal=0), [(symbol, symbol) for symbol in "ABC"],
+            keep_posleafs=True)
+        self.assertEqual(tree.debinarized(),
+            Tree("S", *(Tree(symbol, Tree(PosTerminal(symbol))) for symbol in "ABC")))
+
+    def test_annotated_symbol(self):
+        symbol = AnnotatedSymbol("NP", ("VP", "S"))
+        self.assertEqual(str(symbol), "NP^VP^S")
+        tree = Tree(symbol, Tree("NN", Tree(PosTerminal("NN"))))
+        self.assertEqual(tree.debinarized().type_, "NP")
+
     def test_binarize(self):
         g = Grammar({
             Rule("A", ("B", "C", "D")),
@@ -208,6 +301,48 @@ class TestGrammar(TestCase):
             Rule("B", ("x", "y"))})
         self.assertEqual(g.binarized(), expected)
 
+    def test_binary_rules_for(self):
+        self.assertEqual(set(self.g.binary_rules_for("V", "NP")),
+            {Rule("VP", ("V", "NP"))})
+        self.assertEqual(set(self.g.binary_rules_for("NP", "V")), set())
+
+    def test_binary_rules_with_left(self):
+        self.assertEqual(set(self.g.binary_rules_with_left("VP")),
+            {Rule("VP", ("VP", "PP"))})
+
+    def test_binary_rules_with_right(self):
+        self.assertEqual(set(self.g.binary_rules_with_right("PP")),
+            {Rule("VP", ("VP", "PP"))})
+        self.assertEqual(set(self.g.binary_rules_with_right("V")), set())
+
+    def test_lexical_rules_for(self):
+        self.assertEqual(set(self.g.lexical_rules_for(PosTerminal("NP"))),
+            {Rule("NP", (PosTerminal("NP"),))})
+        self.assertEqual(set(self.g.lexical_rules_for(PosTerminal("X"))), set())
+
+    def test_pickle(self):
+        self.g.outside_estimates(4)
+        copy = pickle.loads(pickle.dumps(self.g))
+        self.assertEqual(copy.rules, self.g.rules)
+        self.assertEqual(set(copy.lexical_rules_for(PosTerminal("NP"))),
+            {Rule("NP", (PosTerminal("NP"),))})
+        # The indexes and estimates are pickled, not built again
+        self.assertEqual(copy._unary_closure, self.g._unary_closure)
+        self.assertEqual(copy._outside_estimates, self.g.outside_estimates(4))
+
+    def test_unpickle_baseline(self):
+        # Grammars used to be pickled with only their rules in the state
+        rules = self.g.rules
+        class Baseline:
+            def __reduce__(self):
+                return (copyreg._reconstructor, (Grammar, object, None), {"rules": rules})
+        copy = pickle.loads(pickle.dumps(Baseline()))
+        self.assertIsInstance(copy, Grammar)
+        self.assertEqual(set(copy.binary_rules_with_left("VP")),
+            {Rule("VP", ("VP", "PP"))})
+        self.assertEqual(set(copy.lexical_rules_for(PosTerminal("NP"))),
+            {Rule("NP", (PosTerminal("NP"),))})
+
 class TestGrammarUnary(TestCase):
     def setUp(self):
         self.g = Grammar(unary_grammar)
@@ -224,6 +359,56 @@ class TestGrammarUnary(TestCase):
         self.assertEqual(set(self.g.binary_rules),
         {Rule("S", ("NP", "VP"))})
 
+    def test_unary_rules_for(self):
+        self.assertEqual(set(self.g.unary_rules_for("V")), {Rule("VP", ["V"])})
+        self.assertEqual(set(self.g.unary_rules_for(PosTerminal("V"))), set())
+
+    def test_unary_chains_for(self):
+        self.assertEqual(self.g.unary_chains_for("V"),
+            (UnaryChain("VP", "V", (Rule("VP", ["V"]),), 0.0),))
+        self.assertEqual(self.g.unary_chains_for("VP"), ())
+
+    def test_unary_chains_transitive(self):
+        g = Grammar({
+            Rule("A", ["B"], probability=0.5),
+            Rule("B", ["C"], probability=0.5),
+            Rule("A", ["C"], probability=0.1),
+            Rule("C", ["A"], probability=0.5)
+        })
+        chains = {chain.top: chain for chain in g.unary_chains_for("C")}
+        self.assertEqual(set(chains), {"A", "B"})
+        self.assertEqual(chains["A"].rules, (Rule("A", ["B"], 0.5), Rule("B", ["C"], 0.5)))
+        self.assertAlmostEqual(chains["A"].log_probability, math.log(0.25))
+        self.assertEqual([chain.top for chain in g.unary_chains_for("A")], ["C", "B"])
+
+    def test_unary_sums_for(self):
+        g = Grammar({Rule("A", ["B"], 0.5), Rule("B", ["A"], 0.5), Rule("C", ["A"], 1)})
+        sums = {unary_sum.top: float(unary_sum.probability) for unary_sum in g.unary_sums_for("B")}
+        # A =>+ B through any number of cycles B => A => B
+        self.assertEqual(set(sums), {"A", "B", "C"})
+        self.assertAlmostEqual(sums["A"], 0.5 / 0.75)
+        self.assertAlmostEqual(sums["B"], 0.25 / 0.75)
+        self.assertAlmostEqual(sums["C"], 0.5 / 0.75)
+        self.assertEqual(g.unary_sums_for("C"), ())
+
+    def test_unary_sums_diverge(self):
+        for rules in [{Rule("A", ["B"], 1), Rule("B", ["A"], 1)},
+                {Rule("A", ["B"], 1), Rule("B", ["A"], 1), Rule("A", ["A"], 0.5)}]:
+            with self.assertRaises(ValueError):
+                Grammar(rules).unary_sums_for("A")
+
+    def test_unary_series_without_numpy(self):
+        from .common import _unary_series
+        # The matrix of test_unary_sums_for, over A, B, C
+        sums = _unary_series([[0, 0.5, 0], [0.5, 0, 0], [1, 0, 0]])
+        expected = [[0.25 / 0.75, 0.5 / 0.75, 0], [0.5 / 0.75, 0.25 / 0.75, 0],
+            [1 / 0.75, 0.5 / 0.75, 0]]
+        for row, expected_row in zip(sums, expected):
+            for total, expected_total in zip(row, expected_row):
+                self.assertAlmostEqual(total, expected_total)
+        with self.assertRaises(ValueError):
+            _unary_series([[0, 1], [1, 0]])
+
     def test_nonterminal_symbols(self):
         self.assertEqual(set(self.g.nonterminal_symbols),
         {"NP", "VP", "V", "S"})
@@ -242,7 +427,52 @@ class TestGrammarUnary(TestCase):
             Rule("VP", ["V"])
         })
 
+class TestOutsideEstimates(TestCase):
+    def setUp(self):
+        from .testutil import pp_grammar
+        self.g = Grammar(pp_grammar)
+
+    def test_root(self):
+        estimates = self.g.outside_estimates(7)
+        self.assertEqual(estimates[0, 0], {"S": 0.0})
+
+    def test_estimates(self):
+        estimates = self.g.outside_estimates(7)
+        # S -> NP VP, with the best NP over one word, and VP -> VP PP, with
+        # the best PP over three words
+        self.assertAlmostEqual(estimates[1, 3]["VP"], math.log(0.3 * 0.3 * 0.5))
+        self.assertAlmostEqual(estimates[1, 0]["VP"], math.log(0.3))
+        self.assertNotIn("S", estimates[1, 0])
+        # Nothing is derived over a PP and a following word
+        self.assertNotIn("PP", estimates[0, 1])
+
+    def test_grow(self):
+        short = dict(self.g.outside_estimates(3))
+        estimates = self.g.outside_estimates(7)
+        self.assertIn((6, 0), estimates)
+        for context, scores in short.items():
+            self.assertEqual(estimates[context], scores)
+        self.assertIs(self.g.outside_estimates(5), estimates)
+        from .testutil import pp_grammar
+        self.assertEqual(Grammar(pp_grammar).outside_estimates(7), estimates)
+
+
 class TestProbability(TestCase):
+    def test_arithmetic(self):
+        self.assertAlmostEqual(float(Probability(0.5) * Probability(0.2)), 0.1)
+        self.assertAlmostEqual(float(Probability(0.5) + Probability(0.2)), 0.7)
+        self.assertEqual(Probability(0) + Probability(0.5), Probability(0.5))
+        self.assertEqual(float(Probability(0) * Probability(0.5)), 0)
+
+    def test_log_space(self):
+        tiny = Probability.from_log(-2000)
+        self.assertEqual((tiny * tiny).log(), -4000)
+        self.assertAlmostEqual((tiny + tiny).log(), -2000 + math.log(2))
+
+    def test_order(self):
+        self.assertLess(Probability(0.2), Probability(0.5))
+        self.assertEqual(max(Probability(0.2), Probability(0.5)), Probability(0.5))
+
     def test_eq(self):
         prob1 = Probability(1)
         prob2 = Probability(0.5)
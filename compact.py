@@ -0,0 +1,138 @@
+"""
+Making trained grammars smaller.
+
+Treebank grammars are full of rules seen once, which slow down parsing and
+barely change the parses. compact_grammar drops rules below a probability,
+removes the symbols that can't be part of a parse and merges intermediate
+symbols of binarization that behave the same.
+"""
+
+import sys
+import argparse
+from collections import defaultdict, namedtuple
+from .common import Grammar, Rule, PosTerminal, SplitTag
+from .util import empty
+from . import storage
+
+GrammarSize = namedtuple("GrammarSize", "rules symbols split_tags")
+
+def grammar_size(grammar):
+    symbols = {rule.left_side for rule in grammar} \
+        | {child for rule in grammar for child in rule.right_side
+            if not isinstance(child, PosTerminal)}
+    return GrammarSize(len(grammar.rules), len(symbols),
+        sum(1 for symbol in symbols if isinstance(symbol, SplitTag)))
+
+
+def renormalized(rules):
+    """The rules with the probabilities of every left side summing to 1"""
+    totals = defaultdict(float)
+    for rule in rules:
+        totals[rule.left_side] += float(rule.probability)
+    return [Rule(rule.left_side, rule.right_side,
+        float(rule.probability) / totals[rule.left_side]) for rule in rules]
+
+def prune_rules(rules, min_probability):
+    """Drop the rules less probable than min_probability and renormalize"""
+    return renormalized([rule for rule in rules if float(rule.probability) >= min_probability])
+
+def remove_useless_symbols(rules, root="S"):
+    """
+    Keep only the rules that can be part of a parse: the ones whose symbols
+    all derive some sequence of POS tags (productive) and whose left side
+    can be derived from root (reachable).
+    """
+    productive = set()
+    changed = True
+    while changed:
+        changed = False
+        for rule in rules:
+            if rule.left_side not in productive and all(isinstance(child, PosTerminal)
+                    or child in productive for child in rule.right_side):
+                productive.add(rule.left_side)
+                changed = True
+    rules = [rule for rule in rules if rule.left_side in productive and all(
+        isinstance(child, PosTerminal) or child in productive for child in rule.right_side)]
+    by_left_side = defaultdict(list)
+    for rule in rules:
+        by_left_side[rule.left_side].append(rule)
+    reachable = {root}
+    agenda = [root]
+    while not empty(agenda):
+        for rule in by_left_side[agenda.pop()]:
+            for child in rule.right_side:
+                if child not in reachable:
+                    reachable.add(child)
+                    agenda.append(child)
+    return [rule for rule in rules if rule.left_side in reachable]
+
+def merge_split_tags(rules):
+    """
+    Merge SplitTag symbols with the same rules, up to the merges, until no
+    more can be merged. Every group is replaced by its member with the
+    smallest repr. Rules that become the same rule get the sum of their
+    probabilities.
+    """
+    rules = list(rules)
+    while True:
+        signatures = defaultdict(set)
+        for rule in rules:
+            if isinstance(rule.left_side, SplitTag):
+                signatures[rule.left_side].add((rule.right_side, float(rule.probability)))
+        groups = defaultdict(list)
+        for symbol, signature in signatures.items():
+            groups[frozenset(signature)].append(symbol)
+        replacements = {}
+        for symbols in groups.values():
+            if len(symbols) > 1:
+                kept = min(symbols, key=repr)
+                replacements.update((symbol, kept) for symbol in symbols if symbol != kept)
+        if empty(replacements):
+            return rules
+        replace = lambda symbol: replacements.get(symbol, symbol)
+        # Rules of a left side that become the same rule are summed
+        summed = defaultdict(float)
+        for rule in rules:
+            right_side = tuple(replace(child) for child in rule.right_side)
+            summed[rule.left_side, right_side] += float(rule.probability)
+        # The merged left sides have the same rules, one of them is kept
+        merged = {(replace(left_side), right_side): probability
+            for (left_side, right_side), probability in summed.items()}
+        rules = [Rule(left_side, right_side, probability)
+            for (left_side, right_side), probability in merged.items()]
+
+def compact_grammar(grammar, min_probability=0, root="S"):
+    """
+    Return the compacted Grammar: prune_rules, then remove_useless_symbols
+    and renormalize, then merge_split_tags.
+    """
+    rules = prune_rules(grammar, min_probability)
+    rules = renormalized(remove_useless_symbols(rules, root))
+    return Grammar(merge_split_tags(rules))
+
+
+def format_size(size):
+    return str.format("{} rules, {} symbols, {} of them SplitTags", *size)
+
+def main(argv):
+    arguments = argparse.ArgumentParser(prog=argv[0],
+        description="Compact a stored grammar and report its size before and after")
+    arguments.add_argument("input", nargs="?", default=storage.GRAMMAR_PATH,
+        help="grammar written by training, default %(default)s")
+    arguments.add_argument("output", nargs="?",
+        help="where to write the compacted grammar, default the input")
+    arguments.add_argument("--min-probability", type=float, default=0,
+        help="drop rules less probable than this, default %(default)s")
+    arguments.add_argument("--format", choices=[storage.COMPILED_FORMAT, storage.PICKLE_FORMAT],
+        default=storage.COMPILED_FORMAT)
+    options = arguments.parse_args(argv[1:])
+    with storage.GrammarReader(options.input) as reader:
+        grammar = reader.read()
+    compacted = compact_grammar(grammar, options.min_probability)
+    print("before:", format_size(grammar_size(grammar)))
+    print("after: ", format_size(grammar_size(compacted)))
+    with storage.GrammarWriter(options.output or options.input, options.format) as writer:
+        writer.write(compacted)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,81 @@
+import os
+import tempfile
+from io import StringIO
+from contextlib import redirect_stdout
+from unittest import TestCase
+from .common import Rule, Grammar, PosTerminal, SplitTag
+from .parser import parse_best
+from .testutil import pp_grammar, pp_sentence
+from . import storage
+
+from .compact import *
+
+class TestPruneRules(TestCase):
+    def test_renormalizes(self):
+        pruned = {(rule.left_side, rule.right_side): float(rule.probability)
+            for rule in prune_rules(pp_grammar, .25)}
+        self.assertEqual(len(pruned), 10)
+        self.assertNotIn(("NP", ("NP", "PP")), pruned)
+        self.assertAlmostEqual(pruned["NP", ("Det", "N")], .625)
+        self.assertAlmostEqual(pruned["VP", ("V", "NP")], 2 / 3)
+        self.assertAlmostEqual(pruned["S", ("NP", "VP")], 1)
+
+
+class TestRemoveUselessSymbols(TestCase):
+    def test_unproductive_and_unreachable(self):
+        rules = [Rule("S", ["NP", "VP"], .5), Rule("S", ["NP", "X"], .5),
+            Rule("X", ["X", "NP"], 1), Rule("NP", [PosTerminal("NP")], 1),
+            Rule("VP", [PosTerminal("VP")], 1), Rule("Y", [PosTerminal("Y")], 1)]
+        self.assertEqual(set(remove_useless_symbols(rules)), {Rule("S", ["NP", "VP"], .5),
+            Rule("NP", [PosTerminal("NP")], 1), Rule("VP", [PosTerminal("VP")], 1)})
+
+
+class TestMergeSplitTags(TestCase):
+    def test_chains(self):
+        # Two chains of Markovized intermediates that only differ in their parent
+        a1, a2 = SplitTag(("B", "C", "D"), "A"), SplitTag(("C", "D"), "A")
+        e1, e2 = SplitTag(("B", "C", "D"), "E"), SplitTag(("C", "D"), "E")
+        rules = [Rule("A", ["X", a1], 1), Rule("E", ["Y", e1], 1),
+            Rule(a1, ["B", a2], 1), Rule(a2, ["C", "D"], 1),
+            Rule(e1, ["B", e2], 1), Rule(e2, ["C", "D"], 1)]
+        merged = merge_split_tags(rules)
+        self.assertEqual(len(merged), 4)
+        kept = min((a1, e1), key=repr)
+        self.assertIn(Rule("A", ["X", kept], 1), merged)
+        self.assertIn(Rule("E", ["Y", kept], 1), merged)
+
+    def test_colliding_rules_summed(self):
+        a, e = SplitTag(("B", "C"), "A"), SplitTag(("B", "C"), "E")
+        rules = [Rule("A", ["X", a], .5), Rule("A", ["X", e], .5),
+            Rule(a, ["B", "C"], 1), Rule(e, ["B", "C"], 1)]
+        merged = {(rule.left_side, rule.right_side): float(rule.probability)
+            for rule in merge_split_tags(rules)}
+        kept = min((a, e), key=repr)
+        self.assertEqual(merged, {("A", ("X", kept)): 1, (kept, ("B", "C")): 1})
+
+    def test_different_rules_kept(self):
+        a, b = SplitTag(("B", "C"), "A"), SplitTag(("B", "C"), "E")
+        rules = [Rule(a, ["B", "C"], 1), Rule(b, ["B", "C"], .5), Rule(b, ["C", "B"], .5)]
+        self.assertEqual(len(merge_split_tags(rules)), 3)
+
+
+class TestCompactGrammar(TestCase):
+    def test_parses_unchanged(self):
+        grammar = Grammar(pp_grammar | {Rule("NP", ["Z"], .01), Rule("Z", ["Z", "Z"], 1)})
+        compacted = compact_grammar(grammar)
+        self.assertEqual(grammar_size(compacted), grammar_size(Grammar(pp_grammar)))
+        self.assertEqual(parse_best(compacted, pp_sentence)[0],
+            parse_best(Grammar(pp_grammar), pp_sentence)[0])
+
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "grammar")
+        with storage.GrammarWriter(path) as writer:
+            writer.write(Grammar(pp_grammar))
+        output = StringIO()
+        with redirect_stdout(output):
+            main(["compact", path, "--min-probability", ".25"])
+        self.assertIn("before: 12 rules", output.getvalue())
+        self.assertIn("after:  10 rules", output.getvalue())
+        with storage.GrammarReader(path) as reader:
+            self.assertEqual(len(reader.read().rules), 10)
@@ -0,0 +1,374 @@
+"""
+CKY on a dense chart.
+
+Nonterminals are mapped to integer ids and the chart is a NumPy array of log
+scores indexed by [start, length, symbol]. Rules are applied as array
+operations over all rules and all cells of one span length at once, instead
+of one rule at a time.
+"""
+
+import numpy as np
+from .common import Grammar, PosTerminal, HashableTree
+from .util import irange
+from . import log
+
+VITERBI = "viterbi"
+INSIDE = "inside"
+
+_REDUCERS = {
+    VITERBI: (np.maximum, np.maximum.reduceat),
+    INSIDE: (np.logaddexp, np.logaddexp.reduceat),
+}
+
+
+class _RuleArrays:
+    """
+    Rules of one arity as parallel arrays, sorted by their left side so that
+    per-parent reductions can be done with ufunc.reduceat.
+
+    entries -- (rule, parent id, child ids, log probability) tuples
+    """
+    def __init__(self, entries, arity):
+        entries = sorted(entries, key=lambda entry: entry[1])
+        self.rules = tuple(entry[0] for entry in entries)
+        self.parent = np.array([entry[1] for entry in entries], dtype=np.intp)
+        self.children = np.array([entry[2] for entry in entries],
+            dtype=np.intp).reshape(len(entries), arity)
+        self.logprob = np.array([entry[3] for entry in entries], dtype=np.float64)
+        if len(entries) == 0:
+            self.group_starts = np.zeros(0, dtype=np.intp)
+        else:
+            self.group_starts = np.flatnonzero(np.r_[True, self.parent[1:] != self.parent[:-1]])
+        self.group_parents = self.parent[self.group_starts]
+        # Orderings by child for reduce_by_child, computed on first use
+        self._by_child = {}
+
+    @classmethod
+    def from_rules(cls, rules, arity, symbol_ids, child_ids):
+        return cls(((rule, symbol_ids[rule.left_side],
+            [child_ids[child] for child in rule.right_side], rule.probability.log())
+            for rule in rules), arity)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def reduce_by_parent(self, scores, reduceat, num_symbols):
+        """
+        Reduce scores of shape (cells, rules) to (cells, symbols), combining
+        all rules with the same left side.
+        """
+        ret = np.full((scores.shape[0], num_symbols), -np.inf)
+        if len(self) != 0:
+            ret[:, self.group_parents] = reduceat(scores, self.group_starts, axis=1)
+        return ret
+
+    def reduce_by_child(self, scores, position, reduceat, num_symbols):
+        """
+        Like reduce_by_parent, but combining all rules with the same child at
+        position of the right side.
+        """
+        if position not in self._by_child:
+            children = self.children[:, position]
+            order = np.argsort(children, kind="stable")
+            ordered = children[order]
+            starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]]) \
+                if len(order) != 0 else np.zeros(0, dtype=np.intp)
+            self._by_child[position] = order, starts, ordered[starts]
+        order, starts, group_children = self._by_child[position]
+        ret = np.full((scores.shape[0], num_symbols), -np.inf)
+        if len(self) != 0:
+            ret[:, group_children] = reduceat(scores[:, order], starts, axis=1)
+        return ret
+
+    def of_parent(self, parent_id):
+        """Slice of the arrays holding the rules with left side parent_id"""
+        begin, end = np.searchsorted(self.parent, [parent_id, parent_id + 1])
+        return slice(begin, end)
+
+
+def unary_series(unary):
+    """
+    The geometric series U + U^2 + ... = (I - U)^-1 - I of a square unary
+    rule matrix U, indexed by [left side, child]. Grammar.unary_sums_for
+    uses it too.
+
+    Raises ValueError if the series doesn't converge, which is the case iff
+    the inverse doesn't exist or has a negative entry.
+    """
+    unary = np.asarray(unary, dtype=float)
+    identity = np.eye(len(unary))
+    try:
+        inverse = np.linalg.inv(identity - unary)
+    except np.linalg.LinAlgError:
+        raise ValueError("The unary rules have no finite summed probability") from None
+    if not np.isfinite(inverse).all() or (inverse < -1e-9).any():
+        raise ValueError("The unary rules have no finite summed probability")
+    return np.clip(inverse - identity, 0, None)
+
+
+class DenseGrammar:
+    """
+    A Grammar compiled to integer symbol ids and rule arrays.
+
+    Compiling takes time proportional to the grammar size, so build it once
+    and pass it to build_dense_chart instead of the Grammar.
+    """
+    def __init__(self, grammar):
+        if not isinstance(grammar, Grammar):
+            grammar = Grammar(grammar)
+        assert all(len(rule.right_side) <= 2 for rule in grammar.rules)
+        self.grammar = grammar
+        symbols = set(grammar.nonterminal_symbols)
+        postags = set()
+        for rule in grammar.rules:
+            for child in rule.right_side:
+                if isinstance(child, PosTerminal):
+                    postags.add(child)
+                else:
+                    symbols.add(child)
+        # Sorted so that ids don't depend on hash randomization
+        self.symbols = tuple(sorted(symbols, key=repr))
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.postags = tuple(sorted(postags, key=repr))
+        self.postag_ids = {postag: i for i, postag in enumerate(self.postags)}
+        self.binary = _RuleArrays.from_rules(grammar.binary_rules, 2,
+            self.symbol_ids, self.symbol_ids)
+        self.lexical = _RuleArrays.from_rules(
+            (rule for rule in grammar.unary_rules if isinstance(rule.right_side[0], PosTerminal)),
+            1, self.symbol_ids, self.postag_ids)
+        # The unary closure, with a UnaryChain in place of the rule
+        self.unary = _RuleArrays(((chain, self.symbol_ids[chain.top],
+            [self.symbol_ids[chain.bottom]], chain.log_probability)
+            for symbol in self.symbols for chain in grammar.unary_chains_for(symbol)), 1)
+        self.unary_sums = self._unary_sums(grammar)
+
+    def _unary_sums(self, grammar):
+        """
+        Summed probability of all unary derivations A =>+ B, including the
+        ones going around cycles, as a (symbols, symbols) matrix indexed by
+        [A, B], see unary_series.
+
+        The series only converges if the spectral radius of U is below 1,
+        which improper grammars like coarse projections don't guarantee. In
+        that case the best chain between two symbols is used instead, like
+        for VITERBI.
+        """
+        unary = np.zeros((self.num_symbols, self.num_symbols))
+        for rule in grammar.unary_rules:
+            child = rule.right_side[0]
+            if not isinstance(child, PosTerminal):
+                unary[self.symbol_ids[rule.left_side], self.symbol_ids[child]] += float(rule.probability)
+        if not unary.any():
+            return unary
+        try:
+            return unary_series(unary)
+        except ValueError:
+            log.warn("Unary rules don't have finite summed probabilities, using the best chains")
+        sums = np.zeros((self.num_symbols, self.num_symbols))
+        sums[self.unary.parent, self.unary.children[:, 0]] = np.exp(self.unary.logprob)
+        return sums
+
+    @property
+    def num_symbols(self):
+        return len(self.symbols)
+
+    def lexical_scores(self, text, reduceat):
+        """Scores of shape (len(text), symbols) for the preterminals of every word"""
+        scores = np.full((len(text), len(self.lexical)), -np.inf)
+        postags = self.lexical.children[:, 0]
+        for i, (word, pos) in enumerate(text):
+            pos_id = self.postag_ids.get(PosTerminal(pos))
+            if pos_id is not None:
+                match = postags == pos_id
+                scores[i, match] = self.lexical.logprob[match]
+        return self.lexical.reduce_by_parent(scores, reduceat, self.num_symbols)
+
+
+def as_dense_grammar(grammar):
+    if isinstance(grammar, DenseGrammar):
+        return grammar
+    return DenseGrammar(grammar)
+
+
+class DenseChart:
+    """
+    scores -- log scores of shape (n+1, n+1, symbols), indexed by
+        [start, length, symbol] with 1-indexed starts like build_chart
+    inner -- the scores before unary rules were applied to a cell
+
+    scores and inner can be passed in, filled with -inf, to fill arrays
+    allocated elsewhere, like in shared memory.
+    """
+    def __init__(self, grammar, text, mode, scores=None, inner=None):
+        self.grammar = grammar
+        self.text = text
+        self.mode = mode
+        shape = (len(text) + 1, len(text) + 1, grammar.num_symbols)
+        self.scores = np.full(shape, -np.inf) if scores is None else scores
+        self.inner = np.full(shape, -np.inf) if inner is None else inner
+
+    def score(self, start, length, symbol):
+        symbol_id = self.grammar.symbol_ids.get(symbol)
+        if symbol_id is None or not 1 <= start <= start + length - 1 <= len(self.text):
+            return -np.inf
+        return self.scores[start, length, symbol_id]
+
+
+def _apply_unary_rules(grammar, cells, mode):
+    """
+    Apply the unary closure once to cells of shape (cells, symbols).
+
+    For VITERBI, this uses the best chain for every pair of symbols, for
+    INSIDE the summed probability of all chains.
+    """
+    if len(grammar.unary) == 0:
+        return cells
+    if mode == VITERBI:
+        candidates = cells[:, grammar.unary.children[:, 0]] + grammar.unary.logprob
+        chains = grammar.unary.reduce_by_parent(candidates, np.maximum.reduceat, grammar.num_symbols)
+        return np.maximum(cells, chains)
+    # Scaled per cell so the exponentials don't underflow
+    scale = cells.max(axis=1, keepdims=True)
+    scale[scale == -np.inf] = 0
+    probabilities = np.exp(cells - scale)
+    with np.errstate(divide="ignore"):
+        return np.log(probabilities + probabilities @ grammar.unary_sums.T) + scale
+
+
+def _prune(cells, beam, threshold):
+    """
+    Like parser.prune_cell for cells of shape (cells, symbols). Symbol ids
+    are in repr order, so ties are broken the same way.
+    """
+    if threshold is not None:
+        cutoff = cells.max(axis=1, keepdims=True) - threshold
+        cells = np.where(cells >= cutoff, cells, -np.inf)
+    if beam is not None and beam < cells.shape[1]:
+        order = np.argsort(-cells, axis=1, kind="stable")
+        np.put_along_axis(cells, order[:, beam:], -np.inf, axis=1)
+    return cells
+
+
+def _close_cells(grammar, inner, mode, beam, threshold):
+    """
+    Apply the unary rules to inner, cells of shape (cells, symbols), and
+    prune them. Return the inner cells and the cells.
+
+    Pruned symbols are taken out of the inner cells and the unary rules
+    applied again, so that no chain starts at a pruned symbol.
+    """
+    cells = _apply_unary_rules(grammar, inner, mode)
+    if beam is None and threshold is None:
+        return inner, cells
+    kept = _prune(cells.copy(), beam, threshold) != -np.inf
+    inner = np.where(kept, inner, -np.inf)
+    return inner, np.where(kept, _apply_unary_rules(grammar, inner, mode), -np.inf)
+
+def _fill_cells(grammar, scores, inner, starts, length, mode, beam, threshold):
+    """
+    Fill the cells (start, length) for starts, an array, in the score arrays
+    of a DenseChart. The shorter spans must be filled already.
+    """
+    combine, reduceat = _REDUCERS[mode]
+    rule_scores = np.full((len(starts), len(grammar.binary)), -np.inf)
+    left_ids = grammar.binary.children[:, 0]
+    right_ids = grammar.binary.children[:, 1]
+    for partition in irange(1, length - 1):
+        left = scores[starts, partition][:, left_ids]
+        right = scores[starts + partition, length - partition][:, right_ids]
+        rule_scores = combine(rule_scores, left + right + grammar.binary.logprob)
+    cells = grammar.binary.reduce_by_parent(rule_scores, reduceat, grammar.num_symbols)
+    inner[starts, length], scores[starts, length] = _close_cells(grammar, cells, mode,
+        beam, threshold)
+
+
+def build_dense_chart(grammar, text, mode=VITERBI, beam=None, threshold=None, pool=None):
+    """
+    Fill a DenseChart for text.
+
+    mode -- VITERBI for the best derivation score of every cell, INSIDE for
+        the log of the summed probability of all derivations
+    beam, threshold -- per cell pruning, see parser.prune_cell
+    pool -- a WavefrontPool to fill the cells of every span length in
+        parallel, or None
+    """
+    if pool is not None:
+        return pool.build_chart(text, mode, beam, threshold)
+    grammar = as_dense_grammar(grammar)
+    chart = DenseChart(grammar, text, mode)
+    _fill_chart(chart, beam, threshold, _fill_cells)
+    return chart
+
+def _fill_chart(chart, beam, threshold, fill_cells):
+    """
+    Fill chart span length by span length, calling
+    fill_cells(grammar, scores, inner, starts, length, mode, beam, threshold)
+    for the cells of every length above 1.
+    """
+    grammar = chart.grammar
+    mode = chart.mode
+    text_len = len(chart.text)
+    if text_len == 0:
+        return
+    lexical = grammar.lexical_scores(chart.text, _REDUCERS[mode][1])
+    chart.inner[1:, 1], chart.scores[1:, 1] = _close_cells(grammar, lexical, mode,
+        beam, threshold)
+    for length in irange(2, text_len):
+        fill_cells(grammar, chart.scores, chart.inner, np.arange(1, text_len - length + 2),
+            length, mode, beam, threshold)
+
+
+def dense_viterbi_tree(chart, start, length, symbol):
+    """Recover the best tree below (start, length, symbol) from a VITERBI chart"""
+    assert chart.mode == VITERBI
+    grammar = chart.grammar
+    return _dense_viterbi_tree(chart, start, length, grammar.symbol_ids[symbol], False)
+
+def _dense_viterbi_tree(chart, start, length, symbol_id, below_unary):
+    grammar = chart.grammar
+    scores = chart.scores
+    symbol = grammar.symbols[symbol_id]
+    score = scores[start, length, symbol_id]
+    if not below_unary and score > chart.inner[start, length, symbol_id]:
+        # Reached through a unary chain, which starts at a symbol derived
+        # without unary rules and not pruned
+        chains = grammar.unary.of_parent(symbol_id)
+        child_ids = grammar.unary.children[chains, 0]
+        candidates = chart.inner[start, length, child_ids] + grammar.unary.logprob[chains]
+        best = int(np.argmax(candidates))
+        chain = grammar.unary.rules[chains.start + best]
+        child = _dense_viterbi_tree(chart, start, length, int(child_ids[best]), True)
+        return chain.wrap(child, start, length)
+    if length == 1:
+        pos_id = grammar.postag_ids[PosTerminal(chart.text[start - 1][1])]
+        rules = grammar.lexical.of_parent(symbol_id)
+        candidates = np.where(grammar.lexical.children[rules, 0] == pos_id,
+            grammar.lexical.logprob[rules], -np.inf)
+        rule = grammar.lexical.rules[rules.start + int(np.argmax(candidates))]
+        return HashableTree(symbol, HashableTree(rule.right_side[0]), start=start, length=length)
+    rules = grammar.binary.of_parent(symbol_id)
+    left_ids = grammar.binary.children[rules, 0]
+    right_ids = grammar.binary.children[rules, 1]
+    partitions = np.arange(1, length)
+    candidates = scores[start, partitions][:, left_ids] \
+        + scores[start + partitions, length - partitions][:, right_ids] \
+        + grammar.binary.logprob[rules]
+    partition_index, rule_index = np.unravel_index(int(np.argmax(candidates)), candidates.shape)
+    partition = int(partitions[partition_index])
+    left = _dense_viterbi_tree(chart, start, partition, int(left_ids[rule_index]), False)
+    right = _dense_viterbi_tree(chart, start + partition, length - partition,
+        int(right_ids[rule_index]), False)
+    return HashableTree(symbol, left, right, start=start, length=length)
+
+
+def parse_best(grammar, text, beam=None, threshold=None, pool=None):
+    """
+    Like parser.parse_best with keep_posleafs=True, but on a dense chart.
+
+    Returns a (tree, log probability) tuple or None.
+    """
+    chart = build_dense_chart(grammar, text, VITERBI, beam, threshold, pool)
+    score = chart.score(1, len(text), "S")
+    if score == -np.inf:
+        return None
+    return dense_viterbi_tree(chart, 1, len(text), "S"), float(score)
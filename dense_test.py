@@ -0,0 +1,80 @@
+from unittest import TestCase, skipIf
+import math
+from .parser import parse_best, build_viterbi_chart, NUMPY_ENGINE
+from .common import Rule, PosTerminal
+from .testutil import grammar, unary_grammar, unary_grammar2, pp_grammar, pp_sentence
+try:
+    import numpy
+    from .dense import DenseGrammar, build_dense_chart, INSIDE
+except ImportError:
+    numpy = None
+
+SENTENCE = [("she", "NP"), ("eats", "V"), ("a", "Det"), ("fish", "N")]
+
+@skipIf(numpy is None, "numpy is not installed")
+class TestDenseChart(TestCase):
+    def assertSameBest(self, grammar, text, **kwargs):
+        expected = parse_best(grammar, text, **kwargs)
+        found = parse_best(DenseGrammar(grammar), text, engine=NUMPY_ENGINE, **kwargs)
+        self.assertEqual(found[0], expected[0])
+        self.assertAlmostEqual(found[1], expected[1])
+
+    def test_simple(self):
+        self.assertSameBest(grammar, SENTENCE)
+
+    def test_ambiguous(self):
+        self.assertSameBest(pp_grammar, pp_sentence)
+
+    def test_unary(self):
+        self.assertSameBest(unary_grammar, [("John", "NP"), ("eats", "V")])
+        self.assertSameBest(unary_grammar2, [("she", "NP"), ("eats", "VP")])
+
+    def test_unary_cycle(self):
+        cyclic = unary_grammar | {Rule("V", ["VP"], probability=0.5)}
+        self.assertSameBest(cyclic, [("John", "NP"), ("eats", "V")])
+
+    def test_false(self):
+        self.assertIsNone(parse_best(grammar, [("she", "NP"), ("fish", "N"), ("eats", "V")],
+            engine=NUMPY_ENGINE))
+        self.assertIsNone(parse_best(grammar, [("she", "X")], engine=NUMPY_ENGINE))
+
+    def test_pruning(self):
+        sentence = [("John", "NP"), ("eats", "V")]
+        self.assertIsNone(parse_best(unary_grammar, sentence, engine=NUMPY_ENGINE, beam=1))
+        self.assertIsNotNone(parse_best(unary_grammar, sentence, engine=NUMPY_ENGINE, threshold=0))
+        self.assertSameBest(pp_grammar, pp_sentence, beam=1)
+        self.assertSameBest(pp_grammar, pp_sentence, beam=2, threshold=3)
+
+    def test_pruned_are_not_chain_children(self):
+        from .parser_test import TestPruning
+        sentence = [("t", "T")]
+        tree, score = parse_best(TestPruning.pruned_chain_grammar, sentence,
+            engine=NUMPY_ENGINE, beam=2, keep_posleafs=True)
+        self.assertEqual(tree, parse_best(TestPruning.pruned_chain_grammar, sentence,
+            keep_posleafs=True, beam=2)[0])
+        self.assertAlmostEqual(score, math.log(0.3))
+
+    def test_scores_match_viterbi_chart(self):
+        dense_chart = build_dense_chart(pp_grammar, pp_sentence)
+        for (start, length, symbol), entry in build_viterbi_chart(pp_grammar, pp_sentence).items():
+            self.assertAlmostEqual(dense_chart.score(start, length, symbol), entry.score)
+
+    def test_inside(self):
+        chart = build_dense_chart(pp_grammar, pp_sentence, mode=INSIDE)
+        total = 0.3 * 0.3 * 0.6 * 0.5 * 0.5 + 0.3 * 0.6 * 0.2 * 0.5 * 0.5
+        self.assertAlmostEqual(math.exp(chart.score(1, len(pp_sentence), "S")), total)
+
+    def test_inside_unary_cycle(self):
+        cyclic = unary_grammar | {Rule("V", ["VP"], probability=0.5)}
+        chart = build_dense_chart(cyclic, [("John", "NP"), ("eats", "V")], mode=INSIDE)
+        self.assertAlmostEqual(math.exp(chart.score(2, 1, "VP")), 2)
+        self.assertAlmostEqual(math.exp(chart.score(1, 2, "S")), 2)
+
+    def test_inside_divergent_unaries(self):
+        # A => B => A ... has no finite summed probability, the best chains are used
+        rules = {Rule("S", ["A"], 1), Rule("A", ["B"], 1), Rule("B", ["A"], 1),
+            Rule("B", ["C"], .5), Rule("C", ["B"], 1), Rule("C", [PosTerminal("T")], 1)}
+        dense = DenseGrammar(rules)
+        self.assertTrue(numpy.isfinite(dense.unary_sums).all())
+        chart = build_dense_chart(dense, [("t", "T")], mode=INSIDE)
+        self.assertAlmostEqual(math.exp(chart.score(1, 1, "S")), .5)
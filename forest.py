@@ -0,0 +1,186 @@
+"""
+A packed parse forest: all derivations of a sentence, sharing subderivations.
+"""
+
+import math
+import heapq
+import itertools
+from collections import namedtuple
+from itertools import product
+from .common import HashableTree, UnaryChain
+from .util import empty
+
+Backpointer = namedtuple("Backpointer", "rule partition children")
+Backpointer.__doc__ = """
+One way of deriving a ForestNode.
+
+rule -- the Rule applied, or a UnaryChain
+partition -- length of the left child for binary rules, None otherwise
+children -- the ForestNodes of the right side of the rule, () for lexical rules
+"""
+
+
+class ForestNode:
+    """
+    All derivations of symbol over the words start..start+length-1.
+
+    Attributes:
+        backpointers: a list of Backpointer
+        score: log probability of the best derivation
+        inner_score: log probability of the best derivation that doesn't
+            start with a unary chain
+    """
+    __slots__ = ("symbol", "start", "length", "backpointers", "score", "inner_score")
+
+    def __init__(self, symbol, start, length):
+        self.symbol = symbol
+        self.start = start
+        self.length = length
+        self.backpointers = []
+        self.score = -math.inf
+        self.inner_score = -math.inf
+
+    def add(self, backpointer, score):
+        self.backpointers.append(backpointer)
+        if score > self.score:
+            self.score = score
+        if not isinstance(backpointer.rule, UnaryChain) and score > self.inner_score:
+            self.inner_score = score
+
+    def __repr__(self):
+        return str.format("ForestNode({!r}, start={}, length={}, {} backpointers)",
+            self.symbol, self.start, self.length, len(self.backpointers))
+
+    def trees(self, factory=HashableTree):
+        """
+        Build every derivation as a HashableTree, one at a time.
+
+        factory -- builds the tree nodes, a common.TreeFactory to share the
+            subtrees common to several derivations
+        """
+        for backpointer in self.backpointers:
+            for tree in self._trees(backpointer, factory):
+                yield tree
+
+    def inner_trees(self, factory=HashableTree):
+        """Like trees, but without the derivations starting with a unary chain"""
+        for backpointer in self.backpointers:
+            if not isinstance(backpointer.rule, UnaryChain):
+                for tree in self._trees(backpointer, factory):
+                    yield tree
+
+    def _trees(self, backpointer, factory):
+        rule = backpointer.rule
+        if isinstance(rule, UnaryChain):
+            # Chains of the unary closure start at a derivation without one
+            for child in backpointer.children[0].inner_trees(factory):
+                yield rule.wrap(child, self.start, self.length, factory)
+        elif backpointer.partition is None:
+            yield factory(self.symbol, factory(rule.right_side[0]),
+                start=self.start, length=self.length)
+        else:
+            left, right = backpointer.children
+            for left_child, right_child in product(left.trees(factory), right.trees(factory)):
+                yield factory(self.symbol, left_child, right_child,
+                    start=self.start, length=self.length)
+
+
+class _Derivation(namedtuple("_Derivation", "score backpointer ranks")):
+    """
+    A derivation of a node: its top backpointer and, for every child, the
+    rank of the child's derivation it uses.
+    """
+    __slots__ = ()
+
+
+class KBest:
+    """
+    Lazy k-best extraction over a packed forest (Huang and Chiang 2005,
+    algorithm 3). Derivations of a node are only computed when a derivation
+    of a parent needs them, so asking for the k best trees of the root does
+    work roughly proportional to k times the size of a tree, not the size of
+    the forest.
+
+    factory -- builds the tree nodes, like in ForestNode.trees
+    """
+    def __init__(self, factory=HashableTree):
+        self._factory = factory
+        # Keys are (node, inner), inner meaning without unary chains on top
+        self._derivations = {}
+        self._candidates = {}
+        self._seen = {}
+        self._counter = itertools.count()
+
+    @staticmethod
+    def _children(backpointer):
+        if isinstance(backpointer.rule, UnaryChain):
+            return ((backpointer.children[0], True),)
+        return tuple((child, False) for child in backpointer.children)
+
+    def _score(self, backpointer, ranks):
+        """Score of a derivation, None if a child has fewer derivations"""
+        if isinstance(backpointer.rule, UnaryChain):
+            score = backpointer.rule.log_probability
+        else:
+            score = backpointer.rule.probability.log()
+        for child, rank in zip(self._children(backpointer), ranks):
+            derivation = self.get(child, rank)
+            if derivation is None:
+                return None
+            score += derivation.score
+        return score
+
+    def _push(self, key, backpointer, ranks):
+        if (backpointer, ranks) in self._seen[key]:
+            return
+        self._seen[key].add((backpointer, ranks))
+        score = self._score(backpointer, ranks)
+        if score is not None:
+            heapq.heappush(self._candidates[key],
+                (-score, next(self._counter), _Derivation(score, backpointer, ranks)))
+
+    def get(self, key, rank):
+        """The derivation of the given rank (0 is the best), or None"""
+        derivations = self._derivations.get(key)
+        if derivations is None:
+            derivations = self._derivations[key] = []
+            self._candidates[key] = []
+            self._seen[key] = set()
+            node, inner = key
+            for backpointer in node.backpointers:
+                if not (inner and isinstance(backpointer.rule, UnaryChain)):
+                    self._push(key, backpointer, (0,) * len(backpointer.children))
+        while len(derivations) <= rank:
+            if not empty(derivations):
+                # The successors of the last derivation are the next candidates
+                last = derivations[-1]
+                for i in range(len(last.ranks)):
+                    ranks = last.ranks[:i] + (last.ranks[i] + 1,) + last.ranks[i+1:]
+                    self._push(key, last.backpointer, ranks)
+            if empty(self._candidates[key]):
+                return None
+            derivations.append(heapq.heappop(self._candidates[key])[2])
+        return derivations[rank]
+
+    def tree(self, key, rank):
+        """Build the HashableTree of a derivation returned by get"""
+        node, inner = key
+        derivation = self.get(key, rank)
+        backpointer = derivation.backpointer
+        rule = backpointer.rule
+        factory = self._factory
+        children = [self.tree(child, child_rank)
+            for child, child_rank in zip(self._children(backpointer), derivation.ranks)]
+        if isinstance(rule, UnaryChain):
+            return rule.wrap(children[0], node.start, node.length, factory)
+        if backpointer.partition is None:
+            children = [factory(rule.right_side[0])]
+        return factory(node.symbol, *children, start=node.start, length=node.length)
+
+    def trees(self, node, k):
+        """Yield up to k (tree, log probability) tuples for node, best first"""
+        for rank in range(k):
+            derivation = self.get((node, False), rank)
+            if derivation is None:
+                break
+            yield self.tree((node, False), rank), derivation.score
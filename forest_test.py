@@ -0,0 +1,31 @@
+from unittest import TestCase
+import math
+from .forest import *
+from .common import Rule, PosTerminal, UnaryChain, HashableTree
+
+class TestForestNode(TestCase):
+    def setUp(self):
+        self.lexical = Rule("N", [PosTerminal("N")], probability=0.5)
+        self.chain = UnaryChain("NP", "N", (Rule("NP", ["N"], probability=0.5),), math.log(0.5))
+        self.n = ForestNode("N", 1, 1)
+        self.n.add(Backpointer(self.lexical, None, ()), math.log(0.5))
+        self.np = ForestNode("NP", 1, 1)
+        self.np.add(Backpointer(self.chain, None, (self.n,)), math.log(0.25))
+
+    def test_scores(self):
+        self.assertEqual(self.n.score, math.log(0.5))
+        self.assertEqual(self.n.inner_score, math.log(0.5))
+        self.assertEqual(self.np.score, math.log(0.25))
+        self.assertEqual(self.np.inner_score, -math.inf)
+
+    def test_trees(self):
+        n_tree = HashableTree("N", HashableTree(PosTerminal("N")))
+        self.assertEqual(list(self.n.trees()), [n_tree])
+        self.assertEqual(list(self.np.trees()), [HashableTree("NP", n_tree)])
+        self.assertEqual(list(self.np.inner_trees()), [])
+
+    def test_chain_skips_unary_derivations_of_child(self):
+        # A chain is applied to the derivations of its bottom that don't
+        # start with a unary chain themselves
+        self.n.add(Backpointer(UnaryChain("N", "X", (), 0.0), None, (ForestNode("X", 1, 1),)), 0)
+        self.assertEqual(len(list(self.np.trees())), 1)
@@ -1,13 +1,35 @@
 import logging
+import functools
 
 #if __debug__:
 #    logging.basicConfig(level=logging.DEBUG)
+
+class _Message:
+    """
+    A str.format call done only when the message is emitted, so disabled
+    log calls don't pay for formatting their parameters
+    """
+    __slots__ = ("string", "params")
+
+    def __init__(self, string, params):
+        self.string = string
+        self.params = params
+
+    def __str__(self):
+        return str(self.string).format(*self.params)
+
+def is_enabled(level=logging.DEBUG):
+    return logging.root.isEnabledFor(level)
+
 def debug(string, *params):
-    logging.debug(str(string).format(*params))
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug(_Message(string, params))
 def warn(string, *params):
-    logging.warn(str(string).format(*params))
+    if logging.root.isEnabledFor(logging.WARNING):
+        logging.warning(_Message(string, params))
 def info(string, *params):
-    logging.info(str(string).format(*params))
+    if logging.root.isEnabledFor(logging.INFO):
+        logging.info(_Message(string, params))
 
 def is_generator(obj):
     return hasattr(obj, "__next__")
@@ -34,7 +56,17 @@ class logging_iterator_wrapper:
         return self
 
 def log(func):
+    """
+    Log the arguments and results of func at DEBUG level.
+
+    Whether DEBUG is enabled is checked once, when decorating: if it isn't,
+    func is returned unchanged and costs nothing. Configure logging before
+    importing the modules to trace.
+    """
+    if not is_enabled():
+        return func
     funcname = func.__name__
+    @functools.wraps(func)
     def my_func(*args, **kwargs):
         debug("{}:enter:{}, kwargs={}", funcname, args, kwargs)
         ret = func(*args, **kwargs)
@@ -0,0 +1,46 @@
+import logging
+from unittest import TestCase
+from . import log
+
+class Counted:
+    formatted = 0
+
+    def __format__(self, spec):
+        Counted.formatted += 1
+        return "counted"
+
+
+class TestLog(TestCase):
+    def setUp(self):
+        self.level = logging.root.level
+        Counted.formatted = 0
+
+    def tearDown(self):
+        logging.root.setLevel(self.level)
+
+    def test_lazy_formatting(self):
+        logging.root.setLevel(logging.INFO)
+        log.debug("{}", Counted())
+        self.assertEqual(Counted.formatted, 0)
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            log.debug("value={}", Counted())
+        self.assertEqual(logs.output, ["DEBUG:root:value=counted"])
+        self.assertEqual(Counted.formatted, 1)
+
+    def test_decorator_disabled(self):
+        logging.root.setLevel(logging.INFO)
+        def double(x):
+            return 2 * x
+        self.assertIs(log.log(double), double)
+
+    def test_decorator_enabled(self):
+        logging.root.setLevel(logging.DEBUG)
+        def count(n):
+            yield from range(n)
+        traced = log.log(count)
+        self.assertEqual(traced.__name__, "count")
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            self.assertEqual(list(traced(2)), [0, 1])
+        self.assertEqual(logs.output, ["DEBUG:root:count:enter:(2,), kwargs={}",
+            "DEBUG:root:count:yield:0", "DEBUG:root:count:yield:1",
+            "DEBUG:root:count:exit iterator"])
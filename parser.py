@@ -1,53 +1,320 @@
 #! /usr/bin/env python3.2
 
 import sys
-from collections import defaultdict
+import math
+import argparse
+import itertools
+import multiprocessing
+import queue
+import heapq
+import time
+from collections import OrderedDict
 from copy import copy
-from .util import irange, files_from_paths
-from .common import HashableTree, Grammar, SplitTag, PosTerminal, HashableTree
+from .util import irange, empty, files_from_paths, gc_paused
+from .common import HashableTree, Grammar, SplitTag, PosTerminal, UnaryChain, TreeFactory, \
+    _max_into
 from . import log
+from . import storage
+from .forest import ForestNode, Backpointer, KBest
+from .chart import Chart
+from .stats import ParseStats
+from . import semiring as _semiring
+from .semiring import ViterbiEntry
+try:
+    from . import dense
+except ImportError:
+    log.info("Could not import numpy, the numpy engine is not available")
+    dense = None
+
+PYTHON_ENGINE = "python"
+NUMPY_ENGINE = "numpy"
+ASTAR_ENGINE = "astar"
+
+def _as_grammar(grammar):
+    """Wrap a plain collection of rules, but reuse an existing Grammar and its indexes"""
+    if isinstance(grammar, Grammar):
+        return grammar
+    return Grammar(grammar)
 
 def init_chart(grammar, text):
-    ret = defaultdict(set)
+    ret = Chart(len(text))
     for raw_i, word in enumerate(text):
         index = raw_i + 1 # p is 1-indexed
         posterm = PosTerminal(word[1])
-        for rule in grammar.unary_rules:
-            if rule.right_side[0] == posterm:
-                tree = HashableTree(rule.left_side, HashableTree(rule.right_side[0]))
-                ret[(index, 1, rule.left_side)].add(tree)
+        for rule in grammar.lexical_rules_for(posterm):
+            node = ret.get((index, 1, rule.left_side))
+            if node is None:
+                node = ret[index, 1, rule.left_side] = ForestNode(rule.left_side, index, 1)
+            node.add(Backpointer(rule, None, ()), rule.probability.log())
     return ret
 
+def prune_cell(scores, beam=None, threshold=None):
+    """
+    Return the set of symbols of a chart cell that survive pruning.
+
+    scores -- dict mapping the symbols of the cell to their best log probability
+    beam -- keep at most this many symbols, None for no limit
+    threshold -- drop symbols whose log probability is more than threshold
+        below that of the best symbol in the cell, None to keep them
+    """
+    # repr breaks ties so that the result doesn't depend on hash order
+    ranked = sorted(scores, key=lambda symbol: (-scores[symbol], repr(symbol)))
+    if beam is not None:
+        ranked = ranked[:beam]
+    if threshold is not None and not empty(ranked):
+        cutoff = scores[ranked[0]] - threshold
+        ranked = [symbol for symbol in ranked if scores[symbol] >= cutoff]
+    return set(ranked)
+
+
+def build_chart(grammar, text, beam=None, threshold=None, stats=None, semiring=None):
+    """
+    Return a Chart mapping (start, length, symbol) to a forest.ForestNode
+    packing all derivations of symbol from the words start..start+length-1
+    (1-indexed).
+
+    beam, threshold -- prune every cell as described in prune_cell. The
+        score of a symbol is its best derivation; pruned symbols are never
+        used as children, not even of unary chains in the same cell.
+    stats -- a stats.ParseStats to add the work done to, or None
+    semiring -- if not None, a semiring.Semiring; the chart then maps to
+        the semiring values of the derivations instead, see
+        build_semiring_chart
+    """
+    return build_semiring_chart(grammar, text,
+        _semiring.FOREST if semiring is None else semiring, beam, threshold, stats=stats)
+
+def build_semiring_chart(grammar, text, semiring, beam=None, threshold=None, allowed=None,
+        stats=None):
+    """
+    Return a Chart mapping (start, length, symbol) to the semiring value of
+    the derivations of symbol from the words start..start+length-1. Entries
+    without derivations are left out.
+
+    Unary rules are applied as the chains of semiring.unary_chains, to
+    derivations not starting with a chain.
 
-def build_chart(grammar, text):
-    grammar = Grammar(grammar)
+    beam, threshold -- per cell pruning, see prune_cell, on semiring.score.
+        Raises ValueError for semirings without one.
+    allowed -- if not None, a function returning the set of symbols that
+        may be derived over (start, length), see coarse.CoarseToFine
+    stats -- a stats.ParseStats to add the work done to, or None
+    """
+    grammar = _as_grammar(grammar)
     assert all(len(rule.right_side) <= 2 for rule in grammar.rules)
-    ret = init_chart(grammar, text)
+    if (beam is not None or threshold is not None) and semiring.score is None:
+        raise ValueError("Pruning needs a semiring with scores")
     text_len = len(text)
-    def apply_binary_rules():
-        for rule in grammar.binary_rules:
-            left_children = ret[start, partition, rule.right_side[0]]
-            right_children= ret[start+partition, length-partition, rule.right_side[1]]
-            for left_child, right_child in zip(left_children, right_children):
-                ret[start, length, rule.left_side].add(HashableTree(
-                    rule.left_side, left_child, right_child, start=start, length=length))
-    def apply_unary_rules():
-        for rule in grammar.unary_rules:
-            children = ret[start, length, rule.right_side[0]]
-            for child in children:
-                ret[start, length, rule.left_side].add(HashableTree(
-                    rule.left_side, child, start=start, length=length))
-    del text
-    length = 1
-    for start in irange(1, text_len-length + 1):
-        apply_unary_rules()
-    for length in irange(2, text_len):
-        for start in irange(1, text_len-length+1):
-            for partition in irange(1, length-1):
-                apply_binary_rules()
-            apply_unary_rules()
+    ret = Chart(text_len)
+    entries = peak_entries = 0
+    time_by_length = {}
+    # Charts have no reference cycles
+    with gc_paused():
+        for length in irange(1, text_len):
+            started = time.perf_counter()
+            for start in irange(1, text_len-length+1):
+                derived = _fill_cell(grammar, ret, text, start, length, semiring, beam,
+                    threshold, None if allowed is None else allowed(start, length), stats)
+                peak_entries = max(peak_entries, entries + derived)
+                entries += len(ret.span(start, length))
+            time_by_length[length] = time.perf_counter() - started
+    if stats is not None:
+        stats.sentences += 1
+        stats.words += text_len
+        stats.cells_visited += text_len * (text_len + 1) // 2
+        stats.peak_entries = max(stats.peak_entries, peak_entries)
+        stats.init_time += time_by_length.get(1, 0)
+        stats.fill_time += sum(time_by_length.values()) - time_by_length.get(1, 0)
+        for length, seconds in time_by_length.items():
+            stats.time_by_length[length] += seconds
     return ret
 
+def _fill_cell(grammar, chart, text, start, length, semiring, beam=None, threshold=None,
+        allowed=None, stats=None):
+    """
+    Fill the cell (start, length) of a chart of build_semiring_chart, whose
+    shorter spans within start..start+length-1 must already be filled.
+
+    allowed -- if not None, the set of symbols that may be added to the cell
+
+    Return the number of symbols derived before pruning.
+    """
+    if allowed is not None and empty(allowed):
+        return 0
+    add = semiring.add
+    rules_tried = binary_edges = unary_edges = 0
+    # Derivations not starting with a unary chain
+    inner = {}
+    if length == 1:
+        rules = grammar.lexical_rules_for(PosTerminal(text[start - 1][1]))
+        rules_tried += len(rules)
+        for rule in rules:
+            if allowed is None or rule.left_side in allowed:
+                unary_edges += 1
+                add(inner, rule.left_side, rule, start, 1, None, ())
+    for partition in irange(1, length-1):
+        # Only rules whose children have been derived are looked at
+        right_span = chart.span(start+partition, length-partition)
+        if empty(right_span):
+            continue
+        for left_symbol, left in chart.span(start, partition).items():
+            rules = grammar.binary_rules_with_left(left_symbol)
+            rules_tried += len(rules)
+            for rule in rules:
+                right = right_span.get(rule.right_side[1])
+                if right is not None and (allowed is None or rule.left_side in allowed):
+                    binary_edges += 1
+                    add(inner, rule.left_side, rule, start, length, partition, (left, right))
+    derived = inner.keys()
+    if beam is not None or threshold is not None:
+        # Prune on the best derivations first and then only apply the chains
+        # between kept symbols, so that no entry is derived from a pruned one
+        score = semiring.score
+        scores = {symbol: score(value) for symbol, value in inner.items()}
+        for symbol, value in inner.items():
+            for chain in semiring.unary_chains(grammar, symbol):
+                if allowed is None or chain.top in allowed:
+                    _max_into(scores, chain.top, scores[symbol] + chain.log_probability)
+        derived = scores.keys()
+        kept = prune_cell(scores, beam, threshold)
+        inner = {symbol: value for symbol, value in inner.items() if symbol in kept}
+        allowed = kept if allowed is None else kept & allowed
+    # Every chain is applied once to what was derived without unary rules,
+    # so the order doesn't matter.
+    cell = dict(inner)
+    for symbol, value in inner.items():
+        chains = semiring.unary_chains(grammar, symbol)
+        rules_tried += len(chains)
+        for chain in chains:
+            if allowed is None or chain.top in allowed:
+                unary_edges += 1
+                add(cell, chain.top, chain, start, length, None, (value,))
+    zero = semiring.zero
+    for symbol, value in cell.items():
+        if value != zero:
+            chart[start, length, symbol] = value
+    if stats is not None:
+        stats.rules_tried += rules_tried
+        stats.binary_edges += binary_edges
+        stats.unary_edges += unary_edges
+    return max(len(derived), len(cell))
+
+def recognize(grammar, text):
+    """Whether text has a parse, without building any"""
+    return build_semiring_chart(grammar, text, _semiring.BOOLEAN).get(
+        (1, len(text), "S"), False)
+
+def count_parses(grammar, text):
+    """Number of parses of text, len(parse(grammar, text)), without building any"""
+    return build_semiring_chart(grammar, text, _semiring.COUNTING).get(
+        (1, len(text), "S"), 0)
+
+def build_viterbi_chart(grammar, text, beam=None, threshold=None, allowed=None):
+    """
+    Like build_chart, but only keep the best scoring derivation per
+    (start, length, symbol), as a ViterbiEntry with backpointers.
+
+    allowed -- if not None, a function returning the set of symbols that
+        may be derived over (start, length), see coarse.CoarseToFine
+    """
+    return build_semiring_chart(grammar, text, _semiring.BEST_DERIVATION, beam, threshold,
+        allowed)
+
+def build_astar_chart(grammar, text, goal="S"):
+    """
+    Best-first, A* version of build_viterbi_chart. Items are taken from an
+    agenda ordered by their score plus the outside estimate of
+    Grammar.outside_estimates, and only combined with the items taken
+    before them. The estimates are admissible, so every item is taken with
+    its Viterbi score, and building stops once goal over the whole text is
+    taken.
+
+    Return the Chart of ViterbiEntry of the items taken. The goal is in it
+    iff the text has a parse.
+    """
+    grammar = _as_grammar(grammar)
+    assert all(len(rule.right_side) <= 2 for rule in grammar.rules)
+    text_len = len(text)
+    estimates = grammar.outside_estimates(text_len)
+    chart = Chart(text_len)
+    agenda = []
+    # Best score pushed so far per item, including the ones taken
+    pushed = {}
+    counter = itertools.count()
+    def push(start, length, symbol, score, rule, partition, bottom):
+        # Most items are worse than one pushed before, so their entry is
+        # only built once they make it onto the agenda
+        estimate = estimates[start - 1, text_len - start - length + 1].get(symbol)
+        if estimate is None:
+            return
+        key = (start, length, symbol)
+        if pushed.get(key, -math.inf) >= score or key in chart:
+            return
+        pushed[key] = score
+        heapq.heappush(agenda, (-score - estimate, next(counter), key,
+            ViterbiEntry(score, rule, partition, bottom)))
+    for start, (word, pos) in enumerate(text, 1):
+        for rule in grammar.lexical_rules_for(PosTerminal(pos)):
+            push(start, 1, rule.left_side, rule.probability.log(), rule, None, None)
+    while not empty(agenda):
+        _, _, key, entry = heapq.heappop(agenda)
+        if key in chart:
+            continue
+        chart[key] = entry
+        start, length, symbol = key
+        if key == (1, text_len, goal):
+            break
+        if not isinstance(entry.rule, UnaryChain):
+            for chain in grammar.unary_chains_for(symbol):
+                push(start, length, chain.top, entry.score + chain.log_probability,
+                    chain, None, entry)
+        # Only rules with symbol as a child are looked at, and only the
+        # siblings they need are looked up in the adjacent spans
+        end = start + length
+        rules = grammar.binary_rules_with_left(symbol)
+        if not empty(rules):
+            for right_length in irange(1, text_len - end + 1):
+                right_span = chart.span(end, right_length)
+                if empty(right_span):
+                    continue
+                for rule in rules:
+                    right = right_span.get(rule.right_side[1])
+                    if right is not None:
+                        push(start, length + right_length, rule.left_side,
+                            entry.score + right.score + rule.probability.log(),
+                            rule, length, None)
+        rules = grammar.binary_rules_with_right(symbol)
+        if not empty(rules):
+            for left_length in irange(1, start - 1):
+                left_span = chart.span(start - left_length, left_length)
+                if empty(left_span):
+                    continue
+                for rule in rules:
+                    left = left_span.get(rule.right_side[0])
+                    if left is not None:
+                        push(start - left_length, left_length + length, rule.left_side,
+                            left.score + entry.score + rule.probability.log(),
+                            rule, left_length, None)
+    return chart
+
+def viterbi_tree(chart, start, length, symbol):
+    """Follow the backpointers of a Viterbi chart and build the tree they describe"""
+    return _viterbi_tree(chart, start, length, symbol, chart[start, length, symbol])
+
+def _viterbi_tree(chart, start, length, symbol, entry):
+    if isinstance(entry.rule, UnaryChain):
+        child = _viterbi_tree(chart, start, length, entry.rule.bottom, entry.bottom)
+        return entry.rule.wrap(child, start, length)
+    right_side = entry.rule.right_side
+    if entry.partition is not None:
+        partition = entry.partition
+        children = (
+            viterbi_tree(chart, start, partition, right_side[0]),
+            viterbi_tree(chart, start + partition, length - partition, right_side[1]))
+    else:
+        children = (HashableTree(right_side[0]),)
+    return HashableTree(symbol, *children, start=start, length=length)
+
 def replace_leafs_by_words(tree, text):
     text_iterator = iter(text)
     for preterminal in tree.preterminals():
@@ -59,23 +326,341 @@ def replace_leafs_by_words(tree, text):
         terminal.type_ = word
         #print(terminal)
 
-def parse(grammar, text, keep_posleafs=False):
+class IncrementalParser:
+    """
+    Parses a text one (word, pos) token at a time.
+
+    Every push fills only the cells of the spans ending at the new word, so
+    parsing a text word by word costs about as much as parsing it at once.
+    The Viterbi chart of the text so far is available as chart.
+    """
+    def __init__(self, grammar, beam=None, threshold=None):
+        self.grammar = _as_grammar(grammar)
+        assert all(len(rule.right_side) <= 2 for rule in self.grammar.rules)
+        self.beam = beam
+        self.threshold = threshold
+        self.text = []
+        self.chart = Chart(0)
+
+    def push(self, token):
+        """Add a (word, pos) token to the end of the text"""
+        self.text.append(token)
+        self.chart.grow()
+        end = len(self.text)
+        for length in irange(1, end):
+            _fill_cell(self.grammar, self.chart, self.text, end - length + 1, length,
+                _semiring.BEST_DERIVATION, self.beam, self.threshold)
+
+    def best(self, symbol="S", start=1, length=None, keep_posleafs=False):
+        """
+        Like parse_best for the text pushed so far, or for the span of it
+        given by start and length.
+        """
+        if length is None:
+            length = len(self.text) - start + 1
+        entry = self.chart.get((start, length, symbol))
+        if entry is None:
+            return None
+        tree = viterbi_tree(self.chart, start, length, symbol)
+        if not keep_posleafs:
+            replace_leafs_by_words(tree, self.text[start-1:start-1+length])
+        return tree, entry.score
+
+
+class ParseCache:
+    """
+    A bounded LRU cache for the results of parse, parse_best and
+    parse_kbest.
+
+    Parsing only looks at the POS tags, so results are cached with POS
+    terminals as leafs, keyed by the grammar object, the tag sequence and
+    the options. Words are put into copies of the cached trees on every hit.
+
+    Attributes:
+        maxsize: maximum number of results kept
+        hits, misses: counters of lookups
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_or_compute(self, grammar, text, options, compute):
+        """Return the cached result for the key, or cache and return compute()"""
+        key = (id(grammar), tuple(pos for word, pos in text), options)
+        entry = self._entries.get(key)
+        # The entry holds on to the grammar, so its id can't be reused while
+        # it is cached; the check is for ids of grammars evicted before.
+        if entry is not None and entry[0] is grammar:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        result = compute()
+        self._entries[key] = (grammar, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return result
+
+def _cached(cache, grammar, text, options, compute):
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(grammar, text, options, compute)
+
+def _result_tree(tree, text, keep_posleafs, shared):
+    """
+    Put the words into tree unless keep_posleafs. If tree is shared with
+    other results or a cache, this happens on a copy.
+    """
+    if shared:
+        tree = tree.copy()
+    if not keep_posleafs:
+        replace_leafs_by_words(tree, text)
+    return tree
+
+def _build_chart_reporting(grammar, text, beam, threshold, on_stats):
+    if on_stats is None:
+        return build_chart(grammar, text, beam, threshold)
+    stats = ParseStats()
+    chart = build_chart(grammar, text, beam, threshold, stats)
+    on_stats(stats)
+    return chart
+
+def parse(grammar, text, keep_posleafs=False, beam=None, threshold=None, cache=None,
+        on_stats=None):
     """
     Return False if the text doesn't match the grammar.
 
     grammar -- a list of Rule objects
     text -- a list of (word: str, pos: str) tuples
+    beam, threshold -- per cell pruning, see prune_cell
+    cache -- a ParseCache or None
+    on_stats -- if not None, called with a stats.ParseStats for the chart
+        built. Not called for results taken from the cache.
     """
-    chart = build_chart(grammar, text)
-    ret_trees = chart[1, len(text), "S"]
-    if not keep_posleafs:
-        for tree in ret_trees:
-            replace_leafs_by_words(tree, text)
-    return ret_trees
+    def compute():
+        chart = _build_chart_reporting(grammar, text, beam, threshold, on_stats)
+        root = chart.get((1, len(text), "S"))
+        return frozenset() if root is None else frozenset(root.trees(TreeFactory()))
+    trees = _cached(cache, grammar, text, ("parse", beam, threshold), compute)
+    # Trees built from the forest share subtrees
+    shared = cache is not None or not keep_posleafs
+    return {_result_tree(tree, text, keep_posleafs, shared) for tree in trees}
+
+def parse_best(grammar, text, keep_posleafs=False, engine=PYTHON_ENGINE,
+        beam=None, threshold=None, cache=None):
+    """
+    Return a (tree, log probability) tuple for the most probable parse of
+    text, or None if the text doesn't match the grammar.
+
+    grammar -- a list of Rule objects, or a dense.DenseGrammar for the
+        numpy engine
+    text -- a list of (word: str, pos: str) tuples
+    engine -- PYTHON_ENGINE, NUMPY_ENGINE, which fills a dense chart, or
+        ASTAR_ENGINE, which only builds the part of the chart it needs, see
+        build_astar_chart
+    beam, threshold -- per cell pruning, see prune_cell. The astar engine
+        is exact and doesn't prune.
+    cache -- a ParseCache or None
+    """
+    def compute():
+        if engine == NUMPY_ENGINE:
+            if dense is None:
+                raise ImportError("The numpy engine needs numpy")
+            return dense.parse_best(grammar, text, beam, threshold)
+        elif engine in (PYTHON_ENGINE, ASTAR_ENGINE):
+            if engine == ASTAR_ENGINE:
+                if beam is not None or threshold is not None:
+                    raise ValueError("The astar engine doesn't prune")
+                chart = build_astar_chart(grammar, text)
+            else:
+                chart = build_viterbi_chart(grammar, text, beam, threshold)
+            if (1, len(text), "S") not in chart:
+                return None
+            return viterbi_tree(chart, 1, len(text), "S"), chart[1, len(text), "S"].score
+        else:
+            raise ValueError("Unknown engine: " + repr(engine))
+    ret = _cached(cache, grammar, text, ("parse_best", engine, beam, threshold), compute)
+    if ret is None:
+        return None
+    tree, score = ret
+    return _result_tree(tree, text, keep_posleafs, cache is not None), score
+
+
+def parse_kbest(grammar, text, k, keep_posleafs=False, beam=None, threshold=None,
+        cache=None, on_stats=None):
+    """
+    Return a list of the (tree, log probability) tuples of the k most
+    probable parses of text, best first. Fewer if there are fewer parses.
+
+    Only the requested derivations are built, see forest.KBest.
+    """
+    def compute():
+        chart = _build_chart_reporting(grammar, text, beam, threshold, on_stats)
+        root = chart.get((1, len(text), "S"))
+        if root is None:
+            return ()
+        return tuple(KBest().trees(root, k))
+    ret = _cached(cache, grammar, text, ("parse_kbest", k, beam, threshold), compute)
+    return [(_result_tree(tree, text, keep_posleafs, cache is not None), score)
+        for tree, score in ret]
 
 
+# Set in every worker process of parse_many by _init_worker
+_worker_state = None
+
+def _init_worker(grammar, parse_function, kwargs):
+    global _worker_state
+    _worker_state = grammar, parse_function, kwargs
+
+def _parse_chunk(chunk):
+    grammar, parse_function, kwargs = _worker_state
+    return [(index, parse_function(grammar, text, **kwargs)) for index, text in chunk]
+
+def _length_buckets(indexed_sentences, chunksize):
+    """
+    Split (index, text) tuples into chunks of sentences of similar length,
+    longest first so that no worker is left with the long ones at the end.
+    """
+    ordered = sorted(indexed_sentences, key=lambda item: len(item[1]), reverse=True)
+    return [ordered[i:i+chunksize] for i in range(0, len(ordered), chunksize)]
+
+def _parse_as_completed(grammar, sentences, workers, parse_function, chunksize, kwargs):
+    indexed = enumerate(sentences)
+    if workers <= 1:
+        for index, text in indexed:
+            yield index, parse_function(grammar, text, **kwargs)
+        return
+    done = queue.Queue()
+    # Sentences are only read window by window, so memory stays bounded for
+    # long inputs.
+    window = workers * chunksize * 4
+    with multiprocessing.Pool(workers, _init_worker, (grammar, parse_function, kwargs)) as pool:
+        in_flight = 0
+        exhausted = False
+        while True:
+            while not exhausted and in_flight < 2 * workers:
+                batch = list(itertools.islice(indexed, window))
+                exhausted = empty(batch)
+                for chunk in _length_buckets(batch, chunksize):
+                    pool.apply_async(_parse_chunk, (chunk,),
+                        callback=done.put, error_callback=done.put)
+                    in_flight += 1
+            if in_flight == 0:
+                break
+            results = done.get()
+            in_flight -= 1
+            if isinstance(results, BaseException):
+                raise results
+            for result in results:
+                yield result
+
+def parse_many(grammar, sentences, workers=None, ordered=True, best=True,
+        chunksize=8, **kwargs):
+    """
+    Parse sentences in parallel in worker processes.
+
+    The grammar, with its indexes, is sent to every worker once.
+
+    grammar -- a list of Rule objects
+    sentences -- an iterable of texts as taken by parse
+    workers -- number of worker processes, default one per CPU. With 1,
+        everything runs in this process.
+    ordered -- if True, yield results in the order of sentences, otherwise
+        yield (index, result) tuples as soon as they are done
+    best -- use parse_best if True, else parse
+    chunksize -- number of sentences sent to a worker at a time
+    kwargs -- passed on to parse_best or parse
+    """
+    parse_function = parse_best if best else parse
+    if best and kwargs.get("engine") == NUMPY_ENGINE and dense is not None:
+        grammar = dense.as_dense_grammar(grammar)
+    else:
+        grammar = _as_grammar(grammar)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    results = _parse_as_completed(grammar, sentences, workers, parse_function,
+        chunksize, kwargs)
+    if not ordered:
+        for result in results:
+            yield result
+        return
+    pending = {}
+    next_index = 0
+    for index, result in results:
+        pending[index] = result
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+
+
+def read_tagged_sentence(line):
+    """
+    Turn a line of whitespace separated word/POS tokens into a text as
+    taken by parse.
+    """
+    ret = []
+    for token in line.split():
+        word, separator, pos = token.rpartition("/")
+        if empty(separator) or empty(word):
+            raise ValueError("Token without POS tag: " + repr(token))
+        ret.append((word, pos))
+    return ret
+
+def format_result(result, best):
+    """
+    The debinarized trees of a parse_best (if best) or parse result in
+    bracket notation. For parse_best this is one line, empty if there is no
+    parse, otherwise one line per tree followed by an empty line.
+    """
+    if best:
+        return ("" if result is None else result[0].debinarized().bracketed()) + "\n"
+    return "".join(tree.debinarized().bracketed() + "\n" for tree in result) + "\n"
+
 def main(argv):
-    pass
+    arguments = argparse.ArgumentParser(prog=argv[0],
+        description="Parse POS-tagged sentences, one per line, into bracketed trees. "
+            "An empty line is written for sentences without a parse.")
+    arguments.add_argument("files", nargs="*",
+        help="files containing word/POS tagged sentences, default stdin")
+    arguments.add_argument("--grammar", default=storage.GRAMMAR_PATH,
+        help="grammar written by training, default %(default)s")
+    arguments.add_argument("--workers", type=int, default=1,
+        help="number of worker processes, default %(default)s")
+    arguments.add_argument("--all", action="store_true",
+        help="write all parses instead of only the best, followed by an empty line")
+    arguments.add_argument("--engine", choices=[PYTHON_ENGINE, NUMPY_ENGINE, ASTAR_ENGINE],
+        default=PYTHON_ENGINE)
+    arguments.add_argument("--beam", type=int)
+    arguments.add_argument("--threshold", type=float)
+    arguments.add_argument("--cache", type=int, default=0,
+        help="size of the cache of results by POS tag sequence, per worker")
+    options = arguments.parse_args(argv[1:])
+    with storage.GrammarReader(options.grammar) as reader:
+        grammar = reader.read()
+    if empty(options.files):
+        lines = sys.stdin
+    else:
+        lines = itertools.chain.from_iterable(files_from_paths(options.files))
+    best = not options.all
+    kwargs = {"beam": options.beam, "threshold": options.threshold}
+    if options.cache > 0:
+        kwargs["cache"] = ParseCache(options.cache)
+    if best:
+        kwargs["engine"] = options.engine
+    results = parse_many(grammar, (read_tagged_sentence(line) for line in lines),
+        workers=options.workers, best=best, **kwargs)
+    for result in results:
+        sys.stdout.write(format_result(result, best))
+        sys.stdout.flush()
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -4,7 +4,13 @@ from unittest import TestCase, main, skip, expectedFailure
 from .parser import *
 from .common import Tree, AbstractTree, Rule
 from .util import empty
-from .testutil import POSTREE, grammar, unary_grammar, unary_grammar2, iter_eq
+from .testutil import POSTREE, grammar, unary_grammar, unary_grammar2, iter_eq, \
+    pp_grammar, pp_sentence
+import math
+from collections import defaultdict
+from contextlib import redirect_stdout
+import io, os, tempfile
+from . import storage
 
 class TreeTest(TestCase):
     def test_multiple_children(self):
@@ -40,8 +46,8 @@ class TestParse(TestCase):
             }
         self.assertEqual(set(result.keys()), expected_keys)
         for value in result.values():
-            self.assertIsInstance(value, set)
-            for entry in value:
+            self.assertIsInstance(value, ForestNode)
+            for entry in value.trees():
                 self.assertIsInstance(entry, AbstractTree)
 
     def test_true(self):
@@ -62,8 +68,8 @@ class TestParse(TestCase):
     def test_chart(self):
         result = build_chart(grammar, self.correct_sentence)
         for value in result.values():
-            self.assertIsInstance(value, set)
-            for entry in value:
+            self.assertIsInstance(value, ForestNode)
+            for entry in value.trees():
                 self.assertIsInstance(entry, AbstractTree)
                 if not empty(entry.children):
                     try:
@@ -74,6 +80,30 @@ class TestParse(TestCase):
                 for child in entry.children:
                     self.assertIsInstance(child, AbstractTree)
 
+    def test_ambiguous(self):
+        ambiguous_grammar = grammar | {
+            Rule("S", ["S", "PP"]),
+            Rule("NP", ["NP", "PP"])
+        }
+        sentence = self.correct_sentence + [("with", "P"), ("a", "Det"), ("fork", "N")]
+        self.assertEqual(len(parse(ambiguous_grammar, sentence)), 3)
+
+    def test_forest_is_packed(self):
+        ambiguous_grammar = grammar | {
+            Rule("S", ["S", "PP"]),
+            Rule("NP", ["NP", "PP"])
+        }
+        sentence = self.correct_sentence + [("with", "P"), ("a", "Det"), ("fork", "N")]
+        chart = build_chart(ambiguous_grammar, sentence)
+        root = chart[1, len(sentence), "S"]
+        # S -> NP VP, with both attachments packed into the VP, and S -> S PP
+        self.assertEqual(len(root.backpointers), 2)
+        # The NP "a fish with a fork" is shared by two derivations of the VP
+        np = chart[3, 5, "NP"]
+        vp = chart[2, 6, "VP"]
+        self.assertIn(np, [backpointer.children[1] for backpointer in vp.backpointers])
+        self.assertEqual(len(set(root.trees())), 3)
+
     def test_posprune(self):
         result = Grammar(grammar).rules
         for rule in result:
@@ -94,5 +124,355 @@ class TestParse(TestCase):
 #    self.assertEqual(found, {expected})
 
 
+class TestParseBest(TestCase):
+    def test_best(self):
+        tree, score = parse_best(pp_grammar, pp_sentence)
+        self.assertEqual(tree.children[1].children[0].type_, "VP")
+        self.assertAlmostEqual(score, math.log(0.3 * 0.3 * 0.6 * 0.5 * 0.5))
+
+    def test_is_one_of_all_parses(self):
+        tree, score = parse_best(pp_grammar, pp_sentence)
+        self.assertIn(tree, parse(pp_grammar, pp_sentence))
+        self.assertEqual(len(parse(pp_grammar, pp_sentence)), 2)
+
+    def test_words(self):
+        tree, score = parse_best(grammar, TestParse.correct_sentence)
+        self.assertEqual(tree, WORDTREE)
+        self.assertEqual(score, 0)
+
+    def test_unary(self):
+        tree, score = parse_best(unary_grammar2, TestParse.correct_unary_sentence2,
+            keep_posleafs=True)
+        self.assertEqual(tree.children[0].type_, "S2")
+
+    def test_unary_chain(self):
+        chain_grammar = {
+            Rule("S", ["A"], probability=0.5),
+            Rule("A", ["B"]),
+            Rule("B", ["NP", "VP"]),
+            Rule("S", ["NP", "VP"], probability=0.1),
+            Rule("NP", [PosTerminal("NP")]),
+            Rule("VP", [PosTerminal("VP")])
+        }
+        sentence = TestParse.correct_unary_sentence2
+        tree, score = parse_best(chain_grammar, sentence)
+        self.assertEqual([node.type_ for node in tree.subtrees][:3], ["S", "A", "B"])
+        self.assertAlmostEqual(score, math.log(0.5))
+        self.assertEqual(len(parse(chain_grammar, sentence)), 2)
+
+    def test_false(self):
+        self.assertIsNone(parse_best(grammar, [("she", "NP"), ("fish", "N"), ("eats", "V")]))
+
+
+class TestAStar(TestCase):
+    def assertSameBest(self, grammar, text):
+        self.assertEqual(parse_best(grammar, text, engine=ASTAR_ENGINE), parse_best(grammar, text))
+
+    def test_same_as_parse_best(self):
+        self.assertSameBest(pp_grammar, pp_sentence)
+        self.assertSameBest(grammar, TestParse.correct_sentence)
+        self.assertSameBest(unary_grammar2, TestParse.correct_unary_sentence2)
+        self.assertSameBest(TestParseKBest.ambiguous_grammar, pp_sentence)
+
+    def test_unary_chain(self):
+        chain_grammar = Grammar({
+            Rule("S", ["A"], probability=0.5),
+            Rule("A", ["B"]),
+            Rule("B", ["NP", "VP"]),
+            Rule("S", ["NP", "VP"], probability=0.1),
+            Rule("NP", [PosTerminal("NP")]),
+            Rule("VP", [PosTerminal("VP")])
+        })
+        self.assertSameBest(chain_grammar, TestParse.correct_unary_sentence2)
+
+    def test_false(self):
+        self.assertIsNone(parse_best(grammar, [("she", "NP"), ("fish", "N"), ("eats", "V")],
+            engine=ASTAR_ENGINE))
+
+    def test_explores_less(self):
+        sentence = pp_sentence + [("with", "P"), ("a", "Det"), ("fork", "N")] * 2
+        chart = build_astar_chart(pp_grammar, sentence)
+        self.assertLess(len(chart), len(build_viterbi_chart(pp_grammar, sentence)))
+        self.assertAlmostEqual(chart[1, len(sentence), "S"].score,
+            parse_best(pp_grammar, sentence)[1])
+
+    def test_no_pruning(self):
+        with self.assertRaises(ValueError):
+            parse_best(pp_grammar, pp_sentence, engine=ASTAR_ENGINE, beam=2)
+
+
+class TestParseStats(TestCase):
+    def test_counts(self):
+        stats = ParseStats()
+        chart = build_chart(pp_grammar, pp_sentence, stats=stats)
+        backpointers = [backpointer for node in chart.values() for backpointer in node.backpointers]
+        self.assertEqual(stats.sentences, 1)
+        self.assertEqual(stats.words, 7)
+        self.assertEqual(stats.cells_visited, 28)
+        self.assertEqual(stats.binary_edges,
+            sum(1 for backpointer in backpointers if backpointer.partition is not None))
+        self.assertEqual(stats.unary_edges,
+            sum(1 for backpointer in backpointers if backpointer.partition is None))
+        self.assertGreaterEqual(stats.rules_tried, stats.edges)
+        self.assertEqual(stats.peak_entries, len(chart))
+        self.assertEqual(set(stats.time_by_length), set(range(1, 8)))
+
+    def test_peak_with_pruning(self):
+        stats = ParseStats()
+        # V and VP over "eats", one of which is pruned
+        chart = build_chart(TestParseKBest.ambiguous_grammar, [("eats", "V")], beam=1,
+            stats=stats)
+        self.assertEqual(stats.peak_entries, 2)
+        self.assertEqual(len(chart), 1)
+
+    def test_callback(self):
+        reported = []
+        cache = ParseCache()
+        for i in range(2):
+            parse(pp_grammar, pp_sentence, cache=cache, on_stats=reported.append)
+        self.assertEqual(len(reported), 1)
+        total = ParseStats()
+        for stats in reported * 2:
+            total += stats
+        self.assertEqual(total.edges, 2 * reported[0].edges)
+
+
+class TestParseKBest(TestCase):
+    ambiguous_grammar = pp_grammar | {
+        Rule("S", ["S", "PP"], probability=0.1),
+        Rule("VP", ["V"], probability=0.05),
+        Rule("V", ["VP"], probability=0.5)
+    }
+
+    def test_order(self):
+        result = parse_kbest(self.ambiguous_grammar, pp_sentence, 10)
+        scores = [score for tree, score in result]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(result[0], parse_best(self.ambiguous_grammar, pp_sentence))
+
+    def test_all_parses(self):
+        result = parse_kbest(self.ambiguous_grammar, pp_sentence, 100)
+        trees = [tree for tree, score in result]
+        self.assertEqual(len(trees), len(set(trees)))
+        self.assertEqual(set(trees), parse(self.ambiguous_grammar, pp_sentence))
+
+    def test_k(self):
+        self.assertEqual(len(parse_kbest(pp_grammar, pp_sentence, 1)), 1)
+        self.assertEqual(len(parse_kbest(pp_grammar, pp_sentence, 5)), 2)
+        self.assertEqual(parse_kbest(grammar, [("she", "NP"), ("fish", "N")], 5), [])
+
+    def test_scores(self):
+        (first, first_score), (second, second_score) = parse_kbest(pp_grammar, pp_sentence, 2)
+        self.assertAlmostEqual(first_score, math.log(0.3 * 0.3 * 0.6 * 0.5 * 0.5))
+        self.assertAlmostEqual(second_score, math.log(0.3 * 0.6 * 0.2 * 0.5 * 0.5))
+
+
+class TestPruning(TestCase):
+    def test_prune_cell(self):
+        scores = {"A": -1, "B": -2, "C": -5, "D": -1}
+        self.assertEqual(prune_cell(scores), set(scores))
+        self.assertEqual(prune_cell(scores, beam=2), {"A", "D"})
+        self.assertEqual(prune_cell(scores, beam=1), {"A"})
+        self.assertEqual(prune_cell(scores, threshold=1.5), {"A", "B", "D"})
+        self.assertEqual(prune_cell(scores, beam=3, threshold=0.5), {"A", "D"})
+        self.assertEqual(prune_cell({}, beam=1, threshold=1), set())
+
+    def test_beam(self):
+        chart = build_chart(pp_grammar, pp_sentence, beam=1)
+        spans = defaultdict(set)
+        for start, length, symbol in chart:
+            spans[start, length].add(symbol)
+        self.assertTrue(all(len(symbols) == 1 for symbols in spans.values()))
+        self.assertEqual(parse_best(pp_grammar, pp_sentence, beam=1),
+            parse_best(pp_grammar, pp_sentence))
+
+    def test_pruned_are_not_children(self):
+        sentence = TestParse.correct_unary_sentence
+        # V and VP over "eats" score the same, the beam keeps V
+        self.assertFalse(parse(unary_grammar, sentence, beam=1))
+        self.assertIsNone(parse_best(unary_grammar, sentence, beam=1))
+        self.assertTrue(parse(unary_grammar, sentence, threshold=0))
+        self.assertIsNotNone(parse_best(unary_grammar, sentence, threshold=0))
+
+    # X has a derivation of its own and a better one through Y, which is pruned
+    # with beam=2: S and X are kept, tied with Y
+    pruned_chain_grammar = {
+        Rule("S", ["X"], 1),
+        Rule("X", [PosTerminal("T")], 0.3),
+        Rule("X", ["Y"], 1),
+        Rule("Y", [PosTerminal("T")], 0.45)
+    }
+
+    def test_pruned_are_not_chain_children(self):
+        sentence = [("t", "T")]
+        expected = Tree("S", Tree("X", Tree("t"))).hashable()
+        self.assertEqual(parse(self.pruned_chain_grammar, sentence, beam=2), {expected})
+        self.assertEqual(parse_kbest(self.pruned_chain_grammar, sentence, 5, beam=2),
+            [(expected, math.log(0.3))])
+        self.assertEqual(parse_best(self.pruned_chain_grammar, sentence, beam=2),
+            (expected, math.log(0.3)))
+        chart = build_chart(self.pruned_chain_grammar, sentence, beam=2)
+        self.assertEqual(set(chart.keys()), {(1, 1, "S"), (1, 1, "X")})
+        self.assertEqual(chart[1, 1, "X"].score, math.log(0.3))
+
+    def test_threshold(self):
+        ambiguous_tag = {
+            Rule("S", ["NP", "VP"]),
+            Rule("NP", [PosTerminal("X")], probability=0.9),
+            Rule("VP", [PosTerminal("X")], probability=0.1)
+        }
+        sentence = [("fish", "X"), ("fish", "X")]
+        # VP is log(9) below NP in every cell
+        self.assertFalse(parse(ambiguous_tag, sentence, threshold=1))
+        self.assertIsNone(parse_best(ambiguous_tag, sentence, threshold=1))
+        self.assertTrue(parse(ambiguous_tag, sentence, threshold=3))
+        self.assertIsNotNone(parse_best(ambiguous_tag, sentence, threshold=3))
+
+class TestParseMany(TestCase):
+    sentences = [
+        pp_sentence,
+        TestParse.correct_sentence,
+        [("she", "NP"), ("fish", "N"), ("eats", "V")],
+        pp_sentence[:4],
+        [("she", "NP"), ("eats", "VP")]
+    ] * 3
+
+    def test_ordered(self):
+        expected = [parse_best(pp_grammar, text) for text in self.sentences]
+        self.assertEqual(list(parse_many(pp_grammar, self.sentences, workers=2, chunksize=2)),
+            expected)
+
+    def test_as_completed(self):
+        expected = [parse(pp_grammar, text) for text in self.sentences]
+        found = dict(parse_many(pp_grammar, iter(self.sentences), workers=2,
+            ordered=False, best=False, chunksize=1))
+        self.assertEqual(found, dict(enumerate(expected)))
+
+    def test_single_process(self):
+        found = list(parse_many(pp_grammar, self.sentences, workers=1, keep_posleafs=True))
+        self.assertEqual(found,
+            [parse_best(pp_grammar, text, keep_posleafs=True) for text in self.sentences])
+
+
+class TestIncrementalParser(TestCase):
+    def test_same_as_parse_best(self):
+        parser = IncrementalParser(pp_grammar)
+        for i, token in enumerate(pp_sentence):
+            parser.push(token)
+            self.assertEqual(parser.best(), parse_best(pp_grammar, pp_sentence[:i+1]))
+        self.assertEqual(set(parser.chart.keys()),
+            set(build_viterbi_chart(pp_grammar, pp_sentence).keys()))
+
+    def test_prefix_cells(self):
+        parser = IncrementalParser(pp_grammar)
+        for token in pp_sentence[:5]:
+            parser.push(token)
+        self.assertIsNone(parser.best())
+        tree, score = parser.best("NP", start=3, length=2)
+        self.assertEqual(list(tree.terminals()), ["a", "fish"])
+        self.assertIn((2, 3, "VP"), parser.chart)
+        self.assertNotIn((2, 4, "VP"), parser.chart)
+
+    def test_pruning(self):
+        parser = IncrementalParser(pp_grammar, beam=1)
+        for token in pp_sentence:
+            parser.push(token)
+        self.assertEqual(parser.best(), parse_best(pp_grammar, pp_sentence, beam=1))
+
+
+class TestParseCache(TestCase):
+    other_words = [("he", "NP"), ("likes", "V"), ("the", "Det"), ("dog", "N"),
+        ("on", "P"), ("the", "Det"), ("couch", "N")]
+
+    def test_hits(self):
+        cache = ParseCache()
+        first = parse_best(pp_grammar, pp_sentence, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        second = parse_best(pp_grammar, self.other_words, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(first, parse_best(pp_grammar, pp_sentence))
+        self.assertEqual(second, parse_best(pp_grammar, self.other_words))
+        self.assertEqual(list(second[0].terminals()), [word for word, pos in self.other_words])
+
+    def test_results_are_fresh(self):
+        cache = ParseCache()
+        for i in range(2):
+            trees = parse(pp_grammar, pp_sentence, cache=cache)
+            self.assertEqual(trees, parse(pp_grammar, pp_sentence))
+            kbest = parse_kbest(pp_grammar, self.other_words, 2, cache=cache)
+            self.assertEqual(kbest, parse_kbest(pp_grammar, self.other_words, 2))
+            raw = parse_best(pp_grammar, pp_sentence, keep_posleafs=True, cache=cache)
+            self.assertEqual(raw, parse_best(pp_grammar, pp_sentence, keep_posleafs=True))
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+    def test_keyed_by_grammar_and_options(self):
+        cache = ParseCache()
+        g1 = Grammar(pp_grammar)
+        g2 = Grammar(pp_grammar)
+        parse_best(g1, pp_sentence, cache=cache)
+        parse_best(g2, pp_sentence, cache=cache)
+        parse_best(g1, pp_sentence, beam=1, cache=cache)
+        parse(g1, pp_sentence, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 4))
+
+    def test_lru(self):
+        cache = ParseCache(maxsize=2)
+        sentences = [pp_sentence, pp_sentence[:4], TestParse.correct_unary_sentence2]
+        for text in sentences + sentences[1:]:
+            parse_best(pp_grammar, text, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        self.assertEqual(len(cache), 2)
+        parse_best(pp_grammar, pp_sentence, cache=cache)
+        self.assertEqual(cache.misses, 4)
+
+
+class TestMain(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.grammar_path = os.path.join(self.directory.name, "grammar.pkl")
+        with storage.GrammarWriter(self.grammar_path) as writer:
+            writer.write(Grammar(pp_grammar))
+        self.input_path = os.path.join(self.directory.name, "input.txt")
+        with open(self.input_path, "w") as file:
+            file.write("she/NP eats/V a/Det fish/N\n")
+            file.write("she/NP fish/N eats/V\n")
+            file.write(" ".join(word + "/" + pos for word, pos in pp_sentence) + "\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_main(self, *arguments):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main(["parser", "--grammar", self.grammar_path] + list(arguments))
+        return output.getvalue()
+
+    def test_best(self):
+        self.assertEqual(self.run_main(self.input_path).splitlines(), [
+            "(S (NP she) (VP (V eats) (NP (Det a) (N fish))))",
+            "",
+            "(S (NP she) (VP (VP (V eats) (NP (Det a) (N fish))) "
+                "(PP (P with) (NP (Det a) (N fork)))))"
+        ])
+
+    def test_workers(self):
+        self.assertEqual(self.run_main("--workers", "2", self.input_path),
+            self.run_main(self.input_path))
+
+    def test_cache(self):
+        self.assertEqual(self.run_main("--cache", "10", self.input_path, self.input_path),
+            self.run_main(self.input_path) * 2)
+
+    def test_all(self):
+        lines = self.run_main("--all", self.input_path).splitlines()
+        # Every sentence's parses are followed by an empty line
+        self.assertEqual([line.startswith("(S ") for line in lines],
+            [True, False, False, True, True, False])
+
+    def test_read_tagged_sentence(self):
+        self.assertEqual(read_tagged_sentence("a/DT 1/2/CD\n"), [("a", "DT"), ("1/2", "CD")])
+        self.assertRaises(ValueError, lambda: read_tagged_sentence("a"))
+
+
 if __name__ == '__main__':
     main()
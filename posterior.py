@@ -0,0 +1,149 @@
+"""
+Inside-outside over a dense chart, posterior probabilities of labelled spans
+and max-recall decoding.
+
+Everything is computed in log space with the array operations of the dense
+module, one span length at a time.
+"""
+
+import numpy as np
+from .common import HashableTree, PosTerminal, SplitTag
+from .dense import as_dense_grammar, build_dense_chart, INSIDE
+from .parser import replace_leafs_by_words
+from .util import irange
+
+
+class InsideOutside:
+    """
+    The result of inside_outside. All arrays are indexed by
+    [start, length, symbol] like DenseChart.scores and hold logarithms.
+
+    Attributes:
+        chart: the INSIDE DenseChart
+        outside: outside scores of the symbols on top of a cell
+        unary_outside: outside scores of the symbols a unary chain starts at
+        log_z: inside score of the whole sentence, -inf if it has no parse
+        posteriors: probability that a symbol labels the span in a parse.
+            Symbols in the middle of a unary chain are not counted.
+    """
+    def __init__(self, chart, outside, unary_outside, log_z):
+        self.chart = chart
+        self.outside = outside
+        self.unary_outside = unary_outside
+        self.log_z = log_z
+        if log_z == -np.inf:
+            self.posteriors = np.full(chart.scores.shape, -np.inf)
+        else:
+            self.posteriors = np.logaddexp(chart.scores + outside,
+                chart.inner + unary_outside) - log_z
+
+    def posterior(self, start, length, symbol):
+        symbol_id = self.chart.grammar.symbol_ids.get(symbol)
+        text_len = len(self.chart.text)
+        if symbol_id is None or not 1 <= start <= start + length - 1 <= text_len:
+            return 0.0
+        return float(np.exp(self.posteriors[start, length, symbol_id]))
+
+
+def _unary_outside(grammar, outside):
+    """Outside scores of the bottoms of unary chains, from those of their tops"""
+    scale = outside.max(axis=1, keepdims=True)
+    scale[scale == -np.inf] = 0
+    with np.errstate(divide="ignore"):
+        return np.log(np.exp(outside - scale) @ grammar.unary_sums) + scale
+
+
+def inside_outside(grammar, text):
+    """
+    Run the inside and outside passes for text, with "S" over the whole
+    text as the root, and return an InsideOutside.
+
+    grammar -- a list of Rule objects or a dense.DenseGrammar
+    """
+    grammar = as_dense_grammar(grammar)
+    chart = build_dense_chart(grammar, text, INSIDE)
+    text_len = len(text)
+    outside = np.full(chart.scores.shape, -np.inf)
+    unary_outside = np.full(chart.scores.shape, -np.inf)
+    log_z = chart.score(1, text_len, "S")
+    if log_z == -np.inf:
+        return InsideOutside(chart, outside, unary_outside, log_z)
+    outside[1, text_len, grammar.symbol_ids["S"]] = 0
+    binary = grammar.binary
+    left_ids = binary.children[:, 0]
+    right_ids = binary.children[:, 1]
+    reduceat = np.logaddexp.reduceat
+    for length in range(text_len, 0, -1):
+        starts = np.arange(1, text_len - length + 2)
+        unary = _unary_outside(grammar, outside[starts, length])
+        unary_outside[starts, length] = unary
+        # Outside of the derivations below unary chains
+        parents = np.logaddexp(outside[starts, length], unary)[:, binary.parent] + binary.logprob
+        for partition in irange(1, length - 1):
+            left = chart.scores[starts, partition][:, left_ids]
+            right = chart.scores[starts + partition, length - partition][:, right_ids]
+            outside[starts, partition] = np.logaddexp(outside[starts, partition],
+                binary.reduce_by_child(parents + right, 0, reduceat, grammar.num_symbols))
+            outside[starts + partition, length - partition] = np.logaddexp(
+                outside[starts + partition, length - partition],
+                binary.reduce_by_child(parents + left, 1, reduceat, grammar.num_symbols))
+    return InsideOutside(chart, outside, unary_outside, log_z)
+
+
+def max_recall_tree(result):
+    """
+    Return the binary tree with "S" at the root that maximizes the expected
+    number of correctly labelled spans (Goodman 1996), together with that
+    number, or None if the sentence has no parse.
+
+    Every span of the tree gets its most probable label that isn't a
+    SplitTag, since those are gone after debinarizing and can't be
+    correct. Only spans where all labels are SplitTags get one.
+
+    result -- an InsideOutside
+    """
+    if result.log_z == -np.inf:
+        return None
+    grammar = result.chart.grammar
+    text = result.chart.text
+    text_len = len(text)
+    posteriors = np.exp(result.posteriors)
+    countable = np.array([not isinstance(symbol, SplitTag) for symbol in grammar.symbols])
+    countable_posteriors = np.where(countable, posteriors, 0)
+    gains = countable_posteriors.max(axis=2)
+    # The label of a span is the symbol its gain comes from
+    labels = np.where(gains > 0, countable_posteriors.argmax(axis=2), posteriors.argmax(axis=2))
+    root = grammar.symbol_ids["S"]
+    labels[1, text_len] = root
+    gains[1, text_len] = posteriors[1, text_len, root]
+    # Best expected count and best partition of every span
+    best = np.zeros(gains.shape)
+    partitions = np.zeros(gains.shape, dtype=np.intp)
+    best[1:, 1] = gains[1:, 1]
+    for length in irange(2, text_len):
+        starts = np.arange(1, text_len - length + 2)
+        candidates = np.stack([best[starts, partition] + best[starts + partition, length - partition]
+            for partition in irange(1, length - 1)], axis=1)
+        partitions[starts, length] = candidates.argmax(axis=1) + 1
+        best[starts, length] = gains[starts, length] + candidates.max(axis=1)
+    def build(start, length):
+        symbol = grammar.symbols[labels[start, length]]
+        if length == 1:
+            children = (HashableTree(PosTerminal(text[start - 1][1])),)
+        else:
+            partition = int(partitions[start, length])
+            children = (build(start, partition),
+                build(start + partition, length - partition))
+        return HashableTree(symbol, *children, start=start, length=length)
+    return build(1, text_len), float(best[1, text_len])
+
+
+def parse_max_recall(grammar, text, keep_posleafs=False):
+    """
+    Like parser.parse_best, but return the max-recall tree and its expected
+    number of correct constituents, see max_recall_tree.
+    """
+    ret = max_recall_tree(inside_outside(grammar, text))
+    if ret is not None and not keep_posleafs:
+        replace_leafs_by_words(ret[0], text)
+    return ret
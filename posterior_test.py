@@ -0,0 +1,99 @@
+from unittest import TestCase, skipIf
+import math
+from .common import Rule, PosTerminal, SplitTag
+from .parser import parse_best, parse_kbest
+from .evaluate import count_correct_constituents
+from .testutil import grammar, pp_grammar, pp_sentence
+try:
+    import numpy
+    from .posterior import *
+except ImportError:
+    numpy = None
+
+VP_ATTACHMENT = 0.3 * 0.3 * 0.6 * 0.5 * 0.5
+NP_ATTACHMENT = 0.3 * 0.6 * 0.2 * 0.5 * 0.5
+
+@skipIf(numpy is None, "numpy is not installed")
+class TestInsideOutside(TestCase):
+    def setUp(self):
+        self.result = inside_outside(pp_grammar, pp_sentence)
+
+    def test_log_z(self):
+        self.assertAlmostEqual(math.exp(self.result.log_z), VP_ATTACHMENT + NP_ATTACHMENT)
+
+    def test_posteriors(self):
+        total = VP_ATTACHMENT + NP_ATTACHMENT
+        self.assertAlmostEqual(self.result.posterior(1, 7, "S"), 1)
+        self.assertAlmostEqual(self.result.posterior(1, 1, "NP"), 1)
+        self.assertAlmostEqual(self.result.posterior(2, 3, "VP"), VP_ATTACHMENT / total)
+        self.assertAlmostEqual(self.result.posterior(3, 5, "NP"), NP_ATTACHMENT / total)
+        self.assertAlmostEqual(self.result.posterior(3, 2, "NP"), 1)
+        self.assertEqual(self.result.posterior(1, 2, "S"), 0)
+        self.assertEqual(self.result.posterior(1, 7, "unknown"), 0)
+
+    def test_posteriors_match_enumeration(self):
+        parses = parse_kbest(pp_grammar, pp_sentence, 10, keep_posleafs=True)
+        total = sum(math.exp(score) for tree, score in parses)
+        for tree, score in parses:
+            for subtree in tree.subtrees:
+                if subtree._start is not None:
+                    expected = sum(math.exp(other_score) for other, other_score in parses
+                        if any(subtree.is_equal_constituent(node) for node in other.subtrees))
+                    self.assertAlmostEqual(
+                        self.result.posterior(subtree._start, subtree._length, subtree.type_),
+                        expected / total)
+
+    def test_unary_chain(self):
+        chain_grammar = {
+            Rule("S", ["A"], probability=0.5),
+            Rule("A", ["B"]),
+            Rule("B", ["NP", "VP"]),
+            Rule("S", ["NP", "VP"], probability=0.1),
+            Rule("NP", [PosTerminal("NP")]),
+            Rule("VP", [PosTerminal("VP")])
+        }
+        result = inside_outside(chain_grammar, [("she", "NP"), ("eats", "VP")])
+        self.assertAlmostEqual(math.exp(result.log_z), 0.6)
+        self.assertAlmostEqual(result.posterior(1, 2, "S"), 1)
+        self.assertAlmostEqual(result.posterior(1, 2, "B"), 0.5 / 0.6)
+        self.assertAlmostEqual(result.posterior(1, 1, "NP"), 1)
+
+    def test_no_parse(self):
+        result = inside_outside(grammar, [("she", "NP"), ("fish", "N")])
+        self.assertEqual(result.posterior(1, 1, "NP"), 0)
+        self.assertIsNone(max_recall_tree(result))
+
+
+@skipIf(numpy is None, "numpy is not installed")
+class TestMaxRecall(TestCase):
+    def test_tree(self):
+        tree, expected = parse_max_recall(pp_grammar, pp_sentence, keep_posleafs=True)
+        best, score = parse_best(pp_grammar, pp_sentence, keep_posleafs=True)
+        self.assertEqual(tree, best)
+        # All 13 labelled spans but VP over "eats a fish" are in both parses
+        self.assertAlmostEqual(expected, 12 + VP_ATTACHMENT / (VP_ATTACHMENT + NP_ATTACHMENT))
+
+    def test_maximizes_expected_recall(self):
+        parses = parse_kbest(pp_grammar, pp_sentence, 10, keep_posleafs=True)
+        total = sum(math.exp(score) for tree, score in parses)
+        def expected_correct(tree):
+            return sum(math.exp(score) * count_correct_constituents(tree, reference)
+                for reference, score in parses) / total
+        tree, expected = parse_max_recall(pp_grammar, pp_sentence, keep_posleafs=True)
+        for other, score in parses:
+            self.assertGreaterEqual(expected_correct(tree), expected_correct(other) - 1e-9)
+
+    def test_split_tag_not_label(self):
+        split_tag = SplitTag(("B", "C"))
+        rules = {Rule("S", ["A", split_tag], 0.6), Rule(split_tag, ["B", "C"], 1),
+            Rule("S", ["A", "X"], 0.4), Rule("X", ["B", "C"], 1)}
+        rules |= {Rule(symbol, [PosTerminal(symbol)], 1) for symbol in "ABC"}
+        text = [("a", "A"), ("b", "B"), ("c", "C")]
+        tree, expected = parse_max_recall(rules, text, keep_posleafs=True)
+        self.assertEqual(tree.children[1].type_, "X")
+        # S, A, B and C are in every parse, X in 40% of them
+        self.assertAlmostEqual(expected, 4.4)
+
+    def test_words(self):
+        tree, expected = parse_max_recall(pp_grammar, pp_sentence)
+        self.assertEqual(list(tree.terminals()), [word for word, pos in pp_sentence])
@@ -0,0 +1,214 @@
+"""
+Semirings for parser.build_semiring_chart.
+
+The value of a chart entry is the semiring sum over its derivations of the
+semiring product of the rules in each derivation. The same chart loop
+gives a yes/no answer, the number of parses, the best or the summed
+probability, the best derivation, all parse trees or the packed forest,
+depending on the semiring.
+"""
+
+import operator
+from collections import namedtuple
+from itertools import product
+from .common import HashableTree, Probability, UnaryChain, UnarySum
+from .forest import ForestNode, Backpointer
+
+
+class Semiring:
+    """
+    Subclasses define
+        zero -- the value of no derivation; chart entries equal to it are
+            left out
+        plus(a, b) -- the value of the derivations of both a and b
+        derive(rule, start, length, partition, children) -- the value of
+            the derivations of (start, length) that apply rule, a Rule or
+            the result of unary_chains, to children, the values of its
+            right side. partition is the length of the left child for
+            binary rules, None otherwise.
+    and, for semirings whose charts can be pruned, score(value), the log
+    probability parser.prune_cell ranks an entry by.
+    """
+    score = None
+
+    def add(self, cell, symbol, rule, start, length, partition, children):
+        """
+        Add the derivations described like for derive to cell, a dict from symbols
+        to values. Subclasses may do this in place.
+        """
+        value = self.derive(rule, start, length, partition, children)
+        old = cell.get(symbol)
+        cell[symbol] = value if old is None else self.plus(old, value)
+
+    def unary_chains(self, grammar, symbol):
+        """
+        What to apply to the derivations of symbol that don't start with a
+        unary rule: Grammar.unary_chains_for, the best chain per symbol
+        above it
+        """
+        return grammar.unary_chains_for(symbol)
+
+
+class ProductSemiring(Semiring):
+    """
+    A semiring where the value of a derivation is the product (times) of
+    the weight(rule) of its rules.
+    """
+    def __init__(self, zero, plus, times, weight, score=None):
+        self.zero = zero
+        self.plus = plus
+        self.times = times
+        self.weight = weight
+        if score is not None:
+            self.score = score
+
+    def derive(self, rule, start, length, partition, children):
+        if isinstance(rule, UnaryChain):
+            value = self.weight(rule.rules[0])
+            for chain_rule in rule.rules[1:]:
+                value = self.times(value, self.weight(chain_rule))
+        else:
+            value = self.weight(rule)
+        for child in children:
+            value = self.times(value, child)
+        return value
+
+
+class InsideSemiring(ProductSemiring):
+    """
+    The summed Probability of all derivations, including all unary
+    derivations between two symbols instead of only the best chain
+    """
+    def __init__(self):
+        super().__init__(Probability(0), operator.add, operator.mul,
+            operator.attrgetter("probability"))
+
+    def unary_chains(self, grammar, symbol):
+        return grammar.unary_sums_for(symbol)
+
+    def derive(self, rule, start, length, partition, children):
+        if isinstance(rule, UnarySum):
+            return rule.probability * children[0]
+        return super().derive(rule, start, length, partition, children)
+
+
+class DerivationSemiring(Semiring):
+    """
+    All derivations, as a frozenset of HashableTree.
+
+    factory -- builds the tree nodes, like HashableTree or a
+        common.TreeFactory, which makes the set operations cheap
+    """
+    zero = frozenset()
+    plus = staticmethod(operator.or_)
+
+    def __init__(self, factory=HashableTree):
+        self.factory = factory
+
+    def derive(self, rule, start, length, partition, children):
+        factory = self.factory
+        if isinstance(rule, UnaryChain):
+            return frozenset(rule.wrap(tree, start, length, factory) for tree in children[0])
+        if len(children) == 0:
+            return frozenset((factory(rule.left_side, factory(rule.right_side[0]),
+                start=start, length=length),))
+        return frozenset(factory(rule.left_side, *trees, start=start, length=length)
+            for trees in product(*children))
+
+
+class ForestSemiring(Semiring):
+    """
+    All derivations, packed as a forest.ForestNode per chart entry. Nodes
+    are ranked for pruning by their best derivation.
+    """
+    zero = None
+
+    def derive(self, rule, start, length, partition, children):
+        symbol = rule.top if isinstance(rule, UnaryChain) else rule.left_side
+        cell = {}
+        self.add(cell, symbol, rule, start, length, partition, children)
+        return cell[symbol]
+
+    @staticmethod
+    def plus(a, b):
+        a.backpointers.extend(b.backpointers)
+        a.score = max(a.score, b.score)
+        a.inner_score = max(a.inner_score, b.inner_score)
+        return a
+
+    def add(self, cell, symbol, rule, start, length, partition, children):
+        if partition is not None:
+            left, right = children
+            score = left.score + right.score + rule.probability.log()
+        elif isinstance(rule, UnaryChain):
+            # Chains of the unary closure start at a derivation without one
+            score = children[0].inner_score + rule.log_probability
+        else:
+            score = rule.probability.log()
+        backpointer = Backpointer(rule, partition, children)
+        # In place, the nodes of a cell are only shared once it is filled
+        node = cell.get(symbol)
+        if node is None:
+            node = cell[symbol] = ForestNode(symbol, start, length)
+        node.add(backpointer, score)
+
+    @staticmethod
+    def score(node):
+        return node.score
+
+
+ViterbiEntry = namedtuple("ViterbiEntry", "score rule partition bottom")
+ViterbiEntry.__doc__ = """
+Best derivation of a symbol over a span.
+
+score -- log probability of the derivation
+rule -- the rule applied at the top of the derivation, or a UnaryChain
+partition -- length of the left child for binary rules, None otherwise
+bottom -- for a UnaryChain, the ViterbiEntry of the derivation it starts
+    at, None otherwise
+"""
+
+class BestDerivationSemiring(Semiring):
+    """The best derivation, as a ViterbiEntry with backpointers"""
+    zero = None
+
+    def derive(self, rule, start, length, partition, children):
+        cell = {}
+        self.add(cell, None, rule, start, length, partition, children)
+        return cell[None]
+
+    @staticmethod
+    def plus(a, b):
+        # The first of equally good derivations is kept
+        return b if b.score > a.score else a
+
+    def add(self, cell, symbol, rule, start, length, partition, children):
+        # Entries are only built for better derivations
+        if partition is not None:
+            left, right = children
+            score = left.score + right.score + rule.probability.log()
+            bottom = None
+        elif isinstance(rule, UnaryChain):
+            score = children[0].score + rule.log_probability
+            bottom = children[0]
+        else:
+            score = rule.probability.log()
+            bottom = None
+        old = cell.get(symbol)
+        if old is None or old.score < score:
+            cell[symbol] = ViterbiEntry(score, rule, partition, bottom)
+
+    @staticmethod
+    def score(entry):
+        return entry.score
+
+
+BOOLEAN = ProductSemiring(False, operator.or_, operator.and_,
+    lambda rule: float(rule.probability) > 0)
+COUNTING = ProductSemiring(0, operator.add, operator.mul, lambda rule: 1)
+VITERBI = ProductSemiring(Probability(0), max, operator.mul,
+    operator.attrgetter("probability"), Probability.log)
+INSIDE = InsideSemiring()
+DERIVATIONS = DerivationSemiring()
+FOREST = ForestSemiring()
+BEST_DERIVATION = BestDerivationSemiring()
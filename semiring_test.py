@@ -0,0 +1,84 @@
+from unittest import TestCase, skipIf
+import math
+import random
+from .semiring import *
+from .common import Probability, Rule, PosTerminal
+from .parser import build_chart, build_viterbi_chart, parse, parse_best, recognize, \
+    count_parses
+from .parser import dense
+from .parser_test import TestParseKBest
+from .testutil import grammar, pp_grammar, pp_sentence
+
+VP_ATTACHMENT = 0.3 * 0.3 * 0.6 * 0.5 * 0.5
+NP_ATTACHMENT = 0.3 * 0.6 * 0.2 * 0.5 * 0.5
+
+class TestSemiringChart(TestCase):
+    def root(self, semiring, grammar=pp_grammar, text=pp_sentence):
+        return build_chart(grammar, text, semiring=semiring).get((1, len(text), "S"))
+
+    def test_boolean(self):
+        self.assertTrue(self.root(BOOLEAN))
+        self.assertIsNone(self.root(BOOLEAN, grammar, [("she", "NP"), ("fish", "N")]))
+        self.assertTrue(recognize(pp_grammar, pp_sentence))
+        self.assertFalse(recognize(grammar, [("she", "NP"), ("fish", "N")]))
+
+    def test_counting(self):
+        self.assertEqual(self.root(COUNTING), 2)
+        ambiguous = TestParseKBest.ambiguous_grammar
+        self.assertEqual(count_parses(ambiguous, pp_sentence), len(parse(ambiguous, pp_sentence)))
+        self.assertEqual(count_parses(grammar, [("she", "NP"), ("fish", "N")]), 0)
+
+    def test_viterbi(self):
+        self.assertAlmostEqual(self.root(VITERBI).log(), parse_best(pp_grammar, pp_sentence)[1])
+        ambiguous = TestParseKBest.ambiguous_grammar
+        self.assertAlmostEqual(self.root(VITERBI, ambiguous).log(),
+            parse_best(ambiguous, pp_sentence)[1])
+
+    def test_inside(self):
+        self.assertAlmostEqual(float(self.root(INSIDE)), VP_ATTACHMENT + NP_ATTACHMENT)
+
+    def test_inside_unary_cycles(self):
+        # S =>+ S any number of times, through V and VP
+        cyclic = {Rule("S", ["VP"], 0.5), Rule("S", ["S", "S"], 0.5),
+            Rule("VP", ["V"], 0.5), Rule("V", ["VP"], 0.5), Rule("V", [PosTerminal("V")], 0.5)}
+        text = [("eats", "V")]
+        vp = 0.5 * 0.5 / 0.75
+        self.assertAlmostEqual(float(self.root(INSIDE, cyclic, text)), 0.5 * vp)
+
+    @skipIf(dense is None, "numpy is not installed")
+    def test_inside_same_as_dense(self):
+        random.seed(3)
+        symbols = ["S", "A", "B", "C"]
+        for i in range(20):
+            rules = {Rule(random.choice(symbols), random.sample(symbols, 2), random.random())
+                for j in range(8)}
+            rules |= {Rule(top, [bottom], random.random() * 0.4)
+                for top, bottom in [random.sample(symbols, 2) for j in range(4)]}
+            rules |= {Rule(symbol, [PosTerminal("T")], random.random()) for symbol in symbols}
+            text = [("t", "T")] * 3
+            chart = dense.build_dense_chart(rules, text, dense.INSIDE)
+            inside = self.root(INSIDE, rules, text) or Probability(0)
+            if inside.log() == -math.inf:
+                self.assertEqual(chart.score(1, 3, "S"), -math.inf)
+            else:
+                self.assertAlmostEqual(inside.log(), float(chart.score(1, 3, "S")))
+
+    def test_forest_and_best_derivation(self):
+        ambiguous = TestParseKBest.ambiguous_grammar
+        self.assertEqual(self.root(FOREST, ambiguous).score, parse_best(ambiguous, pp_sentence)[1])
+        self.assertEqual(set(build_chart(ambiguous, pp_sentence, semiring=BEST_DERIVATION).items()),
+            set(build_viterbi_chart(ambiguous, pp_sentence).items()))
+
+    def test_viterbi_pruning(self):
+        chart = build_chart(pp_grammar, pp_sentence, beam=1, semiring=VITERBI)
+        self.assertAlmostEqual(chart[1, len(pp_sentence), "S"].log(),
+            parse_best(pp_grammar, pp_sentence, beam=1)[1])
+
+    def test_derivations(self):
+        ambiguous = TestParseKBest.ambiguous_grammar
+        self.assertEqual(self.root(DERIVATIONS, ambiguous),
+            parse(ambiguous, pp_sentence, keep_posleafs=True))
+
+    def test_no_pruning(self):
+        with self.assertRaises(ValueError):
+            build_chart(pp_grammar, pp_sentence, beam=1, semiring=COUNTING)
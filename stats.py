@@ -0,0 +1,60 @@
+"""
+Counters of the work done by the parser, to see where parse time goes.
+"""
+
+from collections import defaultdict
+
+
+class ParseStats:
+    """
+    Work done building the chart of one sentence, or of many, after adding
+    up the stats of their sentences with +=.
+
+    Attributes:
+        sentences, words: what was parsed
+        cells_visited: (start, length) cells filled
+        rules_tried: rules looked up for children that were derived
+        binary_edges, unary_edges: derivations added to the chart, lexical
+            rules and unary chains counting as unary
+        peak_entries: most (start, length, symbol) entries in the chart at
+            once, the largest over all sentences
+        init_time: seconds spent on the lexical entries
+        fill_time: seconds spent on everything else
+        time_by_length: dict mapping span lengths to the seconds spent on
+            the spans of that length
+    """
+    _COUNTERS = ("sentences", "words", "cells_visited", "rules_tried", "binary_edges",
+        "unary_edges", "init_time", "fill_time")
+
+    def __init__(self):
+        for counter in self._COUNTERS:
+            setattr(self, counter, 0)
+        self.peak_entries = 0
+        self.time_by_length = defaultdict(float)
+
+    @property
+    def edges(self):
+        return self.binary_edges + self.unary_edges
+
+    @property
+    def total_time(self):
+        return self.init_time + self.fill_time
+
+    def __iadd__(self, other):
+        for counter in self._COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        self.peak_entries = max(self.peak_entries, other.peak_entries)
+        for length, seconds in other.time_by_length.items():
+            self.time_by_length[length] += seconds
+        return self
+
+    def as_dict(self):
+        """All counters as a dict, for writing out"""
+        ret = {counter: getattr(self, counter) for counter in self._COUNTERS}
+        ret["peak_entries"] = self.peak_entries
+        ret["time_by_length"] = dict(self.time_by_length)
+        return ret
+
+    def __repr__(self):
+        return "ParseStats(" + ", ".join(str.format("{}={!r}", key, value)
+            for key, value in sorted(self.as_dict().items())) + ")"
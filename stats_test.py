@@ -0,0 +1,28 @@
+from unittest import TestCase
+from .stats import *
+
+class TestParseStats(TestCase):
+    def stats(self, **counters):
+        ret = ParseStats()
+        for counter, value in counters.items():
+            setattr(ret, counter, value)
+        return ret
+
+    def test_empty(self):
+        stats = ParseStats()
+        self.assertEqual(stats.edges, 0)
+        self.assertEqual(stats.total_time, 0)
+        self.assertEqual(stats.as_dict()["time_by_length"], {})
+
+    def test_add(self):
+        total = self.stats(sentences=1, binary_edges=3, unary_edges=2, peak_entries=10)
+        total.time_by_length[1] = 0.5
+        other = self.stats(sentences=1, binary_edges=1, peak_entries=4, fill_time=1.0)
+        other.time_by_length[1] = 0.25
+        other.time_by_length[2] = 1.0
+        total += other
+        self.assertEqual(total.sentences, 2)
+        self.assertEqual(total.edges, 6)
+        self.assertEqual(total.peak_entries, 10)
+        self.assertEqual(total.total_time, 1.0)
+        self.assertEqual(total.time_by_length, {1: 0.75, 2: 1.0})
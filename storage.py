@@ -1,5 +1,23 @@
+"""
+Reading and writing grammars.
+
+Grammars are written in a compiled format by default: a symbol table, the
+rules as arrays grouped by arity, and the lookup indexes the parser uses,
+all precomputed. GrammarReader maps the file into memory, so reading is
+near-instant and worker processes share its pages; rules are only decoded
+when the parser looks them up. Pickled Grammar objects, the legacy format,
+can still be written and are read just the same.
+"""
+
+import sys
+import json
+import mmap
+import bisect
+from array import array
+from collections import Counter
 from . import log
-from .util import SelfClosingContextManager
+from .common import Grammar, Rule, PosTerminal, SplitTag, UnaryChain, AnnotatedSymbol
+from .util import SelfClosingContextManager, empty
 try:
     import cPickle as pickle
 except ImportError:
@@ -9,13 +27,295 @@ except ImportError:
 GRAMMAR_PATH = "grammar.pkl"
 PROTOCOL = pickle.HIGHEST_PROTOCOL
 
+COMPILED_FORMAT = "compiled"
+PICKLE_FORMAT = "pickle"
+
+MAGIC = b"CKYGRAM\0"
+FORMAT_VERSION = 1
+# Sections start at multiples of this, so they can be cast in place
+_ALIGNMENT = 8
+_HEADER_PREFIX = len(MAGIC) + 8
+
+
+def _encode_symbol(symbol):
+    if isinstance(symbol, str):
+        return symbol
+    if isinstance(symbol, PosTerminal):
+        return {"pos": symbol._postag}
+    if isinstance(symbol, SplitTag):
+        ret = {"split": [_encode_symbol(member) for member in symbol._members]}
+        if symbol._parent is not None:
+            ret["parent"] = _encode_symbol(symbol._parent)
+        return ret
+    if isinstance(symbol, AnnotatedSymbol):
+        return {"annotated": _encode_symbol(symbol.symbol),
+            "ancestors": [_encode_symbol(ancestor) for ancestor in symbol.ancestors]}
+    raise ValueError("Can't write symbol {!r} in the compiled format, use {}".format(
+        symbol, PICKLE_FORMAT))
+
+def _decode_symbol(data):
+    if isinstance(data, str):
+        return data
+    if "pos" in data:
+        return PosTerminal(data["pos"])
+    if "annotated" in data:
+        return AnnotatedSymbol(_decode_symbol(data["annotated"]),
+            tuple(_decode_symbol(ancestor) for ancestor in data["ancestors"]))
+    parent = data.get("parent")
+    return SplitTag((_decode_symbol(member) for member in data["split"]),
+        None if parent is None else _decode_symbol(parent))
+
+def _offsets(counts):
+    """CSR offsets: counts [2, 0, 1] give [0, 2, 2, 3]"""
+    ret = [0]
+    for count in counts:
+        ret.append(ret[-1] + count)
+    return ret
+
+
+def compile_grammar(grammar):
+    """Return the compiled format of grammar as bytes"""
+    if not isinstance(grammar, Grammar):
+        grammar = Grammar(grammar)
+    symbols = set()
+    for rule in grammar.rules:
+        symbols.add(rule.left_side)
+        symbols.update(rule.right_side)
+    symbols = sorted(symbols, key=repr)
+    ids = {symbol: i for i, symbol in enumerate(symbols)}
+    # Grouped by arity, and within a group by children, so that the rules
+    # with a given first child are contiguous
+    rules = sorted(grammar.rules, key=lambda rule: (len(rule.right_side),
+        [ids[child] for child in rule.right_side], ids[rule.left_side],
+        float(rule.probability)))
+    rule_ids = {rule: i for i, rule in enumerate(rules)}
+    arities = [len(rule.right_side) for rule in rules]
+    max_arity = max(arities, default=0)
+    first_children = [ids[rule.right_side[0]] for rule in rules if len(rule.right_side) >= 1]
+    arity_offsets = _offsets(arities.count(arity) for arity in range(max_arity + 1))
+    def offsets_by_first_child(arity):
+        group = Counter(first_children[arity_offsets[arity] - arity_offsets[1]:
+            arity_offsets[arity + 1] - arity_offsets[1]] if arity <= max_arity else [])
+        return _offsets(group[i] for i in range(len(symbols)))
+    chains = [chain for symbol in symbols for chain in grammar.unary_chains_for(symbol)]
+    sections = {
+        "arity_offsets": ("i", arity_offsets),
+        "rule_parent": ("i", [ids[rule.left_side] for rule in rules]),
+        "rule_children_offsets": ("i", _offsets(arities)),
+        "rule_children": ("i", [ids[child] for rule in rules for child in rule.right_side]),
+        "rule_probability": ("d", [float(rule.probability) for rule in rules]),
+        "rule_log_probability": ("d", [rule.probability.log() for rule in rules]),
+        "unary_child_offsets": ("i", offsets_by_first_child(1)),
+        "binary_left_offsets": ("i", offsets_by_first_child(2)),
+        "chain_bottom_offsets": ("i", _offsets(len(grammar.unary_chains_for(symbol))
+            for symbol in symbols)),
+        "chain_top": ("i", [ids[chain.top] for chain in chains]),
+        "chain_log_probability": ("d", [chain.log_probability for chain in chains]),
+        "chain_rule_offsets": ("i", _offsets(len(chain.rules) for chain in chains)),
+        "chain_rules": ("i", [rule_ids[rule] for chain in chains for rule in chain.rules]),
+    }
+    blobs = {name: array(typecode, values).tobytes()
+        for name, (typecode, values) in sections.items()}
+    header = {"symbols": [_encode_symbol(symbol) for symbol in symbols],
+        "byteorder": sys.byteorder, "sections": {}}
+    # The header holds the section offsets, which depend on its length
+    header_length = 0
+    while True:
+        offset = _align(_HEADER_PREFIX + header_length)
+        for name, (typecode, values) in sections.items():
+            header["sections"][name] = [offset, typecode, len(values)]
+            offset = _align(offset + len(blobs[name]))
+        encoded = json.dumps(header, ensure_ascii=True, sort_keys=True).encode("ascii")
+        if len(encoded) == header_length:
+            break
+        header_length = len(encoded)
+    data = bytearray(MAGIC)
+    data += FORMAT_VERSION.to_bytes(4, "little") + header_length.to_bytes(4, "little")
+    data += encoded
+    for name, (offset, typecode, count) in sorted(header["sections"].items(),
+            key=lambda item: item[1][0]):
+        data += bytes(offset - len(data))
+        data += blobs[name]
+    return bytes(data)
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+class CompiledGrammar(Grammar):
+    """
+    A Grammar over a buffer in the compiled format, usually a mapped file.
+
+    Nothing is decoded up front: rules and index entries are decoded when
+    first looked up and then kept. Everything needing all rules, like
+    iterating over the grammar, decodes all of them.
+    """
+    def __init__(self, buffer, path=None):
+        self._buffer = buffer
+        self._path = path
+        view = memoryview(buffer)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a compiled grammar")
+        version = int.from_bytes(view[len(MAGIC):len(MAGIC) + 4], "little")
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported compiled grammar version {}".format(version))
+        header_length = int.from_bytes(view[len(MAGIC) + 4:_HEADER_PREFIX], "little")
+        header = json.loads(bytes(view[_HEADER_PREFIX:_HEADER_PREFIX + header_length]))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError("Compiled grammar has the wrong byte order")
+        self._symbols = tuple(_decode_symbol(symbol) for symbol in header["symbols"])
+        self._symbol_ids = {symbol: i for i, symbol in enumerate(self._symbols)}
+        for name, (offset, typecode, count) in header["sections"].items():
+            size = array(typecode).itemsize
+            setattr(self, "_" + name, view[offset:offset + count * size].cast(typecode))
+        self._decoded_rules = {}
+        # Decoded lookups, filled as they are asked for
+        self._lookups = {}
+        self._by_arity = {}
+        self._binary_by_left = {}
+        self._binary_by_children = {}
+        self._unary_by_child = {}
+        self._chains_by_bottom = {}
+        self._inside_estimates = [{}]
+        self._outside_estimates = {}
+        self._unary_sums = None
+        self._binary_by_right = None
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as file:
+            # The mapping stays valid after the file is closed
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), path)
+
+    def __reduce__(self):
+        # Mapping the file again shares its pages with other processes
+        if self._path is not None:
+            return (CompiledGrammar.open, (self._path,))
+        return (CompiledGrammar, (bytes(self._buffer),))
+
+    def _rule(self, index):
+        rule = self._decoded_rules.get(index)
+        if rule is None:
+            children = self._rule_children[
+                self._rule_children_offsets[index]:self._rule_children_offsets[index + 1]]
+            rule = self._decoded_rules[index] = Rule(self._symbols[self._rule_parent[index]],
+                [self._symbols[child] for child in children], self._rule_probability[index])
+        return rule
+
+    def _rule_range(self, begin, end):
+        return tuple(self._rule(index) for index in range(begin, end))
+
+    def _lookup(self, cache, key, compute):
+        ret = cache.get(key)
+        if ret is None:
+            ret = cache[key] = compute(key)
+        return ret
+
+    def _arity_range(self, arity):
+        if arity + 1 >= len(self._arity_offsets):
+            return 0, 0
+        return self._arity_offsets[arity], self._arity_offsets[arity + 1]
+
+    def _by_first_child(self, offsets, arity, child):
+        """Range of the rules of arity whose first child is child"""
+        child_id = self._symbol_ids.get(child)
+        if child_id is None:
+            return 0, 0
+        begin = self._arity_range(arity)[0]
+        return begin + offsets[child_id], begin + offsets[child_id + 1]
+
+    @property
+    def rules(self):
+        return self._lookup(self._lookups, "rules",
+            lambda key: frozenset(self._rule_range(0, len(self._rule_parent))))
+
+    def _nnary_rules(self, n):
+        return iter(self._lookup(self._by_arity, n,
+            lambda n: self._rule_range(*self._arity_range(n))))
+
+    @property
+    def nonterminal_symbols(self):
+        return self._lookup(self._lookups, "nonterminal_symbols",
+            lambda key: frozenset(self._symbols[parent] for parent in self._rule_parent))
+
+    _nonterminal_symbols = nonterminal_symbols
+
+    def binary_rules_with_left(self, left):
+        return self._lookup(self._binary_by_left, left, self._decode_binary_with_left)
+
+    def _decode_binary_with_left(self, left):
+        return self._rule_range(*self._by_first_child(self._binary_left_offsets, 2, left))
+
+    def binary_rules_for(self, left, right):
+        return self._lookup(self._binary_by_children, (left, right), self._decode_binary)
+
+    def _decode_binary(self, children):
+        left, right = children
+        begin, end = self._by_first_child(self._binary_left_offsets, 2, left)
+        right_id = self._symbol_ids.get(right)
+        if begin == end or right_id is None:
+            return ()
+        # Rules with the same left child are sorted by the right one
+        rights = self._rule_children[self._rule_children_offsets[begin] + 1:
+            self._rule_children_offsets[end]:2]
+        lo = bisect.bisect_left(rights, right_id)
+        hi = bisect.bisect_right(rights, right_id, lo)
+        return self._rule_range(begin + lo, begin + hi)
+
+    def unary_rules_for(self, child):
+        if isinstance(child, PosTerminal):
+            return ()
+        return self._lookup(self._unary_by_child, child, self._decode_unary)
+
+    def lexical_rules_for(self, posterminal):
+        if not isinstance(posterminal, PosTerminal):
+            return ()
+        return self._lookup(self._unary_by_child, posterminal, self._decode_unary)
+
+    def _decode_unary(self, child):
+        return self._rule_range(*self._by_first_child(self._unary_child_offsets, 1, child))
+
+    def unary_chains_for(self, child):
+        return self._lookup(self._chains_by_bottom, child, self._decode_chains)
+
+    def _decode_chains(self, bottom):
+        bottom_id = self._symbol_ids.get(bottom)
+        if bottom_id is None:
+            return ()
+        chains = range(self._chain_bottom_offsets[bottom_id],
+            self._chain_bottom_offsets[bottom_id + 1])
+        return tuple(UnaryChain(self._symbols[self._chain_top[chain]], bottom,
+            tuple(self._rule(rule) for rule in self._chain_rules[
+                self._chain_rule_offsets[chain]:self._chain_rule_offsets[chain + 1]]),
+            self._chain_log_probability[chain]) for chain in chains)
+
+    @property
+    def _lexicon(self):
+        return {symbol: self.lexical_rules_for(symbol) for symbol in self._symbols
+            if isinstance(symbol, PosTerminal)}
+
+    @property
+    def _unary_closure(self):
+        return {symbol: self.unary_chains_for(symbol) for symbol in self._symbols
+            if not empty(self.unary_chains_for(symbol))}
+
+
 class GrammarWriter(SelfClosingContextManager):
-    def __init__(self):
-        self._file = open(GRAMMAR_PATH, "wb")
-        self._pickler = pickle.Pickler(self._file, PROTOCOL)
+    """
+    format -- COMPILED_FORMAT, or PICKLE_FORMAT for the legacy format, which
+        also takes symbols the compiled format can't store
+    """
+    def __init__(self, path=GRAMMAR_PATH, format=COMPILED_FORMAT):
+        if format not in (COMPILED_FORMAT, PICKLE_FORMAT):
+            raise ValueError("Unknown grammar format: " + repr(format))
+        self._format = format
+        self._file = open(path, "wb")
 
     def write(self, grammar):
-        self._pickler.dump(grammar)
+        if self._format == COMPILED_FORMAT:
+            self._file.write(compile_grammar(grammar))
+        else:
+            pickle.Pickler(self._file, PROTOCOL).dump(grammar)
         self.close() # Writing more than one grammar makes no sense
 
     def close(self):
@@ -23,12 +323,15 @@ class GrammarWriter(SelfClosingContextManager):
 
 
 class GrammarReader(SelfClosingContextManager):
-    def __init__(self):
-        self._file = open(GRAMMAR_PATH, "rb")
-        self._unpickler = pickle.Unpickler(self._file)
+    """Reads grammars in either format"""
+    def __init__(self, path=GRAMMAR_PATH):
+        self._path = path
+        self._file = open(path, "rb")
 
     def read(self):
-        return self._unpickler.load()
+        if self._file.peek(len(MAGIC))[:len(MAGIC)] == MAGIC:
+            return CompiledGrammar.open(self._path)
+        return pickle.Unpickler(self._file).load()
 
     def close(self):
         self._file.close()
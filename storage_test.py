@@ -1,6 +1,8 @@
 from unittest import TestCase
 from .storage import *
 from .common import Grammar, Rule
+from .testutil import unary_grammar2
+import os, pickle, tempfile
 
 class GrammarTestCase(TestCase):
     def setUp(self):
@@ -9,22 +11,109 @@ class GrammarTestCase(TestCase):
             Rule("B", ["x", "y"], probability=1),
             Rule("C", ["söalfkj", "asdf", "sadfas"])
         })
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, GRAMMAR_PATH)
+
+    def tearDown(self):
+        self.directory.cleanup()
 
 
 
 class TestGrammarStorageBasic(GrammarTestCase):
     def test_writing_reading(self):
-        writer = GrammarWriter()
+        writer = GrammarWriter(self.path)
         writer.write(self.grammar)
         writer.close()
-        reader = GrammarReader()
+        reader = GrammarReader(self.path)
         g = reader.read()
         self.assertEqual(g, self.grammar)
         reader.close()
 
 class TestGrammarContextManager(GrammarTestCase):
     def test_basic(self):
-        with GrammarWriter() as writer:
+        with GrammarWriter(self.path) as writer:
             writer.write(self.grammar)
-        with GrammarReader() as reader:
+        with GrammarReader(self.path) as reader:
             self.assertEqual(reader.read(), self.grammar)
+
+class TestCompiledGrammar(TestCase):
+    def setUp(self):
+        from .testutil import pp_grammar
+        from .training import parse_treebank, extract_grammar
+        treebank = "( (S (NP (DT the) (JJ big) (NN dog)) (VP (VBZ barks)) (. .)) )"
+        self.grammars = [Grammar(pp_grammar), Grammar(unary_grammar2),
+            extract_grammar(parse_treebank(treebank)),
+            extract_grammar(parse_treebank(treebank), horizontal=1, vertical=2)]
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "grammar")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def compiled(self, grammar):
+        with GrammarWriter(self.path) as writer:
+            writer.write(grammar)
+        with GrammarReader(self.path) as reader:
+            return reader.read()
+
+    def test_format(self):
+        compiled = self.compiled(self.grammars[0])
+        self.assertIsInstance(compiled, CompiledGrammar)
+        with open(self.path, "rb") as file:
+            self.assertEqual(file.read(len(MAGIC)), MAGIC)
+
+    def test_lookups(self):
+        for grammar in self.grammars:
+            compiled = self.compiled(grammar)
+            self.assertEqual(compiled, grammar)
+            self.assertEqual(set(compiled.binary_rules), set(grammar.binary_rules))
+            self.assertEqual(compiled.nonterminal_symbols, grammar.nonterminal_symbols)
+            symbols = {symbol for rule in grammar for symbol in (rule.left_side,) + rule.right_side}
+            for symbol in symbols | {"unknown"}:
+                self.assertEqual(set(compiled.binary_rules_with_left(symbol)),
+                    set(grammar.binary_rules_with_left(symbol)))
+                self.assertEqual(set(compiled.binary_rules_with_right(symbol)),
+                    set(grammar.binary_rules_with_right(symbol)))
+                self.assertEqual(set(compiled.unary_rules_for(symbol)),
+                    set(grammar.unary_rules_for(symbol)))
+                self.assertEqual(set(compiled.lexical_rules_for(symbol)),
+                    set(grammar.lexical_rules_for(symbol)))
+                self.assertEqual(compiled.unary_chains_for(symbol), grammar.unary_chains_for(symbol))
+                for right in symbols:
+                    self.assertEqual(set(compiled.binary_rules_for(symbol, right)),
+                        set(grammar.binary_rules_for(symbol, right)))
+
+    def test_parse(self):
+        from .testutil import pp_sentence
+        from .parser import parse_best, parse, ASTAR_ENGINE
+        compiled = self.compiled(self.grammars[0])
+        self.assertEqual(parse_best(compiled, pp_sentence), parse_best(self.grammars[0], pp_sentence))
+        self.assertEqual(parse_best(compiled, pp_sentence, engine=ASTAR_ENGINE),
+            parse_best(self.grammars[0], pp_sentence))
+        self.assertEqual(parse(compiled, pp_sentence), parse(self.grammars[0], pp_sentence))
+
+    def test_pickle(self):
+        compiled = self.compiled(self.grammars[2])
+        unpickled = pickle.loads(pickle.dumps(compiled))
+        self.assertIsInstance(unpickled, CompiledGrammar)
+        self.assertEqual(unpickled, self.grammars[2])
+
+    def test_legacy(self):
+        with GrammarWriter(self.path, PICKLE_FORMAT) as writer:
+            writer.write(self.grammars[0])
+        with open(self.path, "rb") as file:
+            self.assertNotEqual(file.read(len(MAGIC)), MAGIC)
+        with GrammarReader(self.path) as reader:
+            grammar = reader.read()
+        self.assertNotIsInstance(grammar, CompiledGrammar)
+        self.assertEqual(grammar, self.grammars[0])
+
+    def test_version(self):
+        data = bytearray(compile_grammar(self.grammars[0]))
+        data[len(MAGIC)] += 1
+        with self.assertRaises(ValueError):
+            CompiledGrammar(bytes(data))
+
+    def test_unsupported_symbol(self):
+        with self.assertRaises(ValueError):
+            compile_grammar({Rule(1, [2])})
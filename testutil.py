@@ -42,6 +42,25 @@ grammar = {
     Rule("Det", [PosTerminal("Det")])
 }
 
+# Ambiguous PP attachment, attaching to the VP is more probable
+pp_grammar = {
+    Rule("S", ["NP", "VP"], probability=1),
+    Rule("VP", ["V", "NP"], probability=0.6),
+    Rule("VP", ["VP", "PP"], probability=0.3),
+    Rule("VP", [PosTerminal("VP")], probability=0.1),
+    Rule("NP", ["NP", "PP"], probability=0.2),
+    Rule("NP", ["Det", "N"], probability=0.5),
+    Rule("NP", [PosTerminal("NP")], probability=0.3),
+    Rule("PP", ["P", "NP"], probability=1),
+    Rule("V", [PosTerminal("V")], probability=1),
+    Rule("P", [PosTerminal("P")], probability=1),
+    Rule("N", [PosTerminal("N")], probability=1),
+    Rule("Det", [PosTerminal("Det")], probability=1)
+}
+
+pp_sentence = [("she", "NP"), ("eats", "V"), ("a", "Det"), ("fish", "N"),
+    ("with", "P"), ("a", "Det"), ("fork", "N")]
+
 
 def tree(symbol, *children):
     """
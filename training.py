@@ -1,9 +1,10 @@
 #! /usr/bin/env python3
 
 import sys
+import argparse
 
 from collections import deque, defaultdict, Counter
-from .common import Tree, PosTerminal, Grammar, Rule
+from .common import Tree, PosTerminal, Grammar, Rule, AnnotatedSymbol
 from .util import empty, files_from_paths
 from . import util
 import itertools, re
@@ -11,9 +12,27 @@ from . import log
 from . import storage
 
 TOKEN_REGEX = re.compile(r"(\(|\)|[^ \n\t\)\(]+)")
-def tokenize(data):
-    """Tokenize a string or a file's contents"""
-    return TOKEN_REGEX.findall(data)
+def tokenize(data, chunks=None):
+    """
+    Tokenize a string or a file's contents, incrementally.
+
+    chunks -- the text as an iterable of strings, default util.chunks(data)
+    """
+    if chunks is None:
+        chunks = util.chunks(data)
+    # A token at the end of a chunk may continue in the next one
+    rest = ""
+    for chunk in chunks:
+        text = rest + chunk
+        rest = ""
+        for match in TOKEN_REGEX.finditer(text):
+            token = match.group()
+            if match.end() == len(text) and token not in ("(", ")"):
+                rest = token
+            else:
+                yield token
+    if rest:
+        yield rest
 
 def remove_additional_tag(token):
     """
@@ -24,15 +43,16 @@ def remove_additional_tag(token):
     """
     return token.split("-")[0]
 
-def parse_treebank(data):
+def parse_treebank(data, chunks=None):
     """
-    Parse a string containing a treebank.
+    Parse a string or a file containing a treebank.
 
-    Returns an iterator yielding all trees found in the treebank.
+    Returns an iterator yielding all trees found in the treebank, each as
+    soon as its top-level bracket closes. Files are read in chunks, see
+    tokenize.
     """
     stack = deque()
-    chars = util.characters(data)
-    for token in tokenize(chars):
+    for token in tokenize(data, chunks):
         if token == "(":
             if not empty(stack) and stack[-1].type_ is None:
                 # Ignore parentheses around the top-level tree
@@ -71,9 +91,39 @@ def count_rules(trees):
     return ret
 
 
-def extract_grammar(trees):
+def annotate_parents(tree, vertical):
+    """
+    Vertical Markovization: return a copy of tree whose phrasal nodes are
+    AnnotatedSymbols with the symbols of their vertical-1 closest
+    ancestors. Preterminals, leaves and the root are left alone.
+    """
+    def annotate(node, ancestors):
+        children = [annotate(child, (node.type_,) + ancestors)[0] for child in node.children]
+        is_preterminal = len(node.children) == 1 and empty(node.children[0].children)
+        type_ = node.type_
+        if not empty(ancestors) and not empty(node.children) and not is_preterminal:
+            type_ = AnnotatedSymbol(node.type_, ancestors[:vertical - 1])
+        return Tree(type_, *children), ancestors
+    return annotate(tree, ())[0]
+
+def extract_grammar(trees, horizontal=None, vertical=1, min_count=1):
+    """
+    Return the binarized Grammar with the relative frequencies of the rules
+    in trees.
+
+    horizontal -- horizontal Markovization of the binarization, see
+        Grammar.binarized
+    vertical -- 1 for plain symbols, 2 to annotate nodes with their parent,
+        3 with their parent and grandparent and so on, see annotate_parents
+    min_count -- rules seen fewer times are dropped before computing the
+        relative frequencies; compact.compact_grammar does the rest
+    """
+    if vertical > 1:
+        trees = (annotate_parents(tree, vertical) for tree in trees)
     rules = set()
     for left_symbol, right_dict in count_rules(trees).items():
+        right_dict = {right_symbols: count for right_symbols, count in right_dict.items()
+            if count >= min_count}
         total = sum(count for right_symbols, count in right_dict.items())
         log.debug("extract_grammar:total={}", total)
         for right_symbols, count in right_dict.items():
@@ -81,21 +131,31 @@ def extract_grammar(trees):
             log.debug("extract_grammar:left_symbol={}", left_symbol)
             log.debug("extract_grammar:right_symbols={}", right_symbols)
             rules.add(Rule(left_symbol, right_symbols, count / total))
-    return Grammar(rules).binarized()
+    return Grammar(rules).binarized(horizontal)
 
 
 def trees_from_files(files):
     for file in files:
         log.info("Reading file {}", file.name)
-        contents = file.read() # Files shouldn't be larger than 100k in size so this is fine
-        for tree in parse_treebank(contents):
+        for tree in parse_treebank(file, util.read_ahead(util.chunks(file))):
             yield tree
 
 
 def main(argv):
-    paths = argv[1:]
-    log.info("Training from files: {}", paths)
-    grammar = extract_grammar( trees_from_files(files_from_paths(paths)))
+    arguments = argparse.ArgumentParser(prog=argv[0],
+        description="Extract a grammar from treebank files and write it to "
+            + storage.GRAMMAR_PATH)
+    arguments.add_argument("paths", nargs="*", help="treebank files")
+    arguments.add_argument("--horizontal", type=int,
+        help="horizontal Markovization order, default none")
+    arguments.add_argument("--vertical", type=int, default=1,
+        help="vertical Markovization order, default %(default)s")
+    arguments.add_argument("--min-count", type=int, default=1,
+        help="drop rules seen fewer times, default %(default)s")
+    options = arguments.parse_args(argv[1:])
+    log.info("Training from files: {}", options.paths)
+    grammar = extract_grammar(trees_from_files(files_from_paths(options.paths)),
+        options.horizontal, options.vertical, options.min_count)
     with storage.GrammarWriter() as writer:
         writer.write(grammar)
 
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 
 from unittest import TestCase, main, skip
-from .common import Tree, PosTerminal, Rule, SplitTag
+from .common import Tree, PosTerminal, Rule, SplitTag, AnnotatedSymbol
 from .testutil import tree
 from glob import glob
 
 from .training import *
+from . import util
 
 TESTDATA_SIMPLE =  \
 """ ( (S
@@ -58,7 +59,48 @@ class TokenizeTest(TestCase):
         self.assertEqual(list(tokenize("a\nb")), ["a", "b"])
         self.assertEqual(list(tokenize("a\tb")), ["a", "b"])
 
+    def test_chunk_boundaries(self):
+        string = "(NP (DT the) (NN dog))\n(VP barks)"
+        for size in range(1, len(string) + 1):
+            self.assertEqual(list(tokenize(string, util.chunks(string, size))),
+                tokenize_all(string))
+
+
+def tokenize_all(string):
+    return TOKEN_REGEX.findall(string)
+
 class ParseTreebankTest(TestCase):
+    def test_file(self):
+        from io import StringIO
+        for size in (1, 7, util.CHUNK_SIZE):
+            file = StringIO(TESTDATA_SIMPLE * 3)
+            trees = list(parse_treebank(file, util.read_ahead(util.chunks(file, size))))
+            self.assertEqual(len(trees), 3)
+            self.assertEqual(treeset(trees), TESTDATA_EXPECTED)
+
+    def test_read_ahead_stopped_early(self):
+        import itertools, threading
+        threads = threading.active_count()
+        produced = []
+        def chunks():
+            for i in itertools.count():
+                produced.append(i)
+                yield "(S (A a))"
+        elements = util.read_ahead(chunks(), poll_interval=.01)
+        self.assertEqual(next(elements), "(S (A a))")
+        elements.close()
+        # The thread is gone, without reading more than it had queued
+        self.assertEqual(threading.active_count(), threads)
+        self.assertLessEqual(len(produced), 4)
+
+    def test_streaming(self):
+        def chunks():
+            yield "(S (A a))"
+            raise AssertionError("read past the first tree")
+        self.assertEqual(next(parse_treebank(None, chunks())),
+            Tree("S", Tree("A", Tree(PosTerminal("A")))))
+
+
     def test_trivial(self):
         string = "(S x)"
         expected = {Tree("S", Tree(PosTerminal("S"))).hashable()}
@@ -136,6 +178,40 @@ class ExtractGrammarTest(TestCase):
             }
         )
 
+class MarkovizationTest(TestCase):
+    def test_annotate_parents(self):
+        data = tree("S", tree("NP", tree("NN", "NN")),
+            tree("VP", tree("V", "V"), tree("NP", tree("NN", "NN"))))
+        annotated = annotate_parents(data, 2)
+        self.assertEqual(annotated.type_, "S")
+        np, vp = annotated.children
+        self.assertEqual(np.type_, AnnotatedSymbol("NP", ("S",)))
+        self.assertEqual(np.children[0].type_, "NN")
+        self.assertEqual(vp.type_, AnnotatedSymbol("VP", ("S",)))
+        self.assertEqual(vp.children[1].type_, AnnotatedSymbol("NP", ("VP",)))
+        self.assertEqual(vp.children[0].type_, "V")
+        self.assertEqual(annotate_parents(data, 3).children[1].children[1].type_,
+            AnnotatedSymbol("NP", ("VP", "S")))
+
+    def test_extract_grammar(self):
+        from .parser import parse_best
+        trees = list(parse_treebank(TESTDATA_SIMPLE))
+        text = [(str(tag), str(tag)) for tag in trees[0].terminals()]
+        plain = extract_grammar(trees)
+        for horizontal, vertical in [(0, 1), (1, 2), (2, 3)]:
+            grammar = extract_grammar(trees, horizontal, vertical)
+            if horizontal == 0:
+                self.assertLess(len(grammar.nonterminal_symbols), len(plain.nonterminal_symbols))
+            tree, score = parse_best(grammar, text, keep_posleafs=True)
+            self.assertEqual(tree.debinarized(), trees[0])
+
+    def test_min_count(self):
+        trees = list(parse_treebank("(S (A a) (B b)) (S (A a) (B b)) (S (A a))"))
+        grammar = extract_grammar(trees, min_count=2)
+        self.assertEqual(set(grammar.rules), {Rule("S", ("A", "B"), 1),
+            Rule("A", (PosTerminal("A"),), 1), Rule("B", (PosTerminal("B"),), 1)})
+
+
 @skip("Too slow")
 class MainTest(TestCase):
     def test_runs(self):
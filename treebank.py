@@ -0,0 +1,203 @@
+"""
+Column-oriented storage of many trees.
+"""
+
+from array import array
+from collections import deque
+from .common import Tree, Terminal
+from .util import empty
+
+
+class Treebank:
+    """
+    Trees stored as parallel arrays with one entry per node, instead of one
+    object per node. Nodes are numbered in preorder, tree after tree.
+
+    Attributes:
+        labels: the distinct node labels; label[i] indexes into them
+        label: label id of every node
+        parent: index of the parent of every node, -1 for roots
+        child_offsets, children: the children of node i are
+            children[child_offsets[i]:child_offsets[i+1]]
+        start, length: span of every node over the leaves of its tree,
+            start being 1-indexed like everywhere in the parser
+        tree_offsets: the nodes of tree t are tree_offsets[t] up to
+            tree_offsets[t+1]
+
+    Indexing and iterating give TreeNode views of the roots, which have the
+    traversal API of common.AbstractTree.
+    """
+    def __init__(self, trees=()):
+        self.labels = []
+        self._label_ids = {}
+        self.label = array("i")
+        self.parent = array("i")
+        self.child_offsets = array("i", [0])
+        self.children = array("i")
+        self.start = array("i")
+        self.length = array("i")
+        self.tree_offsets = array("i", [0])
+        self.extend(trees)
+
+    def _label_id(self, label):
+        label_id = self._label_ids.get(label)
+        if label_id is None:
+            label_id = self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return label_id
+
+    def append(self, tree):
+        """Add a tree with the type_ and children of common.AbstractTree"""
+        first = len(self.label)
+        # Preorder, with parents before their children
+        nodes = []
+        agenda = [(tree, -1)]
+        while not empty(agenda):
+            node, parent = agenda.pop()
+            index = first + len(nodes)
+            nodes.append(node)
+            self.label.append(self._label_id(node.type_))
+            self.parent.append(parent)
+            agenda.extend((child, index) for child in reversed(node.children))
+        child_indices = [[] for node in nodes]
+        for index in range(1, len(nodes)):
+            child_indices[self.parent[first + index] - first].append(first + index)
+        for indices in child_indices:
+            self.children.extend(indices)
+            self.child_offsets.append(len(self.children))
+        # Leaves are in preorder from left to right; spans are done bottom-up
+        starts = [0] * len(nodes)
+        lengths = [0] * len(nodes)
+        position = 1
+        for index, indices in enumerate(child_indices):
+            if empty(indices):
+                starts[index] = position
+                lengths[index] = 1
+                position += 1
+        for index in reversed(range(len(nodes))):
+            indices = child_indices[index]
+            if not empty(indices):
+                starts[index] = starts[indices[0] - first]
+                lengths[index] = sum(lengths[child - first] for child in indices)
+        self.start.extend(starts)
+        self.length.extend(lengths)
+        self.tree_offsets.append(len(self.label))
+
+    def extend(self, trees):
+        for tree in trees:
+            self.append(tree)
+
+    def __len__(self):
+        return len(self.tree_offsets) - 1
+
+    @property
+    def num_nodes(self):
+        return len(self.label)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return TreeNode(self, self.tree_offsets[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield TreeNode(self, self.tree_offsets[index])
+
+
+class TreeNode:
+    """A node of a Treebank, behaving like a common.AbstractTree"""
+    __slots__ = ("treebank", "index")
+
+    def __init__(self, treebank, index):
+        self.treebank = treebank
+        self.index = index
+
+    @property
+    def type_(self):
+        return self.treebank.labels[self.treebank.label[self.index]]
+
+    @property
+    def children(self):
+        treebank = self.treebank
+        return tuple(TreeNode(treebank, child) for child in treebank.children[
+            treebank.child_offsets[self.index]:treebank.child_offsets[self.index + 1]])
+
+    @property
+    def start(self):
+        return self.treebank.start[self.index]
+
+    @property
+    def length(self):
+        return self.treebank.length[self.index]
+
+    @property
+    def parent(self):
+        parent = self.treebank.parent[self.index]
+        return None if parent == -1 else TreeNode(self.treebank, parent)
+
+    def __eq__(self, other):
+        return tuple(self.children) == tuple(other.children) and self.type_ == other.type_
+
+    __hash__ = None
+
+    def __repr__(self):
+        return str.format("TreeNode({})", self.bracketed())
+
+    @property
+    def is_terminal(self):
+        return isinstance(self.type_, Terminal)
+
+    @property
+    def subtrees(self):
+        agenda = deque([self])
+        while not empty(agenda):
+            cur = agenda.pop()
+            yield cur
+            agenda.extend(cur.children)
+
+    def preterminals(self):
+        agenda = deque([self])
+        while not empty(agenda):
+            cur = agenda.pop()
+            children = cur.children
+            if len(children) == 1 and empty(children[0].children):
+                yield cur
+            else:
+                agenda.extend(reversed(children))
+
+    def terminals(self):
+        agenda = deque([self])
+        while not empty(agenda):
+            cur = agenda.pop()
+            children = cur.children
+            if empty(children):
+                yield cur.type_
+            else:
+                agenda.extend(reversed(children))
+
+    def is_equal_constituent(self, other):
+        return self.type_ == other.type_ and \
+            self.start == other._start and \
+            self.length == other._length
+
+    @property
+    def _start(self):
+        return self.start
+
+    @property
+    def _length(self):
+        return self.length
+
+    def bracketed(self):
+        children = self.children
+        if empty(children):
+            return str(self.type_)
+        return "(" + str(self.type_) + " " \
+            + " ".join(child.bracketed() for child in children) + ")"
+
+    def to_tree(self):
+        """The node and everything below it as a common.Tree"""
+        return Tree(self.type_, *(child.to_tree() for child in self.children),
+            start=self.start, length=self.length)
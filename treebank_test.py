@@ -0,0 +1,64 @@
+from unittest import TestCase
+from .treebank import *
+from .common import Tree, PosTerminal
+from .training import parse_treebank, count_rules
+from .training_test import TESTDATA_SIMPLE
+
+TREES = """
+( (S (NP (DT the) (NN dog)) (VP (VBZ barks))) )
+( (S (NP (PRP it)) (VP (VBZ sees) (NP (DT a) (NN cat)))) )
+"""
+
+class TestTreebank(TestCase):
+    def setUp(self):
+        self.trees = list(parse_treebank(TREES))
+        self.treebank = Treebank(parse_treebank(TREES))
+
+    def test_len(self):
+        self.assertEqual(len(self.treebank), 2)
+        self.assertEqual(self.treebank.num_nodes,
+            sum(len(list(tree.subtrees)) for tree in self.trees))
+
+    def test_equal(self):
+        for tree, node in zip(self.trees, self.treebank):
+            self.assertEqual(node, tree)
+            self.assertEqual(tree, node)
+            self.assertEqual(node.to_tree(), tree)
+        self.assertEqual(self.treebank[-1], self.trees[-1])
+        with self.assertRaises(IndexError):
+            self.treebank[2]
+
+    def test_arrays(self):
+        treebank = Treebank([Tree("S", Tree("A", Tree("a")), Tree("B"))])
+        self.assertEqual(treebank.labels, ["S", "A", "a", "B"])
+        self.assertEqual(list(treebank.label), [0, 1, 2, 3])
+        self.assertEqual(list(treebank.parent), [-1, 0, 1, 0])
+        self.assertEqual(list(treebank.child_offsets), [0, 2, 3, 3, 3])
+        self.assertEqual(list(treebank.children), [1, 3, 2])
+        self.assertEqual(list(treebank.start), [1, 1, 1, 2])
+        self.assertEqual(list(treebank.length), [2, 1, 1, 1])
+
+    def test_spans(self):
+        tree = self.treebank[1]
+        vp = tree.children[1]
+        self.assertEqual((vp.type_, vp.start, vp.length), ("VP", 2, 3))
+        self.assertEqual(vp.parent, tree)
+        self.assertIsNone(tree.parent)
+
+    def test_traversal(self):
+        for tree, node in zip(self.trees, self.treebank):
+            self.assertEqual([subtree.type_ for subtree in node.subtrees],
+                [subtree.type_ for subtree in tree.subtrees])
+            self.assertEqual(list(node.terminals()), list(tree.terminals()))
+            self.assertEqual(list(node.preterminals()), list(tree.preterminals()))
+            self.assertEqual(node.bracketed(), tree.bracketed())
+
+    def test_terminal(self):
+        leaf = next(iter(self.treebank[0].subtrees))
+        self.assertFalse(leaf.is_terminal)
+        self.assertTrue(all(isinstance(terminal, PosTerminal)
+            for terminal in self.treebank[0].terminals()))
+
+    def test_count_rules(self):
+        trees = list(parse_treebank(TESTDATA_SIMPLE))
+        self.assertEqual(count_rules(Treebank(trees)), count_rules(trees))
@@ -1,5 +1,12 @@
+import gc
+import itertools
+import threading
+from contextlib import contextmanager
+import queue
 from . import log
 
+CHUNK_SIZE = 1 << 16
+
 def empty(x):
     assert not isinstance(x, bool)
     return not x
@@ -8,13 +15,88 @@ def irange(start, end):
     """Intuitive range"""
     return range(start, end+1)
 
+def chunks(data, size=CHUNK_SIZE):
+    """
+    Yield the contents of a string or a file opened in text mode as
+    strings of at most size characters, without reading a file all at once
+    """
+    if isinstance(data, str):
+        for start in range(0, len(data), size):
+            yield data[start:start + size]
+        return
+    while True:
+        chunk = data.read(size)
+        if not chunk:
+            return
+        yield chunk
+
 def characters(data):
     """
     Returns a iterable containing all characters contained in a file
     or a string.
     """
-    # TODO: file support
-    return data
+    if isinstance(data, str):
+        return data
+    return itertools.chain.from_iterable(chunks(data))
+
+def read_ahead(iterable, depth=2, poll_interval=.1):
+    """
+    Iterate over iterable in a background thread, up to depth elements
+    ahead of the consumer, so that file reads overlap with processing them.
+
+    If the consumer stops early, the thread notices within poll_interval
+    seconds, stops iterating and is waited for, so a file being read can be
+    closed afterwards.
+    """
+    done = object()
+    elements = queue.Queue(depth)
+    stop = threading.Event()
+    def put(item):
+        while not stop.is_set():
+            try:
+                elements.put(item, timeout=poll_interval)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def produce():
+        try:
+            for element in iterable:
+                if not put((element, None)):
+                    return
+        except BaseException as error:
+            put((done, error))
+        else:
+            put((done, None))
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            element, error = elements.get()
+            if element is done:
+                if error is not None:
+                    raise error
+                return
+            yield element
+    finally:
+        # Also when the generator is closed or garbage collected early
+        stop.set()
+        thread.join()
+
+@contextmanager
+def gc_paused():
+    """
+    Pause the cyclic garbage collector, for building large structures
+    without reference cycles. Its full collections would visit every object
+    built so far over and over.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 class SelfClosingContextManager:
     def __enter__(self):
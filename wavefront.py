@@ -0,0 +1,103 @@
+"""
+Wavefront-parallel filling of dense charts.
+
+The cells of one span length only depend on shorter spans, so every span
+length is split across worker processes, one diagonal of the chart after
+the other. The chart lives in shared memory; only the coordinates of the
+cells to fill are sent to the workers. This lets a single long sentence use
+all cores, where parser.parse_many only parallelizes over sentences.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from .dense import as_dense_grammar, DenseChart, VITERBI, _fill_chart, _fill_cells
+from .util import SelfClosingContextManager
+
+# Set in every worker process by _init_worker
+_worker_grammar = None
+# Names, SharedMemory objects and arrays of the chart a worker is attached to
+_worker_chart = None
+
+def _init_worker(grammar):
+    global _worker_grammar
+    _worker_grammar = grammar
+
+def _attach(names, shape):
+    """Arrays of the chart in the shared memory blocks names, attached once per chart"""
+    global _worker_chart
+    if _worker_chart is None or _worker_chart[0] != names:
+        if _worker_chart is not None:
+            memories = _worker_chart[1]
+            # The arrays have to go before the memory they point into
+            _worker_chart = None
+            for memory in memories:
+                memory.close()
+        memories = tuple(shared_memory.SharedMemory(name) for name in names)
+        arrays = tuple(np.ndarray(shape, np.float64, buffer=memory.buf) for memory in memories)
+        _worker_chart = names, memories, arrays
+    return _worker_chart[2]
+
+def _fill_task(task):
+    names, shape, starts, length, mode, beam, threshold = task
+    scores, inner = _attach(names, shape)
+    _fill_cells(_worker_grammar, scores, inner, starts, length, mode, beam, threshold)
+
+
+class WavefrontPool(SelfClosingContextManager):
+    """
+    Worker processes filling dense charts of one grammar, see
+    dense.build_dense_chart. The grammar is sent to every worker once.
+
+    workers -- number of worker processes, default one per CPU
+    min_cells -- fewest cells given to a worker at a time. Short diagonals
+        aren't worth sending out and are filled in this process.
+    """
+    def __init__(self, grammar, workers=None, min_cells=8):
+        self.grammar = as_dense_grammar(grammar)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.min_cells = min_cells
+        # Workers started after the resource tracker share it, otherwise
+        # each starts its own, which doesn't see the blocks being unlinked
+        # here and unlinks them again when the worker exits.
+        resource_tracker.ensure_running()
+        self._pool = multiprocessing.Pool(self.workers, _init_worker, (self.grammar,))
+
+    def _chunks(self, starts):
+        count = min(self.workers, len(starts) // self.min_cells)
+        return np.array_split(starts, max(count, 1))
+
+    def build_chart(self, text, mode=VITERBI, beam=None, threshold=None):
+        """Like dense.build_dense_chart with this pool's grammar"""
+        shape = (len(text) + 1, len(text) + 1, self.grammar.num_symbols)
+        size = max(int(np.prod(shape)) * np.dtype(np.float64).itemsize, 1)
+        memories = [shared_memory.SharedMemory(create=True, size=size) for i in range(2)]
+        try:
+            return self._fill(memories, shape, text, mode, beam, threshold)
+        finally:
+            for memory in memories:
+                memory.close()
+                memory.unlink()
+
+    def _fill(self, memories, shape, text, mode, beam, threshold):
+        names = tuple(memory.name for memory in memories)
+        scores, inner = (np.ndarray(shape, np.float64, buffer=memory.buf) for memory in memories)
+        scores.fill(-np.inf)
+        inner.fill(-np.inf)
+        chart = DenseChart(self.grammar, text, mode, scores, inner)
+        def fill_cells(grammar, scores, inner, starts, length, mode, beam, threshold):
+            chunks = self._chunks(starts)
+            if len(chunks) == 1:
+                _fill_cells(grammar, scores, inner, starts, length, mode, beam, threshold)
+            else:
+                self._pool.map(_fill_task, [(names, shape, chunk, length, mode, beam, threshold)
+                    for chunk in chunks])
+        _fill_chart(chart, beam, threshold, fill_cells)
+        # Copied out of the shared memory, which is released once filled
+        chart.scores = scores.copy()
+        chart.inner = inner.copy()
+        return chart
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -0,0 +1,44 @@
+from unittest import TestCase, skipIf
+from .testutil import pp_grammar, pp_sentence
+try:
+    import numpy
+    from .dense import DenseGrammar, build_dense_chart, parse_best, INSIDE
+    from .wavefront import WavefrontPool
+except ImportError:
+    numpy = None
+
+@skipIf(numpy is None, "numpy is not installed")
+class TestWavefrontPool(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.grammar = DenseGrammar(pp_grammar)
+        cls.pool = WavefrontPool(cls.grammar, workers=2, min_cells=2)
+        cls.sentence = pp_sentence + [("with", "P"), ("a", "Det"), ("fork", "N")] * 4
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def assertSameChart(self, **kwargs):
+        expected = build_dense_chart(self.grammar, self.sentence, **kwargs)
+        found = build_dense_chart(self.grammar, self.sentence, pool=self.pool, **kwargs)
+        numpy.testing.assert_array_equal(found.scores, expected.scores)
+        numpy.testing.assert_array_equal(found.inner, expected.inner)
+
+    def test_viterbi(self):
+        self.assertSameChart()
+
+    def test_inside(self):
+        self.assertSameChart(mode=INSIDE)
+
+    def test_pruning(self):
+        self.assertSameChart(beam=1)
+
+    def test_parse_best(self):
+        self.assertEqual(parse_best(self.grammar, self.sentence, pool=self.pool),
+            parse_best(self.grammar, self.sentence))
+        self.assertIsNone(parse_best(self.grammar, [("fish", "N")], pool=self.pool))
+
+    def test_chunks(self):
+        self.assertEqual([len(chunk) for chunk in self.pool._chunks(numpy.arange(1, 6))], [3, 2])
+        self.assertEqual(len(self.pool._chunks(numpy.arange(1, 2))), 1)